@@ -0,0 +1,57 @@
+"""Compare per-allocation latency of services.allocate and AllocationEngine.
+
+Runs against a throwaway sqlite file: services.allocate loads and commits
+the product for every line, while the engine allocates in memory and writes
+the lines behind.
+
+    python benchmarks/allocation_engine.py
+"""
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from allocation.adapters.orm import metadata, start_mappers
+from allocation.service_layer import services, unit_of_work
+from allocation.service_layer.allocation_engine import AllocationEngine
+
+BATCHES = [1, 100]
+ALLOCATIONS = 2000
+
+
+def run(allocate, sku: str) -> float:
+    started = time.perf_counter()
+    for i in range(ALLOCATIONS):
+        allocate(f"order-{sku}-{i}", sku, 1)
+    return (time.perf_counter() - started) / ALLOCATIONS
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{Path(directory) / 'bench.db'}")
+        metadata.create_all(engine)
+        start_mappers()
+        uow = partial(unit_of_work.SqlAlchemyUnitOfWork, sessionmaker(bind=engine))
+
+        print(f"{'batches':>8} {'service':>12} {'engine':>12} {'speedup':>9}")
+        for size in BATCHES:
+            for sku in (f"SERVICE-{size}", f"ENGINE-{size}"):
+                for i in range(size):
+                    services.add_batch(f"{sku}-{i}", sku, ALLOCATIONS, None, uow())
+
+            before = run(lambda o, s, q: services.allocate(o, s, q, uow()), f"SERVICE-{size}")
+            allocation_engine = AllocationEngine(uow, flush_interval=0.05)
+            allocation_engine.start([f"ENGINE-{size}"])
+            after = run(allocation_engine.allocate, f"ENGINE-{size}")
+            allocation_engine.stop()
+            print(
+                f"{size:>8} {before * 1e6:>9.1f} us {after * 1e6:>9.1f} us"
+                f" {before / after:>8.0f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Compare planning a large set of lines against Product.allocate in a loop.
+
+Lines spread evenly over the SKUs, then two skewed cases: most lines on one
+hot SKU, and one SKU with far more batches than the others.
+
+    python benchmarks/allocation_planner.py
+"""
+import copy
+import random
+import time
+from datetime import date, timedelta
+
+from allocation.domain.model import Batch, OrderLine, OutOfStock, Product
+from allocation.domain.planner import plan_allocations
+
+SKUS = 2_000
+BATCHES_PER_SKU = 20
+LINES = [100_000, 1_000_000]
+
+
+def make_products(rng: random.Random, wide_batches: int = BATCHES_PER_SKU) -> list:
+    start = date(2023, 1, 1)
+    return [
+        Product(
+            f"SKU-{s}",
+            [
+                Batch(f"SKU-{s}-{b}", f"SKU-{s}", rng.randint(50, 5000), start + timedelta(days=b))
+                for b in range(wide_batches if s == 0 else BATCHES_PER_SKU)
+            ],
+        )
+        for s in range(SKUS)
+    ]
+
+
+def even_skus(rng: random.Random) -> str:
+    return f"SKU-{rng.randrange(SKUS)}"
+
+
+def one_hot_sku(rng: random.Random) -> str:
+    return "SKU-0" if rng.random() < 0.9 else even_skus(rng)
+
+
+def one_by_one(lines, products) -> list:
+    products = {p.sku: p for p in products}
+    results = []
+    for line in lines:
+        try:
+            results.append(products[line.sku].allocate(line))
+        except OutOfStock as e:
+            results.append(e)
+    return results
+
+
+def compare(label: str, products: list, sizes: list, pick_sku, rng: random.Random):
+    for size in sizes:
+        lines = [
+            OrderLine(f"order-{i}", pick_sku(rng), rng.randint(1, 20)) for i in range(size)
+        ]
+        copies = copy.deepcopy(products)
+        started = time.perf_counter()
+        one_by_one(lines, copies)
+        before = time.perf_counter() - started
+
+        started = time.perf_counter()
+        plan_allocations(lines, products)
+        after = time.perf_counter() - started
+        print(
+            f"{label:<22} {size:>10} {before:>15.2f} s {after:>8.2f} s {before / after:>8.1f}x"
+        )
+
+
+def main():
+    rng = random.Random(1)
+    products = make_products(rng)
+    print(f"{'case':<22} {'lines':>10} {'Product.allocate':>17} {'planner':>10} {'speedup':>9}")
+    compare("even", products, LINES, even_skus, rng)
+    compare("90% on one sku", products, [200_000], one_hot_sku, rng)
+    wide = make_products(rng, wide_batches=20_000)
+    compare("one sku, 20k batches", wide, [200_000], even_skus, rng)
+
+
+if __name__ == "__main__":
+    main()
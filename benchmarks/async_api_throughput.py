@@ -0,0 +1,118 @@
+"""Compare request throughput of the Flask app against the ASGI app.
+
+Starts each app as a server on the configured Postgres, seeds products and
+an asset, then posts /allocate and /position with many requests in flight.
+The position cache is switched off in the servers, so every request waits
+on the database.
+
+    python benchmarks/async_api_throughput.py --requests 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+SERVERS = {
+    "flask": ["flask", "--app", "allocation.entrypoints.flask_app", "run", "--with-threads"],
+    "asgi": ["uvicorn", "allocation.entrypoints.asgi_app:app", "--log-level", "warning"],
+}
+PORTS = {"flask": 5105, "asgi": 5106}
+SKUS = 256
+
+
+def start(name: str) -> subprocess.Popen:
+    command = SERVERS[name] + ["--port", str(PORTS[name])]
+    env = {**os.environ, "POSITION_CACHE_TTL": "0"}
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_until_up(url: str):
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            return httpx.get(url)
+        except httpx.TransportError:
+            time.sleep(0.2)
+    sys.exit(f"{url} never came up")
+
+
+def seed(flask_url: str) -> tuple:
+    run = uuid.uuid4().hex[:6]
+    skus = [f"bench-{run}-{i}" for i in range(SKUS)]
+    for sku in skus:
+        httpx.post(
+            f"{flask_url}/add_batch",
+            json={"ref": f"{sku}-batch", "sku": sku, "qty": 10 ** 9, "eta": None},
+        ).raise_for_status()
+    symbol = f"BENCH{run}".upper()
+    httpx.post(f"{flask_url}/add_asset", json={"symbol": symbol, "source": "bench"})
+    httpx.post(
+        f"{flask_url}/allocate_tracker",
+        json={"symbol": symbol, "datetime_t": "2023-01-01T00:00:00", "position": 1},
+    ).raise_for_status()
+    return skus, symbol
+
+
+async def load(url: str, requests: int, concurrency: int, payload) -> float:
+    """Requests per second for `requests` POSTs, at most `concurrency` in flight."""
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+
+        async def worker():
+            while not queue.empty():
+                path, body = payload(queue.get_nowait())
+                response = await client.post(f"{url}{path}", json=body)
+                assert response.status_code == 201, response.text
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return requests / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    servers = {name: start(name) for name in SERVERS}
+    try:
+        urls = {name: f"http://127.0.0.1:{port}" for name, port in PORTS.items()}
+        for url in urls.values():
+            wait_until_up(url)
+        skus, symbol = seed(urls["flask"])
+        payloads = {
+            "/allocate": lambda i: (
+                "/allocate",
+                {"orderid": f"order-{uuid.uuid4().hex}", "sku": skus[i % SKUS], "qty": 1},
+            ),
+            "/position": lambda i: ("/position", {"symbol": symbol}),
+        }
+
+        print(f"{'endpoint':>10} {'flask':>12} {'asgi':>12} {'speedup':>9}")
+        for endpoint, payload in payloads.items():
+            rates = {
+                name: asyncio.run(load(url, args.requests, args.concurrency, payload))
+                for name, url in urls.items()
+            }
+            print(
+                f"{endpoint:>10} {rates['flask']:>8.0f} r/s {rates['asgi']:>8.0f} r/s"
+                f" {rates['asgi'] / rates['flask']:>8.1f}x"
+            )
+    finally:
+        for server in servers.values():
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
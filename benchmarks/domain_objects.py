@@ -0,0 +1,60 @@
+"""Bytes per object and construction throughput of the domain value types.
+
+OrderLine, Tracker and Batch are measured before and after
+orm.start_mappers(), since a mapped class gives every instance a __dict__
+and SQLAlchemy instance state. They are compared with the dicts the bulk
+paths used before and with LineRecord and TrackerRecord, which those paths
+use now: slotted dataclasses that are never mapped, so they carry neither.
+
+    python benchmarks/domain_objects.py
+"""
+import gc
+import time
+import tracemalloc
+from datetime import datetime
+
+from allocation.adapters import orm
+from allocation.domain.model import Batch, LineRecord, OrderLine
+from allocation.domain.tracker import Tracker, TrackerRecord
+
+N = 200_000
+NOW = datetime(2023, 3, 12, 16)
+
+FACTORIES = {
+    "OrderLine": lambda i: OrderLine("order", "SKU", i),
+    "LineRecord": lambda i: LineRecord("order", "SKU", i),
+    "Tracker": lambda i: Tracker("BTCUSDT", NOW, i, NOW),
+    "TrackerRecord": lambda i: TrackerRecord("BTCUSDT", NOW, i, NOW),
+    "tracker dict": lambda i: {"symbol": "BTCUSDT", "datetime_t": NOW, "position": i, "created_at": NOW},
+    "Batch": lambda i: Batch("batch", "SKU", i, None),
+}
+
+
+def measure(factory) -> tuple:
+    # the same small int for every object, so only the object itself counts
+    gc.collect()
+    tracemalloc.start()
+    objects = [factory(1) for _ in range(N)]
+    size = tracemalloc.get_traced_memory()[0] / N - 8  # minus the list slot
+    tracemalloc.stop()
+    del objects
+
+    started = time.perf_counter()
+    objects = [factory(i) for i in range(N)]
+    rate = N / (time.perf_counter() - started)
+    return size, rate
+
+
+def main():
+    results = {name: measure(factory) for name, factory in FACTORIES.items()}
+    orm.start_mappers()
+    for name in ("OrderLine", "Tracker", "Batch"):
+        results[f"{name} (mapped)"] = measure(FACTORIES[name])
+
+    print(f"{'type':>20} {'bytes/object':>13} {'objects/s':>12}")
+    for name, (size, rate) in results.items():
+        print(f"{name:>20} {size:>13.0f} {rate:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
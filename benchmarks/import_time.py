@@ -0,0 +1,87 @@
+"""Measure what a cold worker pays to import the entrypoints and build the app.
+
+Each module is imported in a fresh interpreter under `python -X importtime`,
+several times, and the median cumulative import time is reported, followed
+by the modules that cost the most on their own when importing flask_app.
+Start-up is the import plus the first create_app().
+
+    python benchmarks/import_time.py --runs 7
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+MODULES = [
+    "allocation.config",
+    "allocation.service_layer.unit_of_work",
+    "allocation.service_layer.services",
+    "allocation.entrypoints.flask_app",
+    "allocation.entrypoints.asgi_app",
+]
+STARTUP = """
+import time
+started = time.perf_counter()
+from allocation.entrypoints import flask_app
+flask_app.create_app()
+print(time.perf_counter() - started)
+"""
+
+
+def import_times(module: str) -> Dict[str, Tuple[int, int]]:
+    """(self, cumulative) microseconds per module imported by `import module`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True, env=os.environ,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(own), int(cumulative)
+    return times
+
+
+def startup_seconds() -> float:
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP], capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'module':<42} {'import ms':>10}")
+    own_by_module = defaultdict(list)  # type: Dict[str, List[int]]
+    for module in MODULES:
+        cumulative = []
+        for _ in range(args.runs):
+            times = import_times(module)
+            cumulative.append(times[module][1])
+            if module == "allocation.entrypoints.flask_app":
+                for name, (own, _) in times.items():
+                    own_by_module[name].append(own)
+        print(f"{module:<42} {statistics.median(cumulative) / 1000:>10.1f}")
+
+    try:
+        startup = statistics.median(startup_seconds() for _ in range(args.runs))
+        print(f"{'import flask_app + create_app()':<42} {startup * 1000:>10.1f}")
+    except subprocess.CalledProcessError as e:
+        print(f"start-up failed: {e.stderr.strip().splitlines()[-1]}")
+
+    print(f"\nslowest modules under flask_app, by their own import time")
+    slowest = sorted(own_by_module.items(), key=lambda item: -statistics.median(item[1]))
+    for name, owns in slowest[: args.top]:
+        print(f"{name.strip():<42} {statistics.median(owns) / 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
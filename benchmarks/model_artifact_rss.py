@@ -0,0 +1,107 @@
+"""Compare per-process memory of reading model weights against mapping them.
+
+Writes a synthetic `.npy` artifact, then starts several worker processes
+that each load it through a ModelRegistry and touch every weight, like
+gunicorn workers serving predictions. Each worker reports its RSS before
+and after loading. Linux only; figures come from /proc/self/status and
+/proc/self/smaps_rollup.
+
+RSS counts a shared page in every process that maps it. PSS splits it
+between them, so its total across workers shows what the host really pays.
+
+    python benchmarks/model_artifact_rss.py --megabytes 256 --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+
+import numpy as np
+
+from allocation.service_layer.model_registry import ModelRegistry, load_artifact
+
+LOADERS = {
+    "read": np.load,
+    "mmap": load_artifact,
+}
+
+
+def memory_kb() -> dict:
+    """RSS, its anonymous (heap) part and PSS of this process, in kB."""
+    figures = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "RssAnon"):
+                figures[name] = int(value.split()[0])
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name == "Pss":
+                figures[name] = int(value.split()[0])
+    return figures
+
+
+def worker(loader_name: str, filepath: str, loaded, done, results):
+    before = memory_kb()
+    registry = ModelRegistry(uow_factory=None, loader=LOADERS[loader_name])
+    weights = registry.load(filepath)
+    # a prediction reads every weight
+    float(np.asarray(weights).sum())
+    # measure while every worker holds its weights, so PSS is shared out
+    loaded.wait()
+    results.put((before, memory_kb()))
+    done.wait()
+
+
+def mean(figures: list, name: str) -> int:
+    return sum(f[name] for f in figures) // len(figures)
+
+
+def run(loader_name: str, filepath: str, workers: int) -> list:
+    context = multiprocessing.get_context("spawn")
+    loaded, done = context.Barrier(workers + 1), context.Barrier(workers + 1)
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(loader_name, filepath, loaded, done, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    loaded.wait()
+    reports = [results.get() for _ in processes]
+    done.wait()
+    for process in processes:
+        process.join()
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megabytes", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filepath = os.path.join(directory, "weights.npy")
+        count = args.megabytes * 1024 * 1024 // 4
+        np.save(filepath, np.random.default_rng(0).random(count, dtype=np.float32))
+
+        print(f"{args.megabytes} MB of weights, {args.workers} workers, kB per worker")
+        print(
+            f"{'loader':>6} {'rss before':>11} {'rss after':>11} {'heap after':>11}"
+            f" {'pss after':>11} {'total pss':>11}"
+        )
+        for loader_name in LOADERS:
+            reports = run(loader_name, filepath, args.workers)
+            befores = [before for before, _ in reports]
+            afters = [after for _, after in reports]
+            print(
+                f"{loader_name:>6} {mean(befores, 'VmRSS'):>11} {mean(afters, 'VmRSS'):>11}"
+                f" {mean(afters, 'RssAnon'):>11} {mean(afters, 'Pss'):>11}"
+                f" {sum(after['Pss'] for after in afters):>11}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Compare Product.allocate against the old sort-and-scan batch selection.
+
+Every batch holds room for exactly one line, so each allocation has to get
+past all the batches that were filled before it.
+
+    python benchmarks/product_allocate.py
+"""
+import time
+from datetime import date, timedelta
+
+from allocation.domain.model import Batch, OrderLine, OutOfStock, Product
+
+SIZES = [10, 1_000, 100_000]
+ALLOCATIONS = 100
+
+
+def sort_and_scan(product: Product, line: OrderLine) -> str:
+    try:
+        batch = next(b for b in sorted(product.batches) if b.can_allocate(line))
+        batch.allocate(line)
+        product.version_number += 1
+        return batch.reference
+    except StopIteration:
+        raise OutOfStock(f"Out of stock for sku {line.sku}")
+
+
+def indexed(product: Product, line: OrderLine) -> str:
+    return product.allocate(line)
+
+
+def make_product(size: int) -> Product:
+    start = date(2023, 1, 1)
+    batches = [
+        Batch(f"batch-{i}", "BENCH-SKU", 10, eta=start + timedelta(days=i % 3650))
+        for i in reversed(range(size))
+    ]
+    return Product("BENCH-SKU", batches)
+
+
+def run(allocate, size: int) -> float:
+    product = make_product(size)
+    lines = [OrderLine(f"order-{i}", "BENCH-SKU", 10) for i in range(min(size, ALLOCATIONS))]
+    started = time.perf_counter()
+    for line in lines:
+        allocate(product, line)
+    return (time.perf_counter() - started) / len(lines)
+
+
+def main():
+    print(f"{'batches':>10} {'sort+scan':>14} {'indexed':>14} {'speedup':>9}")
+    for size in SIZES:
+        before = run(sort_and_scan, size)
+        after = run(indexed, size)
+        print(
+            f"{size:>10} {before * 1e6:>11.1f} us {after * 1e6:>11.1f} us"
+            f" {before / after:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
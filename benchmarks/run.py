@@ -0,0 +1,284 @@
+"""Benchmark the allocation and tracker hot paths and save the results as JSON.
+
+Three suites, each run in this process:
+
+    domain    Product.allocate and Batch.can_allocate at several sizes
+    services  services.allocate and allocate_tracker on in-memory SQLite,
+              through the real mappers and unit of work
+    flask     the same endpoints of flask_app through its test client
+
+Every benchmark is repeated and reports the best and median time per
+operation. Inputs are seeded, so runs on one machine are comparable between
+commits:
+
+    python benchmarks/run.py --output before.json
+    git checkout other-branch
+    python benchmarks/run.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from allocation.adapters import orm
+from allocation.domain.model import Batch, OrderLine, Product
+
+Run = Callable[[], int]  # does the timed work and returns how many operations it did
+
+SUITES = ("domain", "services", "flask")
+
+
+class Runner:
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        self.results = []  # type: List[dict]
+
+    def bench(self, name: str, params: Dict[str, int], setup: Callable[[], Run]):
+        """Time `setup()`'s run `repeat` times; setup itself is not timed."""
+        per_op = []
+        for _ in range(self.repeat):
+            run = setup()
+            started = time.perf_counter()
+            ops = run()
+            per_op.append((time.perf_counter() - started) / ops)
+        result = {
+            "name": name,
+            "params": params,
+            "ops": ops,
+            "repeat": self.repeat,
+            "best_s": min(per_op),
+            "median_s": statistics.median(per_op),
+        }
+        self.results.append(result)
+        print(f"{key(result):<55} {result['best_s'] * 1e6:>12.2f} us/op")
+
+
+def key(result: dict) -> str:
+    params = ",".join(f"{k}={v}" for k, v in result["params"].items())
+    return f"{result['name']}[{params}]"
+
+
+def domain_suite(runner: Runner):
+    rng = random.Random(0)
+    start = date(2023, 1, 1)
+
+    for batches in (10, 100, 1_000):
+        for lines in (1_000, 10_000):
+
+            def setup(batches=batches, lines=lines):
+                product = Product(
+                    "SKU",
+                    [
+                        Batch(f"b{i}", "SKU", 10 ** 9, start + timedelta(days=rng.randrange(365)))
+                        for i in range(batches)
+                    ],
+                )
+                order_lines = [OrderLine(f"o{i}", "SKU", rng.randint(1, 10)) for i in range(lines)]
+
+                def run():
+                    for line in order_lines:
+                        product.allocate(line)
+                    return lines
+
+                return run
+
+            runner.bench("product_allocate", {"batches": batches, "lines": lines}, setup)
+
+    for allocated in (0, 1_000, 10_000):
+
+        def setup(allocated=allocated):
+            batch = Batch("b1", "SKU", 10 ** 9, None)
+            for i in range(allocated):
+                batch.allocate(OrderLine(f"held{i}", "SKU", 1))
+            order_lines = [OrderLine(f"o{i}", "SKU", rng.randint(1, 10)) for i in range(10_000)]
+
+            def run():
+                for line in order_lines:
+                    batch.can_allocate(line)
+                return len(order_lines)
+
+            return run
+
+        runner.bench("batch_can_allocate", {"allocated": allocated}, setup)
+
+
+def sqlite_engine():
+    # one shared connection, so every session sees the same in-memory database
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    orm.metadata.create_all(engine)
+    return engine
+
+
+def services_suite(runner: Runner, calls: int):
+    from allocation.service_layer import services, unit_of_work
+
+    orm.start_mappers()
+
+    for batches in (1, 10, 100):
+
+        def setup(batches=batches):
+            session_factory = sessionmaker(bind=sqlite_engine())
+            uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+            for i in range(batches):
+                services.add_batch(f"b{i}", "SKU", 10 ** 9, date(2023, 1, 1 + i % 28), uow)
+
+            def run():
+                for i in range(calls):
+                    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+                    services.allocate(f"o{i}", "SKU", 1, uow)
+                return calls
+
+            return run
+
+        runner.bench("services_allocate", {"batches": batches, "calls": calls}, setup)
+
+    def setup():
+        session_factory = sessionmaker(bind=sqlite_engine())
+        services.add_asset("BTCUSDT", "binance", unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+        first = datetime(2023, 1, 1)
+
+        def run():
+            for i in range(calls):
+                services.allocate_tracker(
+                    "BTCUSDT",
+                    first + timedelta(minutes=i),
+                    i % 3 - 1,
+                    unit_of_work.SqlAlchemyUnitOfWork(session_factory),
+                )
+            return calls
+
+        return run
+
+    runner.bench("services_allocate_tracker", {"calls": calls}, setup)
+
+
+def flask_suite(runner: Runner, calls: int):
+    from allocation.entrypoints import flask_app
+
+    def client():
+        return flask_app.create_app(sessionmaker(bind=sqlite_engine())).test_client()
+
+    def setup():
+        test_client = client()
+        test_client.post("/add_batch", json={"ref": "b1", "sku": "SKU", "qty": 10 ** 9, "eta": None})
+
+        def run():
+            for i in range(calls):
+                line = {"orderid": f"o{i}", "sku": "SKU", "qty": 1}
+                response = test_client.post("/allocate", json=line)
+                assert response.status_code == 201, response.get_data(as_text=True)
+            return calls
+
+        return run
+
+    runner.bench("flask_allocate", {"calls": calls}, setup)
+
+    def setup():
+        test_client = client()
+        test_client.post("/add_asset", json={"symbol": "BTCUSDT", "source": "binance"})
+        first = datetime(2023, 1, 1)
+
+        def run():
+            for i in range(calls):
+                response = test_client.post(
+                    "/allocate_tracker",
+                    json={
+                        "symbol": "BTCUSDT",
+                        "datetime_t": (first + timedelta(minutes=i)).isoformat(),
+                        "position": i % 3 - 1,
+                    },
+                )
+                assert response.status_code == 201, response.get_data(as_text=True)
+            return calls
+
+        return run
+
+    runner.bench("flask_allocate_tracker", {"calls": calls}, setup)
+
+    def setup():
+        test_client = client()
+        test_client.post("/add_asset", json={"symbol": "BTCUSDT", "source": "binance"})
+        test_client.post(
+            "/allocate_tracker",
+            json={"symbol": "BTCUSDT", "datetime_t": "2023-01-01T00:00:00", "position": 1},
+        )
+
+        def run():
+            for _ in range(calls):
+                response = test_client.post("/position", json={"symbol": "BTCUSDT"})
+                assert response.status_code == 201, response.get_data(as_text=True)
+            return calls
+
+        return run
+
+    runner.bench("flask_position", {"calls": calls}, setup)
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def compare(results: List[dict], baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = {key(result): result for result in json.load(f)["results"]}
+    print(f"\n{'benchmark':<55} {'before':>10} {'after':>10} {'change':>8}")
+    for result in results:
+        before = baseline.get(key(result))
+        if before is None:
+            continue
+        change = result["best_s"] / before["best_s"] - 1
+        print(
+            f"{key(result):<55} {before['best_s'] * 1e6:>10.2f} {result['best_s'] * 1e6:>10.2f}"
+            f" {change:>+8.1%}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--suite", choices=SUITES, action="append", help="default: all")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--calls", type=int, default=200, help="requests per service/flask run")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", metavar="BASELINE_JSON")
+    args = parser.parse_args()
+
+    runner = Runner(args.repeat)
+    suites = args.suite or SUITES
+    if "domain" in suites:
+        domain_suite(runner)
+    if "services" in suites:
+        services_suite(runner, args.calls)
+    if "flask" in suites:
+        flask_suite(runner, args.calls)
+
+    with open(args.output, "w") as f:
+        json.dump({**environment(), "results": runner.results}, f, indent=2)
+    print(f"saved {len(runner.results)} results to {args.output}")
+    if args.compare:
+        compare(runner.results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Allocate many trackers of one symbol to an asset, with the old and new Tracker hash.
+
+The old hash only used the symbol, so every tracker of an asset collided
+and each set insert compared against all the trackers before it.
+
+    python benchmarks/tracker_hash.py
+"""
+import time
+
+from allocation.domain.asset import Asset
+from allocation.domain.tracker import Tracker
+
+SIZES = [1_000, 2_000, 4_000, 8_000, 1_000_000]
+# the symbol-only hash is quadratic; past this it takes minutes
+LEGACY_LIMIT = 8_000
+
+
+class SymbolHashedTracker(Tracker):
+    def __hash__(self):
+        return hash(self.symbol)
+
+
+def run(tracker_class, size: int) -> float:
+    asset = Asset("BTCUSDT", "binance")
+    trackers = [tracker_class("BTCUSDT", f"t{i}", i % 3 - 1) for i in range(size)]
+    started = time.perf_counter()
+    for tracker in trackers:
+        asset.allocate_tracker(tracker)
+    for tracker in trackers[::10]:
+        asset.deallocate(tracker)
+    return time.perf_counter() - started
+
+
+def main():
+    print(f"{'trackers':>10} {'symbol hash':>14} {'field hash':>14}")
+    for size in SIZES:
+        before = f"{run(SymbolHashedTracker, size):>12.3f} s" if size <= LEGACY_LIMIT else f"{'-':>14}"
+        after = run(Tracker, size)
+        print(f"{size:>10} {before} {after:>12.3f} s")
+
+
+if __name__ == "__main__":
+    main()
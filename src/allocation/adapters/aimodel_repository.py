@@ -1,7 +1,26 @@
 import abc
+from typing import Optional
+
+from sqlalchemy import select
+
 from allocation.domain.aimodel import AIModel
+from allocation.adapters import orm
 from allocation.adapters.repository import AbstractBaseRepository
 
+
+def best_model_query(symbol: str, ai_type: str):
+    # walks ix_aimodels_symbol_ai_type_accuracy_score backwards and stops at
+    # one row; models without a score never win
+    aimodels = orm.aimodels.c
+    return (
+        select(AIModel)
+        .filter_by(symbol=symbol, ai_type=ai_type)
+        .filter(aimodels.accuracy_score.isnot(None))
+        .order_by(aimodels.accuracy_score.desc())
+        .limit(1)
+    )
+
+
 class AbstractAIModelRepository(AbstractBaseRepository):
     @abc.abstractmethod
     def add(self, aimodel: AIModel):
@@ -10,6 +29,10 @@ class AbstractAIModelRepository(AbstractBaseRepository):
     @abc.abstractmethod
     def get(self, symbol) -> AIModel:
         raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_best(self, symbol, ai_type) -> Optional[AIModel]:
+        raise NotImplementedError
     
 class AIModelRepository(AbstractAIModelRepository):
     def __init__(self, session):
@@ -20,6 +43,9 @@ class AIModelRepository(AbstractAIModelRepository):
 
     def get(self, symbol):
         return self.session.query(AIModel).filter_by(symbol=symbol).first()
+
+    def get_best(self, symbol, ai_type):
+        return self.session.execute(best_model_query(symbol, ai_type)).scalars().first()
     
     def list(self):
-        return self.session.query(AIModel).all()
\ No newline at end of file
+        return self.session.query(AIModel).all()
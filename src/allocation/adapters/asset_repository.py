@@ -1,25 +1,57 @@
 import abc
+from typing import Dict, Set
+
+from sqlalchemy import select
+
 from allocation.domain.asset import Asset
+from allocation.adapters import orm
 from allocation.adapters.repository import AbstractBaseRepository
 
+def asset_query(symbol: str):
+    return select(Asset).filter_by(symbol=symbol)
+
+
 class AbstractAssetRepository(AbstractBaseRepository):
-    @abc.abstractmethod
+    def __init__(self):
+        self.seen = set()  # type: Set[Asset]
+
     def add(self, asset: Asset):
+        self._add(asset)
+        self.seen.add(asset)
+
+    def get(self, symbol) -> Asset:
+        asset = self._get(symbol)
+        if asset is not None:
+            self.seen.add(asset)
+        return asset
+
+    @abc.abstractmethod
+    def _add(self, asset: Asset):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def get(self, symbol) -> Asset:
+    def _get(self, symbol) -> Asset:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def symbol_ids(self) -> Dict[str, int]:
         raise NotImplementedError
     
 class AssetRepository(AbstractAssetRepository):
     def __init__(self, session):
+        super().__init__()
         self.session = session
 
-    def add(self, asset):
+    def _add(self, asset):
         self.session.add(asset)
 
-    def get(self, symbol):
-        return self.session.query(Asset).filter_by(symbol=symbol).first()
+    def _get(self, symbol):
+        return self.session.execute(asset_query(symbol)).scalars().first()
+
+    def symbol_ids(self):
+        # two columns per asset, without loading assets or their trackers
+        rows = self.session.execute(select(orm.assets.c.symbol, orm.assets.c.id))
+        return dict(rows.all())
     
     def list(self):
         return self.session.query(Asset).all()
\ No newline at end of file
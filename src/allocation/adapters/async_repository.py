@@ -0,0 +1,60 @@
+"""Repositories for an AsyncSession.
+
+They build the same SELECTs as the synchronous repositories. Nothing may
+lazy-load under asyncio, so products always come back with their batches and
+allocations loaded, and only the queries the async entrypoint needs are here.
+"""
+from typing import Optional, Set
+
+from allocation.adapters.asset_repository import asset_query
+from allocation.adapters.repository import product_query
+from allocation.adapters.tracker_repository import latest_tracker_query
+from allocation.domain import model
+from allocation.domain.asset import Asset
+from allocation.domain.tracker import Tracker
+
+
+class AsyncSqlAlchemyRepository:
+    def __init__(self, session):
+        self.session = session
+        self.seen = set()  # type: Set[model.Product]
+
+    def add(self, product: model.Product):
+        self.session.add(product)
+        self.seen.add(product)
+
+    async def get(self, sku) -> Optional[model.Product]:
+        result = await self.session.execute(product_query(sku, "selectin"))
+        product = result.scalars().first()
+        if product is not None:
+            self.seen.add(product)
+        return product
+
+
+class AsyncAssetRepository:
+    def __init__(self, session):
+        self.session = session
+        self.seen = set()  # type: Set[Asset]
+
+    def add(self, asset: Asset):
+        self.session.add(asset)
+        self.seen.add(asset)
+
+    async def get(self, symbol) -> Optional[Asset]:
+        result = await self.session.execute(asset_query(symbol))
+        asset = result.scalars().first()
+        if asset is not None:
+            self.seen.add(asset)
+        return asset
+
+
+class AsyncTrackerRepository:
+    def __init__(self, session):
+        self.session = session
+
+    def add(self, tracker: Tracker):
+        self.session.add(tracker)
+
+    async def get_latest(self, symbol) -> Optional[Tracker]:
+        result = await self.session.execute(latest_tracker_query(symbol))
+        return result.scalars().first()
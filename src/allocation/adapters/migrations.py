@@ -0,0 +1,80 @@
+"""Schema changes for databases created before the current orm tables.
+
+    python -m allocation.adapters.migrations
+"""
+from sqlalchemy import String, bindparam, select, text, update
+
+from allocation.adapters import orm
+from allocation.domain.tracker import parse_timestamp
+
+POSTGRES_TRACKER_TIMESTAMPS = [
+    # strings without an offset are read as UTC
+    "SET LOCAL TIME ZONE 'UTC'",
+    "ALTER TABLE trackers ALTER COLUMN datetime_t TYPE TIMESTAMP WITHOUT TIME ZONE"
+    " USING datetime_t::timestamptz AT TIME ZONE 'UTC'",
+]
+
+
+def migrate_tracker_timestamps(connection, batch_size: int = 10000):
+    """Turn trackers.datetime_t from ISO 8601 strings into a timestamp column.
+
+    Postgres changes the column type in place. Other databases keep their
+    loosely typed column, so the strings are rewritten in batches into the
+    format SQLAlchemy's DateTime reads back. Either way, the indexes the
+    tracker and asset queries rely on are then created if missing.
+    """
+    if connection.dialect.name == "postgresql":
+        for statement in POSTGRES_TRACKER_TIMESTAMPS:
+            connection.execute(text(statement))
+    else:
+        _rewrite_tracker_timestamps(connection, batch_size)
+    create_tracker_indexes(connection)
+
+
+def _rewrite_tracker_timestamps(connection, batch_size: int):
+    trackers = orm.trackers
+    raw_datetime_t = trackers.c.datetime_t.cast(String)
+    rewrite = (
+        update(trackers)
+        .where(trackers.c.id == bindparam("tracker_id"))
+        .values(datetime_t=bindparam("timestamp"))
+    )
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(trackers.c.id, raw_datetime_t)
+            .where(trackers.c.id > last_id)
+            .order_by(trackers.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        parsed = [
+            {"tracker_id": id_, "timestamp": parse_timestamp(datetime_t)}
+            for id_, datetime_t in rows
+            if datetime_t is not None
+        ]
+        if parsed:
+            connection.execute(rewrite, parsed)
+        last_id = rows[-1][0]
+
+
+def create_tracker_indexes(connection):
+    """Add the indexes on trackers, allocations_tracker and assets."""
+    for table in (orm.trackers, orm.allocations_tracker, orm.assets):
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def create_aimodel_indexes(connection):
+    """Add the (symbol, ai_type, accuracy_score) index best-model lookups use."""
+    for index in orm.aimodels.indexes:
+        index.create(connection, checkfirst=True)
+
+
+if __name__ == "__main__":
+    from allocation import config
+
+    with config.get_engine().begin() as connection:
+        migrate_tracker_timestamps(connection)
+        create_aimodel_indexes(connection)
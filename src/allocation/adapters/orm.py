@@ -1,13 +1,17 @@
-from sqlalchemy import Table, MetaData, Column, Integer, String, Date, ForeignKey, DateTime, Float
-from sqlalchemy.orm import relationship, registry
+from sqlalchemy import Table, MetaData, Column, Integer, String, Date, ForeignKey, DateTime, Float, Index
+import threading
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Query, relationship, registry
 from sqlalchemy.sql import func
 
 from allocation.domain import model
 from allocation.domain.tracker import Tracker
-from allocation.domain.asset import Asset
+from allocation.domain.asset import Asset, TrackerHistory
 from allocation.domain.aimodel import AIModel
 
 mapper_registry = registry()
+_mapping_lock = threading.Lock()
 
 
 metadata = MetaData()
@@ -51,7 +55,7 @@ assets = Table(
     "assets",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
-    Column("symbol", String(25)),
+    Column("symbol", String(25), unique=True, index=True),
     Column("source", String(100))
     
 )
@@ -67,7 +71,8 @@ aimodels = Table(
     Column("ai_type", String(200)),
     Column("hashtag", String(100), nullable=True),
     Column("accuracy_score", Float()),
-    Column("created_at", DateTime())
+    Column("created_at", DateTime()),
+    Index("ix_aimodels_symbol_ai_type_accuracy_score", "symbol", "ai_type", "accuracy_score"),
 )
 
 
@@ -76,21 +81,89 @@ trackers = Table(
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
     Column("symbol", String(25)),
-    Column("datetime_t", String(200)),
+    Column("datetime_t", DateTime()),
     Column("position", Integer, nullable=False),
-    Column("created_at", DateTime())
+    Column("created_at", DateTime()),
+    Index("ix_trackers_symbol_created_at", "symbol", "created_at"),
+    Index("ix_trackers_symbol_datetime_t", "symbol", "datetime_t"),
 )
 
 allocations_tracker = Table(
     "allocations_tracker",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
-    Column("tracker_id", ForeignKey("trackers.id")),
-    Column("asset_id", ForeignKey("assets.id")),
+    Column("tracker_id", ForeignKey("trackers.id"), index=True),
+    Column("asset_id", ForeignKey("assets.id"), index=True),
 )
 
 
+class TrackerHistoryQuery(Query):
+    """Asset._allocations_tracker for mapped assets.
+
+    Appending only inserts the new row and reads are paged queries, so an
+    asset never pulls its whole tracker history into memory. Mirrors
+    domain.asset.TrackerHistory.
+    """
+
+    def add(self, tracker):
+        self.append(tracker)
+
+    def discard(self, tracker):
+        if self.session is None:
+            matches = [t for t in self if t == tracker]
+        else:
+            matches = self.filter(
+                trackers.c.symbol == tracker.symbol,
+                trackers.c.datetime_t == tracker.datetime_t,
+                trackers.c.position == tracker.position,
+            ).all()
+        for match in matches:
+            self.remove(match)
+
+    def recent(self, n):
+        if self.session is None:
+            return TrackerHistory(self).recent(n)
+        return self._for_symbol().order_by(trackers.c.created_at.desc()).limit(n).all()
+
+    def between(self, start, end):
+        if self.session is None:
+            return TrackerHistory(self).between(start, end)
+        return (
+            self._for_symbol()
+            .filter(trackers.c.datetime_t >= start, trackers.c.datetime_t < end)
+            .order_by(trackers.c.datetime_t)
+            .all()
+        )
+
+    def _for_symbol(self):
+        # redundant with the join, but lets the (symbol, ...) indexes drive the scan
+        return self.filter(trackers.c.symbol == self.instance.symbol)
+
+
+def reset_allocated_quantity(batch, *args):
+    # expire also fires for instances that were already garbage collected
+    if batch is not None:
+        batch._allocated_quantity = None
+        batch._expired()
+
+
+def init_events(aggregate, *args):
+    # loaded instances never run __init__
+    aggregate.events = []
+
+
 def start_mappers():
+    """Map the domain classes; does nothing if they are already mapped.
+
+    Every entrypoint calls this, so importing or creating several of them in
+    one process is safe. clear_mappers() undoes it, e.g. between tests.
+    """
+    with _mapping_lock:
+        if inspect(model.Product, raiseerr=False) is None:
+            _map_domain_classes()
+
+
+def _map_domain_classes():
     lines_mapper = mapper_registry.map_imperatively(model.OrderLine, order_lines)
     batches_mapper = mapper_registry.map_imperatively(
         model.Batch,
@@ -104,8 +177,17 @@ def start_mappers():
         },
     )
     mapper_registry.map_imperatively(
-        model.Product, products, properties={"batches": relationship(batches_mapper)}
+        model.Product,
+        products,
+        properties={"batches": relationship(batches_mapper)},
+        # Product.allocate bumps version_number itself; the UPDATE only
+        # matches if nobody else bumped it since we read the product
+        version_id_col=products.c.version_number,
+        version_id_generator=False,
     )
+    for identifier in ("load", "refresh", "expire"):
+        event.listen(model.Batch, identifier, reset_allocated_quantity)
+    event.listen(model.Product, "load", init_events)
     
     
     lines_mapper_tracker = mapper_registry.map_imperatively(
@@ -117,10 +199,14 @@ def start_mappers():
         assets,
          properties={
             "_allocations_tracker": relationship(
-                lines_mapper_tracker, secondary=allocations_tracker, collection_class=set,
+                lines_mapper_tracker,
+                secondary=allocations_tracker,
+                lazy="dynamic",
+                query_class=TrackerHistoryQuery,
             )
         },
     )
+    event.listen(Asset, "load", init_events)
     
     mapper_registry.map_imperatively(
         AIModel, aimodels
@@ -1,7 +1,33 @@
 import abc
+from typing import Set
+
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, selectinload
+
+from allocation.adapters import orm
 from allocation.domain import model
 
 
+LOADERS = {"selectin": selectinload, "joined": joinedload}
+
+
+def product_graph(strategy: str) -> tuple:
+    """Loader options for a product's batches and their allocated lines.
+
+    "selectin" costs one extra SELECT per level, "joined" loads everything
+    in one joined SELECT and "lazy" leaves SQLAlchemy's per-object loading.
+    """
+    if strategy == "lazy":
+        return ()
+    loader = LOADERS[strategy]
+    return (loader(model.Product.batches).options(loader(model.Batch._allocations)),)
+
+
+def product_query(sku: str, strategy: str = "selectin"):
+    """SELECT for one product and its batch graph, shared by the sync and async repos."""
+    return select(model.Product).options(*product_graph(strategy)).filter_by(sku=sku)
+
+
 class AbstractBaseRepository():
     @abc.abstractmethod
     def add():
@@ -14,21 +40,62 @@ class AbstractBaseRepository():
     
 
 class AbstractRepository(AbstractBaseRepository):
-    @abc.abstractmethod
+    """Remembers every product it hands out or is given in `seen`, so the
+    unit of work can collect their events."""
+
+    def __init__(self):
+        self.seen = set()  # type: Set[model.Product]
+
     def add(self, product: model.Product):
+        self._add(product)
+        self.seen.add(product)
+
+    def get(self, sku) -> model.Product:
+        return self._saw(self._get(sku))
+
+    def get_by_batchref(self, batchref) -> model.Product:
+        return self._saw(self._get_by_batchref(batchref))
+
+    def _saw(self, product):
+        if product is not None:
+            self.seen.add(product)
+        return product
+
+    @abc.abstractmethod
+    def _add(self, product: model.Product):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def get(self, sku) -> model.Product:
+    def _get(self, sku) -> model.Product:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _get_by_batchref(self, batchref) -> model.Product:
         raise NotImplementedError
 
 
 class SqlAlchemyRepository(AbstractRepository):
-    def __init__(self, session):
+    default_loading = {"get": "selectin"}
+
+    def __init__(self, session, loading=None):
+        super().__init__()
         self.session = session
+        self.loading = {**self.default_loading, **(loading or {})}
 
-    def add(self, product):
+    def _add(self, product):
         self.session.add(product)
 
-    def get(self, sku):
-        return self.session.query(model.Product).filter_by(sku=sku).first()
\ No newline at end of file
+    def _get(self, sku):
+        query = product_query(sku, self.loading["get"])
+        # joined eager loads repeat the product once per batch row
+        return self.session.execute(query).unique().scalars().first()
+
+    def _get_by_batchref(self, batchref):
+        query = (
+            select(model.Product)
+            .join(model.Product.batches)
+            .filter(orm.batches.c.reference == batchref)
+            .options(*product_graph(self.loading["get"]))
+        )
+        return self.session.execute(query).unique().scalars().first()
+
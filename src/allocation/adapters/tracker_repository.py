@@ -1,7 +1,28 @@
 import abc
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, func, insert, or_, select
+
 from allocation.domain.tracker import Tracker
+from allocation.adapters import orm
 from allocation.adapters.repository import AbstractBaseRepository
 
+# Postgres caps the bind parameters of a single statement
+POSTGRES_MAX_PARAMETERS = 65535
+
+
+def latest_tracker_query(symbol: str):
+    # walks ix_trackers_symbol_created_at backwards and stops at one row
+    trackers = orm.trackers.c
+    return (
+        select(Tracker)
+        .filter_by(symbol=symbol)
+        .order_by(trackers.created_at.desc(), trackers.id.desc())
+        .limit(1)
+    )
+
+
 class AbstractTrackerRepository(AbstractBaseRepository):
     @abc.abstractmethod
     def add(self, tracker: Tracker):
@@ -10,6 +31,29 @@ class AbstractTrackerRepository(AbstractBaseRepository):
     @abc.abstractmethod
     def get(self, symbol) -> Tracker:
         raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_latest(self, symbol) -> Optional[Tracker]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_latest_many(self, symbols) -> Dict[str, Tracker]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add_many(self, rows: List[dict], asset_ids: Dict[str, int]):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list_range(
+        self,
+        symbol: str,
+        start: Optional[datetime],
+        end: Optional[datetime],
+        limit: int,
+        after: Optional[Tuple[datetime, int]] = None,
+    ) -> List[Tracker]:
+        raise NotImplementedError
     
 class TrackerRepository(AbstractTrackerRepository):
     def __init__(self, session):
@@ -20,6 +64,83 @@ class TrackerRepository(AbstractTrackerRepository):
 
     def get(self, symbol):
         return self.session.query(Tracker).filter_by(symbol=symbol).first()
+
+    def get_latest(self, symbol):
+        return self.session.execute(latest_tracker_query(symbol)).scalars().first()
+
+    def get_latest_many(self, symbols: Iterable[str]):
+        trackers = orm.trackers.c
+        ranked = (
+            select(
+                trackers.id,
+                func.row_number()
+                .over(
+                    partition_by=trackers.symbol,
+                    order_by=(trackers.created_at.desc(), trackers.id.desc()),
+                )
+                .label("rank"),
+            )
+            .where(trackers.symbol.in_(list(symbols)))
+            .subquery()
+        )
+        latest = (
+            self.session.query(Tracker)
+            .join(ranked, trackers.id == ranked.c.id)
+            .filter(ranked.c.rank == 1)
+        )
+        return {tracker.symbol: tracker for tracker in latest}
+
+    def add_many(self, rows, asset_ids):
+        """Insert tracker rows and link each one to its asset, bypassing the ORM.
+
+        `rows` are dicts of trackers columns, `asset_ids` maps symbol to assets.id.
+        """
+        if not rows:
+            return
+        trackers = orm.trackers
+        if self.session.get_bind().dialect.name == "postgresql":
+            # one multi-row INSERT ... RETURNING per slice that fits the limit
+            per_statement = POSTGRES_MAX_PARAMETERS // max(len(row) for row in rows)
+            inserted = []
+            for start in range(0, len(rows), per_statement):
+                inserted += self.session.execute(
+                    insert(trackers)
+                    .values(rows[start : start + per_statement])
+                    .returning(trackers.c.id, trackers.c.symbol)
+                ).all()
+        else:
+            # no RETURNING for executemany here, and other writers may insert
+            # too, so take each row's own id
+            inserted = [
+                (self.session.execute(insert(trackers), row).inserted_primary_key[0], row["symbol"])
+                for row in rows
+            ]
+        self.session.execute(
+            insert(orm.allocations_tracker),
+            [{"tracker_id": id_, "asset_id": asset_ids[symbol]} for id_, symbol in inserted],
+        )
+
+    def list_range(self, symbol, start, end, limit, after=None):
+        """Up to `limit` trackers with start <= datetime_t < end, in (datetime_t, id) order.
+
+        `after` is the (datetime_t, id) of the last row of the previous page,
+        so paging costs an index seek rather than an OFFSET scan.
+        """
+        trackers = orm.trackers.c
+        query = self.session.query(Tracker).filter(trackers.symbol == symbol)
+        if start is not None:
+            query = query.filter(trackers.datetime_t >= start)
+        if end is not None:
+            query = query.filter(trackers.datetime_t < end)
+        if after is not None:
+            after_datetime_t, after_id = after
+            query = query.filter(
+                or_(
+                    trackers.datetime_t > after_datetime_t,
+                    and_(trackers.datetime_t == after_datetime_t, trackers.id > after_id),
+                )
+            )
+        return query.order_by(trackers.datetime_t, trackers.id).limit(limit).all()
     
     def list(self):
         return self.session.query(Tracker).all()
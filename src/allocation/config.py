@@ -1,26 +1,131 @@
+"""Settings, read from the environment.
+
+Importing this module does no I/O. The connection settings (PSQL_*, API_*
+and DB_POOL_*) are read when an engine or URL is first asked for, after
+loading a .env file if there is one. The other settings are read at import
+and must be in the process environment.
+"""
 import os
-from dotenv import load_dotenv
+import tempfile
+import threading
+
+# positions are cached per process, so another worker's writes show up
+# after at most this many seconds
+POSITION_CACHE_SIZE = int(os.getenv('POSITION_CACHE_SIZE', '10000'))
+POSITION_CACHE_TTL = float(os.getenv('POSITION_CACHE_TTL', '30'))
+
+ALLOCATE_ATTEMPTS = int(os.getenv('ALLOCATE_ATTEMPTS', '5'))
+ALLOCATE_RETRY_DELAY = float(os.getenv('ALLOCATE_RETRY_DELAY', '0.01'))
+ALLOCATE_MAX_RETRY_DELAY = float(os.getenv('ALLOCATE_MAX_RETRY_DELAY', '0.5'))
+
+# keep hot products in memory and persist allocations behind (flask_app only)
+ALLOCATION_ENGINE = os.getenv('ALLOCATION_ENGINE', 'false').lower() in ('1', 'true', 'yes')
+ALLOCATION_ENGINE_FLUSH_INTERVAL = float(os.getenv('ALLOCATION_ENGINE_FLUSH_INTERVAL', '0.05'))
+ALLOCATION_ENGINE_MAX_PRODUCTS = int(os.getenv('ALLOCATION_ENGINE_MAX_PRODUCTS', '10000'))
+# held by the one running engine on this host; a second app refuses to start
+ALLOCATION_ENGINE_LOCK_FILE = os.getenv(
+    'ALLOCATION_ENGINE_LOCK_FILE', os.path.join(tempfile.gettempdir(), 'allocation-engine.lock')
+)
+
+# total on-disk size of the model artifacts kept deserialized per process
+AIMODEL_CACHE_BYTES = int(os.getenv('AIMODEL_CACHE_BYTES', str(512 * 1024 * 1024)))
+
+# threads running domain event handlers, off the request path
+EVENT_HANDLER_WORKERS = int(os.getenv('EVENT_HANDLER_WORKERS', '4'))
+
+# fraction of flask_app requests run under cProfile, dumped to PROFILE_DIR
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'allocation-profiles'))
 
-load_dotenv()
+_engine = None
+_session_factory = None
+_async_engine = None
+_async_session_factory = None
+_engine_lock = threading.Lock()
+_dotenv_loaded = False
 
-PSQL_USER = os.getenv('PSQL_USER')
-PSQL_PWD = os.getenv('PSQL_PWD')
-PSQL_HOST = os.getenv('PSQL_HOST')
-PSQL_PORT = os.getenv('PSQL_PORT')
-PSQL_DB_NAME = os.getenv('PSQL_DB_NAME')
 
-API_PORT = os.getenv('API_PORT')
-API_HOST = os.getenv('API_HOST')
+def connection_setting(name: str, default=None):
+    # .env is only read once something is about to connect
+    global _dotenv_loaded
+    if not _dotenv_loaded:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        _dotenv_loaded = True
+    return os.getenv(name, default)
+
+
+def get_pool_options() -> dict:
+    pre_ping = connection_setting('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+    return dict(
+        pool_size=int(connection_setting('DB_POOL_SIZE', '5')),
+        max_overflow=int(connection_setting('DB_MAX_OVERFLOW', '10')),
+        pool_pre_ping=pre_ping,
+        pool_recycle=int(connection_setting('DB_POOL_RECYCLE', '1800')),
+    )
+
 
 def get_postgres_uri():
-    host = PSQL_HOST
-    port = PSQL_PORT
-    password = PSQL_PWD
-    user, db_name = PSQL_USER, PSQL_DB_NAME
+    host = connection_setting('PSQL_HOST')
+    port = connection_setting('PSQL_PORT')
+    password = connection_setting('PSQL_PWD')
+    user, db_name = connection_setting('PSQL_USER'), connection_setting('PSQL_DB_NAME')
     return f"postgresql://{user}:{password}@{host}:{port}/{db_name}"
 
 
+def get_async_postgres_uri():
+    return get_postgres_uri().replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
 def get_api_url():
-    host = API_HOST
-    port = API_PORT
-    return f"http://{host}:{port}"
\ No newline at end of file
+    host = connection_setting('API_HOST')
+    port = connection_setting('API_PORT')
+    return f"http://{host}:{port}"
+
+
+def get_engine():
+    """The one pooled engine shared by every entrypoint and unit of work."""
+    from sqlalchemy import create_engine
+
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_engine(get_postgres_uri(), **get_pool_options())
+        return _engine
+
+
+def get_session_factory():
+    """The session factory units of work use unless they are given one."""
+    from sqlalchemy.orm import sessionmaker
+
+    global _session_factory
+    engine = get_engine()
+    with _engine_lock:
+        if _session_factory is None:
+            _session_factory = sessionmaker(bind=engine)
+        return _session_factory
+
+
+def get_async_engine():
+    """The asyncio counterpart of get_engine, for the ASGI entrypoint."""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    global _async_engine
+    with _engine_lock:
+        if _async_engine is None:
+            _async_engine = create_async_engine(get_async_postgres_uri(), **get_pool_options())
+        return _async_engine
+
+
+def get_async_session_factory():
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from sqlalchemy.orm import sessionmaker
+
+    global _async_session_factory
+    if _async_session_factory is None:
+        # after commit nothing can be lazily refreshed outside the event loop
+        _async_session_factory = sessionmaker(
+            bind=get_async_engine(), class_=AsyncSession, expire_on_commit=False
+        )
+    return _async_session_factory
@@ -1,8 +1,10 @@
 from datetime import datetime
+from typing import Optional
 
 class AIModel:
     def __init__(self, symbol: str, source: str, feature_counts: int,
-                 model_name: str, ai_type: str, hashtag: str, accuracy_score: float, created_at=datetime.now()):
+                 model_name: str, ai_type: str, hashtag: str, accuracy_score: float,
+                 created_at: Optional[datetime] = None):
         self.symbol = symbol
         self.source = source
         self.feature_counts = feature_counts
@@ -10,7 +12,7 @@ class AIModel:
         self.ai_type = ai_type
         self.hashtag = hashtag
         self.accuracy_score = accuracy_score
-        self.created_at = created_at
+        self.created_at = created_at if created_at is not None else datetime.now()
         
     @property    
     def get_filepath(self):
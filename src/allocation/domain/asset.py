@@ -1,20 +1,68 @@
+from datetime import datetime
+from allocation.domain import events
 from allocation.domain.tracker import Tracker
-from typing import Optional, List, Set
+from typing import Iterable, Optional, List, Set
+
+
+class TrackerHistory:
+    """The trackers allocated to an asset, held in memory.
+
+    Assets loaded through the ORM get a database-backed collection with the
+    same add/discard/recent/between methods, which never loads the whole
+    history at once.
+    """
+
+    def __init__(self, trackers: Iterable[Tracker] = ()):
+        self._trackers = set(trackers)  # type: Set[Tracker]
+
+    def add(self, tracker: Tracker):
+        self._trackers.add(tracker)
+
+    def discard(self, tracker: Tracker):
+        self._trackers.discard(tracker)
+
+    def recent(self, n: int) -> List[Tracker]:
+        return sorted(self._trackers, key=lambda t: t.created_at, reverse=True)[:n]
+
+    def between(self, start: datetime, end: datetime) -> List[Tracker]:
+        return sorted(
+            (t for t in self._trackers if start <= t.datetime_t < end),
+            key=lambda t: t.datetime_t,
+        )
+
+    def __contains__(self, tracker):
+        return tracker in self._trackers
+
+    def __iter__(self):
+        return iter(self._trackers)
+
+    def __len__(self):
+        return len(self._trackers)
 
 
 class Asset:
     def __init__(self, symbol: str, source: str):
         self.symbol = symbol
         self.source = source
-        self._allocations_tracker = set()
+        self._allocations_tracker = TrackerHistory()
+        self.events = []  # type: List[events.Event]
         
     def allocate_tracker(self, tracker: Tracker):
         if self.can_allocate(tracker):
             self._allocations_tracker.add(tracker)
+            self.events.append(
+                events.TrackerAllocated(tracker.symbol, tracker.datetime_t, tracker.position)
+            )
             
     def deallocate(self, tracker: Tracker):
-        if tracker in self._allocations_tracker:
-            self._allocations_tracker.remove(tracker)
+        self._allocations_tracker.discard(tracker)
+
+    def recent_trackers(self, n: int) -> List[Tracker]:
+        return self._allocations_tracker.recent(n)
+
+    def trackers_between(self, start: datetime, end: datetime) -> List[Tracker]:
+        """Trackers whose datetime_t falls in [start, end), oldest first."""
+        return self._allocations_tracker.between(start, end)
             
     def can_allocate(self, tracker: Tracker) -> bool:
         return tracker.symbol == self.symbol
@@ -27,7 +75,7 @@ class Asset:
         return cond1 and cond2
     
     def __hash__(self):
-        return hash(self.symbol)
+        return hash((self.symbol, self.source))
         
     def __repr__(self):
         return f"<Asset {self.symbol}, source: {self.source}>"
@@ -0,0 +1,40 @@
+"""Things that happened in the domain, recorded by the aggregates.
+
+Products and assets append these to their `events` list. The unit of work
+collects them once its transaction has committed and hands them to the
+message bus, so handlers only ever see changes that were saved.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+
+
+class Event:
+    pass
+
+
+@dataclass
+class Allocated(Event):
+    orderid: str
+    sku: str
+    qty: int
+    batchref: str
+
+
+@dataclass
+class Deallocated(Event):
+    orderid: str
+    sku: str
+    qty: int
+    batchref: str
+
+
+@dataclass
+class OutOfStock(Event):
+    sku: str
+
+
+@dataclass
+class TrackerAllocated(Event):
+    symbol: str
+    datetime_t: datetime
+    position: int
@@ -1,7 +1,8 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from datetime import date, datetime
-from typing import Optional, List, Set
+from typing import Optional, List, Set, Tuple, Union
+from allocation.domain import events
 from allocation.domain.tracker import Tracker
 
 
@@ -12,20 +13,169 @@ class OutOfStock(Exception):
     pass
 
 
+class NotAllocated(Exception):
+    pass
+
+
+class AlreadyAllocated(Exception):
+    pass
+
+
 class Product:
     def __init__(self, sku: str, batches: List[Batch], version_number: int = 0):
         self.sku = sku
         self.batches = batches
         self.version_number = version_number
+        self.events = []  # type: List[events.Event]
 
     def allocate(self, line: OrderLine) -> str:
         try:
-            batch = next(b for b in sorted(self.batches) if b.can_allocate(line))
-            batch.allocate(line)
-            self.version_number += 1
-            return batch.reference
-        except StopIteration:
+            batch = self._place(line)
+        except OutOfStock:
+            self.events.append(events.OutOfStock(line.sku))
+            raise
+        self.version_number += 1
+        self.events.append(events.Allocated(line.orderid, line.sku, line.qty, batch.reference))
+        return batch.reference
+
+    def deallocate(self, line: OrderLine) -> str:
+        batch = self.batch_holding(line)
+        if batch is None:
+            raise NotAllocated(f"Order line {line.orderid} is not allocated to sku {self.sku}")
+        batch.deallocate(line)
+        self.version_number += 1
+        self.events.append(events.Deallocated(line.orderid, line.sku, line.qty, batch.reference))
+        return batch.reference
+
+    def batch_holding(self, line: OrderLine) -> Optional[Batch]:
+        """The batch `line` is allocated to, if any."""
+        return next((b for b in self.batches if line in b._allocations), None)
+
+    def reallocate(
+        self, ref: str, eta: Optional[date] = None, cancel: bool = False
+    ) -> List[Tuple[OrderLine, Union[str, OutOfStock]]]:
+        """Move every line off batch `ref` and allocate them again, in one pass.
+
+        The batch first gets its new `eta`, or no stock at all if it is
+        cancelled, so lines only return to it if it is still the best fit.
+        Lines that fit nowhere are left unallocated. Returns each line with
+        its new batchref or the OutOfStock it failed with.
+        """
+        batch = next((b for b in self.batches if b.reference == ref), None)
+        if batch is None:
+            raise ValueError(f"No batch {ref} for sku {self.sku}")
+        lines = sorted(batch._allocations, key=lambda l: (l.orderid, l.qty))
+        for line in lines:
+            batch.deallocate(line)
+            self.events.append(events.Deallocated(line.orderid, line.sku, line.qty, ref))
+        if cancel:
+            batch.change_purchased_quantity(0)
+        elif eta is not None:
+            batch.eta = eta
+        # the batch may have moved in allocation order
+        self._index = None
+
+        results = []  # type: List[Tuple[OrderLine, Union[str, OutOfStock]]]
+        for line in lines:
+            try:
+                batchref = self._place(line).reference
+            except OutOfStock as e:
+                self.events.append(events.OutOfStock(line.sku))
+                results.append((line, e))
+                continue
+            self.events.append(events.Allocated(line.orderid, line.sku, line.qty, batchref))
+            results.append((line, batchref))
+        self.version_number += 1
+        return results
+
+    def _place(self, line: OrderLine) -> Batch:
+        batch = None
+        if line.sku == self.sku:
+            batch = self._first_fit(self._batch_index(), line)
+        if batch is None:
             raise OutOfStock(f"Out of stock for sku {line.sku}")
+        batch.allocate(line)
+        return batch
+
+    @staticmethod
+    def _first_fit(index: BatchIndex, line: OrderLine) -> Optional[Batch]:
+        while True:
+            batch = index.first_fit(line.qty)
+            if batch is None or batch.can_allocate(line):
+                return batch
+            # the index overestimated this batch, refresh it and look again
+            index.update(batch)
+
+    def _batch_index(self) -> BatchIndex:
+        # products loaded by the ORM never run __init__, so build the index
+        # on first use and rebuild it whenever a batch is appended or the
+        # ORM has (re)loaded one of its batches
+        index = getattr(self, "_index", None)
+        if index is None or index.stale or not index.covers(self.batches):
+            index = self._index = BatchIndex(self.batches, self.sku)
+        return index
+
+
+class BatchIndex:
+    """Batches in allocation order (warehouse stock first, then by ETA).
+
+    Keeps a max-tree over the available quantities, so the first batch
+    that can take a line is found in O(log n) and an allocation updates
+    O(log n) nodes, instead of sorting and scanning every batch per line.
+    Each batch tells the index it belongs to when it allocates or
+    deallocates, or changes its purchased quantity, so the tree follows
+    changes made straight through a batch too.
+    """
+
+    EMPTY = float("-inf")
+
+    def __init__(self, batches: List[Batch], sku: str):
+        self.sku = sku
+        self._source = batches
+        self._size = len(batches)
+        self._batches = sorted(batches)
+        self._positions = {id(b): i for i, b in enumerate(self._batches)}
+        capacity = 1
+        while capacity < self._size:
+            capacity *= 2
+        self._capacity = capacity
+        self._tree = [self.EMPTY] * (2 * capacity)
+        self.stale = False
+        for i, batch in enumerate(self._batches):
+            self._tree[capacity + i] = self._available(batch)
+            batch._index = self
+        for i in range(capacity - 1, 0, -1):
+            self._tree[i] = max(self._tree[2 * i], self._tree[2 * i + 1])
+
+    def covers(self, batches: List[Batch]) -> bool:
+        return batches is self._source and len(batches) == self._size
+
+    def first_fit(self, qty: int) -> Optional[Batch]:
+        tree = self._tree
+        if tree[1] < qty:
+            return None
+        i = 1
+        while i < self._capacity:
+            i *= 2
+            if tree[i] < qty:
+                i += 1
+        return self._batches[i - self._capacity]
+
+    def update(self, batch: Batch):
+        position = self._positions.get(id(batch))
+        if position is None:
+            return
+        i = position + self._capacity
+        self._tree[i] = self._available(batch)
+        i //= 2
+        while i:
+            self._tree[i] = max(self._tree[2 * i], self._tree[2 * i + 1])
+            i //= 2
+
+    def _available(self, batch: Batch):
+        if batch.sku != self.sku:
+            return self.EMPTY
+        return batch.available_quantity
 
 
 @dataclass(unsafe_hash=True)
@@ -35,6 +185,15 @@ class OrderLine:
     qty: int
 
 
+@dataclass(unsafe_hash=True, slots=True)
+class LineRecord:
+    """An unmapped, slotted OrderLine for lines that are only read."""
+
+    orderid: str
+    sku: str
+    qty: int
+
+
 class Batch:
     def __init__(self, ref: str, sku: str, qty: int, eta: Optional[date]):
         self.reference = ref
@@ -42,6 +201,7 @@ class Batch:
         self.eta = eta
         self._purchased_quantity = qty
         self._allocations = set()  # type: Set[OrderLine]
+        self._allocated_quantity = 0  # type: Optional[int]
 
     def __repr__(self):
         return f"<Batch {self.reference}>"
@@ -62,16 +222,40 @@ class Batch:
         return self.eta > other.eta
 
     def allocate(self, line: OrderLine):
-        if self.can_allocate(line):
+        if self.can_allocate(line) and line not in self._allocations:
+            self._allocated_quantity = self.allocated_quantity + line.qty
             self._allocations.add(line)
+            self._changed()
 
     def deallocate(self, line: OrderLine):
         if line in self._allocations:
+            self._allocated_quantity = self.allocated_quantity - line.qty
             self._allocations.remove(line)
+            self._changed()
+
+    def change_purchased_quantity(self, qty: int):
+        self._purchased_quantity = qty
+        self._changed()
+
+    def _changed(self):
+        # batches loaded by the ORM never run __init__, nor join an index until used
+        index = getattr(self, "_index", None)
+        if index is not None:
+            index.update(self)
+
+    def _expired(self):
+        # the ORM is about to (re)load this batch, so its quantities and ETA
+        # may change under the index; rebuild it before the next allocation
+        index = getattr(self, "_index", None)
+        if index is not None:
+            index.stale = True
 
     @property
     def allocated_quantity(self) -> int:
-        return sum(line.qty for line in self._allocations)
+        # None means "unknown", e.g. the ORM has just (re)loaded _allocations
+        if getattr(self, "_allocated_quantity", None) is None:
+            self._allocated_quantity = sum(line.qty for line in self._allocations)
+        return self._allocated_quantity
 
     @property
     def available_quantity(self) -> int:
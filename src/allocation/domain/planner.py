@@ -0,0 +1,214 @@
+"""Plan the allocation of many order lines at once, without changing any batch.
+
+The plan is exactly what calling Product.allocate on each line in turn
+would produce: every line goes to the first batch, warehouse stock first and
+then by ETA, with enough quantity left. The greedy choice is sequential
+within a SKU but independent across SKUs. So the k-th line of every SKU is
+placed in one vectorized round over a SKUs x batches matrix of available
+quantities, and the number of Python-level steps is the longest per-SKU
+line count, not the number of lines.
+
+Skewed input would undo that: a round only pays off while enough SKUs are
+still in it, so the lines left on a few hot SKUs are placed one at a time,
+and a SKU with far more batches than the rest would widen every row of the
+matrix, so its lines are placed one at a time from the start.
+"""
+from collections import Counter
+from operator import attrgetter
+from typing import Dict, Iterable, List, Sequence, Set, Union
+
+import numpy as np
+
+from allocation.domain.model import LineRecord, OrderLine, OutOfStock, Product
+
+# never enough: pads the matrix and stands for batches of another SKU
+NO_STOCK = np.iinfo(np.int64).min
+# below this many SKUs a numpy round costs more than placing their lines in turn
+MIN_ROUND_ROWS = 8
+# SKUs with more batches than this many times the median, and at least
+# MIN_WIDE_BATCHES, are kept out of the matrix
+WIDE_FACTOR = 4
+MIN_WIDE_BATCHES = 64
+
+PlannedLine = Union[str, OutOfStock, None]
+
+
+def plan_allocations(
+    lines: Sequence[Union[OrderLine, LineRecord]], products: Iterable[Product]
+) -> List[PlannedLine]:
+    """The batchref each line would be allocated to, in input order.
+
+    A line that fits nowhere gets an OutOfStock, and a line whose SKU is not
+    one of `products` gets None. The products are left untouched.
+    """
+    products_by_sku = {product.sku: product for product in products}
+    # plain tuples hash in C, unlike the OrderLine dataclass
+    keys = list(map(attrgetter("orderid", "sku", "qty"), lines))
+    line_skus = [key[1] for key in keys]
+    counts_by_sku = Counter(line_skus)
+    planned = [sku for sku, _ in counts_by_sku.most_common() if sku in products_by_sku]
+    if not planned:
+        return [None] * len(keys)
+    batches_by_sku = {sku: sorted(products_by_sku[sku].batches) for sku in planned}
+    wide = max(
+        MIN_WIDE_BATCHES,
+        WIDE_FACTOR * int(np.median([len(b) for b in batches_by_sku.values()])),
+    )
+    # SKUs with the most lines first, so the SKUs still active in a round
+    # are always the leading rows of the matrix; the wide ones come last
+    skus = [sku for sku in planned if len(batches_by_sku[sku]) <= wide]
+    narrow = len(skus)
+    skus += [sku for sku in planned if len(batches_by_sku[sku]) > wide]
+    row_by_sku = {sku: row for row, sku in enumerate(skus)}
+    batches = [batches_by_sku[sku] for sku in skus]
+    counts = np.array([counts_by_sku[sku] for sku in skus])
+    widths = np.maximum.accumulate([max(len(b), 1) for b in batches[:narrow]] or [1])
+
+    available = np.full((narrow, widths[-1]), NO_STOCK, dtype=np.int64)
+    references = np.full((narrow, widths[-1]), None, dtype=object)
+    for row in range(narrow):
+        sku_batches = batches[row]
+        available[row, : len(sku_batches)] = _quantities(skus[row], sku_batches)
+        references[row, : len(sku_batches)] = [b.reference for b in sku_batches]
+
+    # line positions grouped by row, in input order within a row
+    rows_by_position = np.array([row_by_sku.get(sku, -1) for sku in line_skus])
+    ordered = np.argsort(rows_by_position, kind="stable")[len(keys) - int(counts.sum()):]
+    qty = np.array([key[2] for key in keys], dtype=np.int64)[ordered]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    chosen = np.full(len(ordered), -1)
+
+    # Batch.allocate ignores a line its batch already holds, so the same
+    # line allocated twice only uses stock if it lands in another batch
+    repeats = _repeated_lines(keys, batches)
+    repeated = np.zeros(len(keys), dtype=bool)
+    repeated[list(repeats)] = True
+    repeated = repeated[ordered]
+
+    active, k = narrow, 0
+    while True:
+        while active and counts[active - 1] <= k:
+            active -= 1
+        if active < MIN_ROUND_ROWS:
+            break
+        rows = np.arange(active)
+        at = starts[:active] + k
+        fits = available[:active, : widths[active - 1]] >= qty[at][:, None]
+        columns = fits.argmax(axis=1)
+        found = fits[rows, columns]
+        chosen[at[found]] = columns[found]
+        consume = found & ~repeated[at]
+        for row in np.flatnonzero(found & repeated[at]):
+            held = repeats[ordered[at[row]]]
+            consume[row] = columns[row] not in held
+            held.add(columns[row])
+        available[rows[consume], columns[consume]] -= qty[at[consume]]
+        k += 1
+
+    # the SKUs still active hold the rest of their lines, and the wide ones all
+    # of them: place those in turn
+    leftovers = [(row, k, available[row, : len(batches[row])].tolist()) for row in range(active)]
+    leftovers += [
+        (row, 0, _quantities(skus[row], batches[row])) for row in range(narrow, len(skus))
+    ]
+    for row, done, quantities in leftovers:
+        lines_of_row = slice(starts[row] + done, starts[row] + counts[row])
+        chosen[lines_of_row] = _place_in_turn(
+            quantities,
+            qty[lines_of_row].tolist(),
+            repeated[lines_of_row].tolist(),
+            ordered[lines_of_row].tolist(),
+            repeats,
+        )
+
+    results = np.full(len(keys), None, dtype=object)
+    rows = rows_by_position[ordered]
+    in_matrix = (chosen >= 0) & (rows < narrow)
+    results[ordered[in_matrix]] = references[rows[in_matrix], chosen[in_matrix]]
+    for at in np.flatnonzero((chosen >= 0) & (rows >= narrow)):
+        results[ordered[at]] = batches[rows[at]][chosen[at]].reference
+    for position in ordered[chosen < 0]:
+        results[position] = OutOfStock(f"Out of stock for sku {line_skus[position]}")
+    return results.tolist()
+
+
+def _quantities(sku: str, sku_batches: list) -> List[int]:
+    return [b.available_quantity if b.sku == sku else NO_STOCK for b in sku_batches]
+
+
+def _place_in_turn(
+    quantities: List[int],
+    qty: List[int],
+    repeated: List[bool],
+    positions: List[int],
+    repeats: Dict[int, Set[int]],
+) -> List[int]:
+    """The batch column each line goes to, or -1, placing the lines one by one."""
+    tree = FirstFitTree(quantities)
+    columns = []
+    for line_qty, is_repeat, position in zip(qty, repeated, positions):
+        column = tree.first_fit(line_qty)
+        columns.append(column)
+        if column < 0:
+            continue
+        if is_repeat:
+            held = repeats[position]
+            if column in held:
+                continue
+            held.add(column)
+        tree.take(column, line_qty)
+    return columns
+
+
+class FirstFitTree:
+    """A max-tree over quantities: the first one of at least `qty` in O(log n)."""
+
+    def __init__(self, quantities: List[int]):
+        capacity = 1
+        while capacity < len(quantities):
+            capacity *= 2
+        self._capacity = capacity
+        self._tree = [NO_STOCK] * capacity + quantities + [NO_STOCK] * (capacity - len(quantities))
+        for i in range(capacity - 1, 0, -1):
+            self._tree[i] = max(self._tree[2 * i], self._tree[2 * i + 1])
+
+    def first_fit(self, qty: int) -> int:
+        tree = self._tree
+        if tree[1] < qty:
+            return -1
+        i = 1
+        while i < self._capacity:
+            i *= 2
+            if tree[i] < qty:
+                i += 1
+        return i - self._capacity
+
+    def take(self, column: int, qty: int):
+        tree = self._tree
+        i = column + self._capacity
+        tree[i] -= qty
+        i //= 2
+        while i:
+            tree[i] = max(tree[2 * i], tree[2 * i + 1])
+            i //= 2
+
+
+def _repeated_lines(keys: List[tuple], batches: List[list]) -> Dict[int, Set[int]]:
+    """Positions of lines that may already sit in a batch, mapped to a shared
+    set of the batch columns holding that line."""
+    counts = Counter(keys)
+    held = {}  # type: Dict[tuple, Set[int]]
+    for sku_batches in batches:
+        for column, batch in enumerate(sku_batches):
+            for line in batch._allocations:  # pylint: disable=protected-access
+                key = line.orderid, line.sku, line.qty
+                if key in counts:
+                    held.setdefault(key, set()).add(column)
+    candidates = {key for key, count in counts.items() if count > 1}.union(held)
+    if not candidates:
+        return {}
+    return {
+        position: held.setdefault(key, set())
+        for position, key in enumerate(keys)
+        if key in candidates
+    }
@@ -1,11 +1,22 @@
-from datetime import datetime
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse an ISO 8601 timestamp into the naive UTC datetime trackers store."""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
 
 class Tracker:
-    def __init__(self, symbol: str, datetime_t: str, position: int, created_at=datetime.now()):
+    def __init__(self, symbol: str, datetime_t: datetime, position: int, created_at: Optional[datetime] = None):
         self.symbol = symbol
         self.datetime_t = datetime_t
         self.position = position
-        self.created_at = created_at
+        self.created_at = created_at if created_at is not None else datetime.now()
         
     def __eq__(self, other):
         if not isinstance(other, Tracker):
@@ -16,8 +27,18 @@ class Tracker:
         return cond1 and cond2 and cond3
     
     def __hash__(self):
-        return hash(self.symbol)
+        return hash((self.symbol, self.datetime_t, self.position))
         
         
     def __repr__(self):
-        return f"<Tracker {self.symbol}, datetime: {self.datetime_t}, position: {self.position}, created_at: {self.created_at}>"
\ No newline at end of file
+        return f"<Tracker {self.symbol}, datetime: {self.datetime_t}, position: {self.position}, created_at: {self.created_at}>"
+
+
+@dataclass(unsafe_hash=True, slots=True)
+class TrackerRecord:
+    """An unmapped, slotted Tracker for bulk loads."""
+
+    symbol: str
+    datetime_t: datetime
+    position: int
+    created_at: Optional[datetime] = None
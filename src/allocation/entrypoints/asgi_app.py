@@ -0,0 +1,76 @@
+"""An asyncio (ASGI) entrypoint serving the hot endpoints of flask_app.
+
+    uvicorn allocation.entrypoints.asgi_app:app --port 5006
+
+A request waiting on Postgres yields the event loop instead of holding a
+worker thread.
+"""
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from allocation.domain import model
+from allocation.domain.tracker import parse_timestamp
+from allocation.adapters import orm
+from allocation.service_layer import async_services, services, unit_of_work
+
+
+async def allocate_endpoint(request: Request):
+    body = await request.json()
+    try:
+        batchref = await async_services.allocate(
+            body["orderid"],
+            body["sku"],
+            body["qty"],
+            unit_of_work.AsyncSqlAlchemyUnitOfWork(),
+        )
+    except (model.OutOfStock, services.InvalidSku) as e:
+        return JSONResponse({"message": str(e)}, status_code=400)
+
+    return JSONResponse({"batchref": batchref}, status_code=201)
+
+
+async def allocate_tracker(request: Request):
+    body = await request.json()
+    try:
+        assetref = await async_services.allocate_tracker(
+            body["symbol"],
+            parse_timestamp(body["datetime_t"]),
+            body["position"],
+            unit_of_work.AsyncSqlAlchemyUnitOfWork(),
+        )
+    except services.InvalidSymbol as e:
+        return JSONResponse({"message": str(e)}, status_code=400)
+    except ValueError as e:
+        return JSONResponse({"message": f"Invalid datetime_t: {e}"}, status_code=400)
+
+    return JSONResponse({"assetref": assetref}, status_code=201)
+
+
+async def get_position(request: Request):
+    body = await request.json()
+    try:
+        trackref = await async_services.get_position(
+            body["symbol"],
+            unit_of_work.AsyncSqlAlchemyUnitOfWork(),
+        )
+    except services.InvalidSymbol as e:
+        return JSONResponse({"message": str(e)}, status_code=400)
+
+    return JSONResponse({"trackref": position_json(trackref)}, status_code=201)
+
+
+def position_json(position):
+    symbol, side, datetime_t = position
+    return symbol, side, datetime_t.isoformat()
+
+
+app = Starlette(
+    routes=[
+        Route("/allocate", allocate_endpoint, methods=["POST"]),
+        Route("/allocate_tracker", allocate_tracker, methods=["POST"]),
+        Route("/position", get_position, methods=["POST"]),
+    ],
+    on_startup=[orm.start_mappers],
+)
@@ -1,31 +1,64 @@
+"""The HTTP API, built by an application factory.
+
+    flask --app allocation.entrypoints.flask_app run
+    gunicorn "allocation.entrypoints.flask_app:create_app()"
+
+Importing this module only defines the routes. create_app maps the domain
+classes and wires up the app, and nothing connects to the database until a
+request needs it.
+"""
+import atexit
+import json
 from datetime import datetime
-from flask import Flask, request
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from flask_sqlalchemy import SQLAlchemy
+from functools import partial
+from typing import Optional
+from flask import Blueprint, Flask, Response, current_app, request, stream_with_context
 
 from allocation.domain import model
+from allocation.domain.tracker import parse_timestamp
 from allocation.adapters import orm
+from allocation.entrypoints import metrics
 from allocation.service_layer import services, unit_of_work
+from allocation.service_layer.allocation_engine import AllocationEngine
 import allocation.config as config
 
-from allocation.adapters.tracker_repository import TrackerRepository
-from allocation.adapters.asset_repository import AssetRepository
+
+api = Blueprint("api", __name__)
 
 
-orm.start_mappers()
-get_session = sessionmaker(bind=create_engine(config.get_postgres_uri()))
-app = Flask(__name__)
+def create_app(session_factory=None) -> Flask:
+    """The app, with units of work on `session_factory` (default: config's).
+
+    With ALLOCATION_ENGINE on, the engine must be the only writer, so this
+    raises EngineAlreadyRunning in any process after the first: serve it
+    from a single worker.
+    """
+    orm.start_mappers()
+    app = Flask(__name__)
+    app.config["SESSION_FACTORY"] = session_factory
+    app.register_blueprint(api)
+    metrics.instrument(app)
+
+    if config.ALLOCATION_ENGINE:
+        engine = AllocationEngine(
+            partial(unit_of_work.SqlAlchemyUnitOfWork, session_factory),
+            lock_file=config.ALLOCATION_ENGINE_LOCK_FILE,
+        )
+        engine.start()
+        atexit.register(engine.stop)
+        app.extensions["allocation_engine"] = engine
+    return app
 
-app.config['SQLALCHEMY_DATABASE_URI'] = config.get_postgres_uri()
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-db = SQLAlchemy(app)
+def new_uow() -> unit_of_work.SqlAlchemyUnitOfWork:
+    return unit_of_work.SqlAlchemyUnitOfWork(current_app.config["SESSION_FACTORY"])
 
 
+def allocation_engine() -> Optional[AllocationEngine]:
+    return current_app.extensions.get("allocation_engine")
 
 
-@app.route("/add_batch", methods=["POST"])
+@api.route("/add_batch", methods=["POST"])
 def add_batch():
     eta = request.json["eta"]
     if eta is not None:
@@ -35,70 +68,205 @@ def add_batch():
         request.json["sku"],
         request.json["qty"],
         eta,
-        unit_of_work.SqlAlchemyUnitOfWork(),
+        new_uow(),
     )
+    engine = allocation_engine()
+    if engine is not None:
+        engine.evict(request.json["sku"])
     return "OK", 201
 
 
-@app.route("/allocate", methods=["POST"])
+@api.route("/allocate", methods=["POST"])
 def allocate_endpoint():
+    orderid, sku, qty = request.json["orderid"], request.json["sku"], request.json["qty"]
+    engine = allocation_engine()
     try:
-        batchref = services.allocate(
+        if engine is not None:
+            batchref = engine.allocate(orderid, sku, qty)
+        else:
+            batchref = services.allocate(orderid, sku, qty, new_uow())
+    except (model.OutOfStock, model.AlreadyAllocated, services.InvalidSku) as e:
+        return {"message": str(e)}, 400
+
+    return {"batchref": batchref}, 201
+
+
+@api.route("/allocate_batch", methods=["POST"])
+def allocate_batch_endpoint():
+    lines = [(line["orderid"], line["sku"], line["qty"]) for line in request.json["lines"]]
+    engine = allocation_engine()
+    if request.args.get("dry_run", "false").lower() in ("1", "true", "yes"):
+        results = services.plan_allocations(lines, new_uow())
+    elif engine is not None:
+        results = [_allocate_with_engine(engine, *line) for line in lines]
+    else:
+        results = services.allocate_many(lines, new_uow())
+    return {
+        "results": [
+            {"message": str(result)} if isinstance(result, Exception) else {"batchref": result}
+            for result in results
+        ]
+    }, 201
+
+
+def _allocate_with_engine(engine, orderid, sku, qty):
+    try:
+        return engine.allocate(orderid, sku, qty)
+    except (model.OutOfStock, model.AlreadyAllocated, services.InvalidSku) as e:
+        return e
+
+
+@api.route("/deallocate", methods=["POST"])
+def deallocate_endpoint():
+    engine = allocation_engine()
+    if engine is not None:
+        engine.flush()
+    try:
+        batchref = services.deallocate(
             request.json["orderid"],
             request.json["sku"],
             request.json["qty"],
-            unit_of_work.SqlAlchemyUnitOfWork(),
+            new_uow(),
         )
-    except (model.OutOfStock, services.InvalidSku) as e:
+    except (model.NotAllocated, services.InvalidSku) as e:
         return {"message": str(e)}, 400
+    finally:
+        if engine is not None:
+            engine.evict(request.json["sku"])
 
-    return {"batchref": batchref}, 201
+    return {"batchref": batchref}, 200
 
 
-@app.route("/add_asset", methods=["POST"])
-def add_asset():
-    session = get_session()
-    repo = TrackerRepository(session)
+@api.route("/reallocate_batch", methods=["POST"])
+def reallocate_batch_endpoint():
+    eta = request.json.get("eta")
+    if eta is not None:
+        eta = datetime.fromisoformat(eta).date()
+    engine = allocation_engine()
+    if engine is not None:
+        engine.flush()
+    try:
+        results = services.reallocate_batch(
+            request.json["ref"],
+            new_uow(),
+            eta=eta,
+            cancel=request.json.get("cancel", False),
+        )
+    except services.InvalidBatchref as e:
+        return {"message": str(e)}, 400
+    finally:
+        if engine is not None:
+            engine.clear()
 
+    return {
+        "results": [
+            {"orderid": line.orderid, "message": str(result)}
+            if isinstance(result, Exception)
+            else {"orderid": line.orderid, "batchref": result}
+            for line, result in results
+        ]
+    }, 200
+
+
+@api.route("/add_asset", methods=["POST"])
+def add_asset():
     services.add_asset(
         request.json["symbol"],
         request.json["source"],
-        repo,
-        session,
+        new_uow(),
     )
     return "OK", 201
 
 
-@app.route("/allocate_tracker", methods=["POST"])
+@api.route("/allocate_tracker", methods=["POST"])
 def allocate_tracker():
-    session = get_session()
-    repo = AssetRepository(session)
     try:
         assetref = services.allocate_tracker(
             request.json["symbol"],
-            request.json["datetime_t"],
+            parse_timestamp(request.json["datetime_t"]),
             request.json["position"],
-            repo,
-            session,
+            new_uow(),
         )
     except (services.InvalidSymbol) as e:
         return {"message": str(e)}, 400
+    except ValueError as e:
+        return {"message": f"Invalid datetime_t: {e}"}, 400
 
     return {"assetref": assetref}, 201
 
 
-@app.route("/position", methods=["POST"])
+@api.route("/position", methods=["POST"])
 def get_position():
-    session = get_session()
-    repo = TrackerRepository(session)
     try:
         trackref = services.get_position(
             request.json["symbol"],
-            repo,
-            session
+            new_uow(),
         )
         
     except (services.InvalidSymbol) as e:
         return {"message": str(e)}, 400
 
-    return {"trackref": trackref}, 201
+    return {"trackref": position_json(trackref)}, 201
+
+
+@api.route("/positions", methods=["POST"])
+def get_positions():
+    trackrefs = services.get_positions(
+        request.json["symbols"],
+        new_uow(),
+    )
+    return {
+        "trackrefs": {symbol: position_json(trackref) for symbol, trackref in trackrefs.items()}
+    }, 201
+
+
+def position_json(position):
+    symbol, side, datetime_t = position
+    return symbol, side, datetime_t.isoformat()
+
+
+@api.route("/trackers", methods=["GET"])
+def list_trackers():
+    """Stream a symbol's trackers as NDJSON, oldest first.
+
+    Query parameters: symbol, and optionally start, end (ISO 8601), limit,
+    and after, the cursor of the last tracker of the previous response.
+    """
+    args = request.args
+    try:
+        start, end = (
+            parse_timestamp(args[name]) if name in args else None for name in ("start", "end")
+        )
+        after = None
+        if "after" in args:
+            after_datetime_t, after_id = args["after"].rsplit(",", 1)
+            after = parse_timestamp(after_datetime_t), int(after_id)
+    except ValueError as e:
+        return {"message": f"Invalid query parameter: {e}"}, 400
+
+    trackers = services.list_trackers(
+        args["symbol"],
+        start,
+        end,
+        new_uow(),
+        limit=args.get("limit", type=int),
+        after=after,
+    )
+    return Response(
+        stream_with_context(
+            json.dumps(
+                {
+                    **tracker,
+                    "datetime_t": tracker["datetime_t"].isoformat(),
+                    "cursor": f"{tracker['datetime_t'].isoformat()},{tracker['id']}",
+                }
+            ) + "\n"
+            for tracker in trackers
+        ),
+        mimetype="application/x-ndjson",
+    )
+
+
+@api.route("/position_cache", methods=["GET"])
+def position_cache_stats():
+    return services.position_cache.stats(), 200
@@ -0,0 +1,57 @@
+"""Stream tracker records from an NDJSON or CSV file into the database.
+
+    python src/ingest_trackers.py signals.ndjson --chunk-size 5000
+
+Each record needs symbol, an ISO 8601 datetime_t and position; created_at
+is optional and defaults to datetime_t.
+"""
+import argparse
+import csv
+import json
+from typing import IO, Iterator
+
+from allocation.adapters import orm
+from allocation.domain.tracker import TrackerRecord, parse_timestamp
+from allocation.service_layer import services, unit_of_work
+
+
+def read_ndjson(stream: IO[str]) -> Iterator[TrackerRecord]:
+    for line in stream:
+        if line.strip():
+            yield parse_record(json.loads(line))
+
+
+def read_csv(stream: IO[str]) -> Iterator[TrackerRecord]:
+    for record in csv.DictReader(stream):
+        yield parse_record(record)
+
+
+READERS = {"ndjson": read_ndjson, "csv": read_csv}
+
+
+def parse_record(record: dict) -> TrackerRecord:
+    created_at = record.get("created_at")
+    return TrackerRecord(
+        record["symbol"],
+        parse_timestamp(record["datetime_t"]),
+        int(record["position"]),
+        parse_timestamp(created_at) if created_at else None,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-load tracker records.")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=sorted(READERS))
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    file_format = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    orm.start_mappers()
+    with open(args.path, newline="") as stream:
+        inserted, skipped = services.ingest_trackers(
+            READERS[file_format](stream),
+            unit_of_work.SqlAlchemyUnitOfWork(),
+            chunk_size=args.chunk_size,
+        )
+    print(f"inserted {inserted} trackers, skipped {skipped} with unknown symbols")
@@ -0,0 +1,220 @@
+"""Per-route latency, database time and SQL statement counts for Flask.
+
+    metrics.instrument(app)
+
+A request is timed from before_request until its teardown, so a streamed
+response counts until its last chunk. SQLAlchemy cursor events add up the
+time spent in the database and the number of statements; the rest of the
+request is Python time. GET /metrics renders it all in the Prometheus text
+format. Figures are kept per process, so scrape every worker.
+
+With a PROFILE_SAMPLE_RATE above 0, that fraction of requests also runs
+under cProfile, and each one's stats are written to PROFILE_DIR as a .prof
+file, e.g. for `python -m pstats` or snakeviz.
+"""
+import cProfile
+import contextvars
+import os
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from flask import Flask, Response, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from allocation import config
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Bucket counts, sum and count per set of label values, as Prometheus keeps them."""
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labels=("route",)):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        # per label values: a count per bucket and one for +Inf, then sum and count
+        self._series = {}  # type: Dict[Tuple[str, ...], list]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[bucket] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        for label_values, values in series:
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            cumulative = 0
+            for le, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                bound = "+Inf" if le == float("inf") else repr(float(le))
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {values[-2]!r}")
+            lines.append(f"{self.name}_count{{{labels}}} {values[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}  # type: Dict[Tuple[str, ...], int]
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            lines.append(f"{self.name}{{{labels}}} {value}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.requests = Counter(
+            "allocation_requests_total", "Requests by route, method and status.",
+            ("route", "method", "status"),
+        )
+        self.latency = Histogram(
+            "allocation_request_duration_seconds", "Request latency by route.", LATENCY_BUCKETS
+        )
+        self.db_time = Histogram(
+            "allocation_request_db_seconds", "Time per request spent executing SQL.",
+            LATENCY_BUCKETS,
+        )
+        self.python_time = Histogram(
+            "allocation_request_python_seconds", "Time per request spent outside SQL.",
+            LATENCY_BUCKETS,
+        )
+        self.statements = Histogram(
+            "allocation_request_sql_statements", "SQL statements executed per request.",
+            STATEMENT_BUCKETS,
+        )
+
+    def render(self) -> str:
+        lines = []  # type: List[str]
+        for metric in (self.requests, self.latency, self.db_time, self.python_time, self.statements):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class RequestStats:
+    __slots__ = ("started", "db_time", "statements", "status")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_time = 0.0
+        self.statements = 0
+        self.status = 500
+
+
+# the request being served by this thread (or task), if any
+_current = contextvars.ContextVar(
+    "request_stats", default=None
+)  # type: contextvars.ContextVar[Optional[RequestStats]]
+_listening_lock = threading.Lock()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    started = conn.info.get("query_started")
+    if stats is not None and started:
+        stats.db_time += time.perf_counter() - started.pop()
+        stats.statements += 1
+
+
+def instrument_sql():
+    """Time the statements of every engine; only those inside a request count."""
+    with _listening_lock:
+        if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def instrument(
+    app: Flask,
+    profile_rate: float = config.PROFILE_SAMPLE_RATE,
+    profile_dir: str = config.PROFILE_DIR,
+) -> RequestMetrics:
+    """Measure every request of `app` and serve the results on /metrics."""
+    metrics = RequestMetrics()
+    instrument_sql()
+
+    @app.before_request
+    def start_request():
+        g.request_stats = stats = RequestStats()
+        g.request_stats_token = _current.set(stats)
+        if profile_rate and random.random() < profile_rate:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def record_status(response):
+        stats = g.get("request_stats")
+        if stats is not None:
+            stats.status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_request(exc):
+        stats = g.pop("request_stats", None)
+        if stats is None:
+            return
+        elapsed = time.perf_counter() - stats.started
+        _current.reset(g.pop("request_stats_token"))
+        # unmatched URLs share one label, so scanners cannot add series
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.requests.inc(route, request.method, str(stats.status))
+        metrics.latency.observe(elapsed, route)
+        metrics.db_time.observe(stats.db_time, route)
+        metrics.python_time.observe(max(elapsed - stats.db_time, 0.0), route)
+        metrics.statements.observe(stats.statements, route)
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            _dump_profile(profiler, profile_dir, route)
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics_endpoint():
+        return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+    return metrics
+
+
+def _dump_profile(profiler: cProfile.Profile, profile_dir: str, route: str):
+    os.makedirs(profile_dir, exist_ok=True)
+    name = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+    profiler.dump_stats(os.path.join(profile_dir, f"{name}-{time.time_ns()}-{os.getpid()}.prof"))
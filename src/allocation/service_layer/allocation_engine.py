@@ -0,0 +1,211 @@
+"""Allocate against products held in memory and write the allocations behind.
+
+The engine treats itself as the only writer of the products it holds: it
+never reads them back, so another process allocating, deallocating or
+reallocating on its own would go unnoticed. It takes an exclusive lock on
+ALLOCATION_ENGINE_LOCK_FILE, and flask_app refuses to start in any process
+that cannot get it, so serve the API from a single worker on a single host
+when the engine is on.
+
+Allocations are acknowledged as soon as they are made in memory, and are
+persisted by a background thread in one transaction per flush. An
+allocation made moments before a crash can therefore be lost. One that
+another writer made impossible in the meantime is dropped when flushed, and
+a Deallocated and an OutOfStock event are published for it. Stop the engine
+to flush whatever is still pending.
+"""
+import fcntl
+import logging
+import os
+import threading
+from collections import defaultdict, deque
+from typing import IO, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from allocation import config
+from allocation.domain import events, model
+from allocation.service_layer import messagebus, services, unit_of_work
+from allocation.service_layer.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+Delta = Tuple[str, str, model.OrderLine]  # sku, batchref, line
+
+
+class EngineAlreadyRunning(Exception):
+    """Another engine holds the lock file, so this one must not write."""
+
+
+class AllocationEngine:
+    """Keeps hot products resident and serializes allocations per SKU.
+
+    Allocating a line on a resident product costs a lock and a
+    Product.allocate, so it takes microseconds instead of a database round
+    trip. A product is loaded the first time its SKU is allocated, and
+    dropped when it is the least recently used of `max_products`.
+    """
+
+    def __init__(
+        self,
+        uow_factory: Callable[[], unit_of_work.AbstractUnitOfWork] = unit_of_work.SqlAlchemyUnitOfWork,
+        flush_interval: float = config.ALLOCATION_ENGINE_FLUSH_INTERVAL,
+        max_products: int = config.ALLOCATION_ENGINE_MAX_PRODUCTS,
+        bus: messagebus.MessageBus = messagebus.bus,
+        lock_file: str = config.ALLOCATION_ENGINE_LOCK_FILE,
+    ):
+        self.uow_factory = uow_factory
+        self.bus = bus
+        self.lock_file = lock_file
+        self._lock_handle = None  # type: Optional[IO]
+        self.flush_interval = flush_interval
+        self._products = LRUCache(maxsize=max_products)
+        self._locks = defaultdict(threading.RLock)  # type: Dict[str, threading.RLock]
+        self._locks_lock = threading.Lock()
+        self._pending = deque()  # type: Deque[Delta]
+        self._flush_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._flusher = None  # type: threading.Thread
+
+    def start(self, skus: Iterable[str] = ()):
+        """Load `skus` from the database and start flushing in the background.
+
+        Raises EngineAlreadyRunning if another engine holds the lock file.
+        """
+        self._claim_lock_file()
+        for sku in skus:
+            with self._lock_for(sku):
+                self._resident(sku)
+        self._stopping.clear()
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def stop(self):
+        """Stop the background thread and persist everything still pending."""
+        self._stopping.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        try:
+            self.flush()
+        finally:
+            self._release_lock_file()
+
+    def allocate(self, orderid: str, sku: str, qty: int) -> str:
+        line = model.OrderLine(orderid, sku, qty)
+        with self._lock_for(sku):
+            product = self._resident(sku)
+            if product.batch_holding(line) is not None:
+                raise services.already_allocated(line)
+            try:
+                batchref = product.allocate(line)
+            except model.OutOfStock:
+                # nothing is saved for it, so its event goes out straight away
+                self.bus.publish(product.events)
+                raise
+            finally:
+                # Allocated is recorded again, and published, by the flush
+                product.events.clear()
+            self._pending.append((sku, batchref, line))
+        return batchref
+
+    def evict(self, sku: str):
+        """Forget a product, e.g. after a batch was added to it behind our back.
+
+        Pending allocations are flushed before the product is loaded again.
+        """
+        self._products.invalidate(sku)
+
+    def clear(self):
+        """Forget every resident product."""
+        self._products.clear()
+
+    def flush(self) -> int:
+        """Persist the pending allocations in one transaction; returns how many."""
+        with self._flush_lock:
+            deltas = []  # type: List[Delta]
+            while self._pending:
+                deltas.append(self._pending.popleft())
+            if not deltas:
+                return 0
+            try:
+                rejected = services.retry_on_conflict(lambda: self._persist(deltas))
+            except Exception:
+                # keep them, in order, for the next flush
+                self._pending.extendleft(reversed(deltas))
+                raise
+        for sku in rejected:
+            self.evict(sku)
+        return len(deltas)
+
+    def _resident(self, sku: str) -> model.Product:
+        product = self._products.get(sku)
+        if product is None:
+            # the database must have every allocation before we read it back
+            self.flush()
+            with self.uow_factory() as uow:
+                product = uow.products.get(sku=sku)
+                if product is None:
+                    raise services.InvalidSku(f"Invalid sku {sku}")
+                # batches and allocations are eagerly loaded; detaching keeps
+                # them readable after the session closes
+                uow.session.expunge_all()
+            self._products.set(sku, product)
+        return product
+
+    def _persist(self, deltas: List[Delta]) -> Set[str]:
+        by_sku = defaultdict(list)
+        for sku, batchref, line in deltas:
+            by_sku[sku].append((batchref, line))
+
+        rejected = set()
+        dropped = []  # type: List[events.Event]
+        with self.uow_factory() as uow:
+            for sku, allocations in by_sku.items():
+                product = uow.products.get(sku=sku)
+                batches = {b.reference: b for b in product.batches} if product else {}
+                for batchref, line in allocations:
+                    batch = batches.get(batchref)
+                    if batch is None or not batch.can_allocate(line):
+                        # someone else wrote to this product; reload it next time,
+                        # and tell whoever was told the line was allocated
+                        logger.error("cannot persist %s in %s, dropping it", line, batchref)
+                        rejected.add(sku)
+                        dropped.append(events.Deallocated(line.orderid, sku, line.qty, batchref))
+                        dropped.append(events.OutOfStock(sku))
+                        continue
+                    # a copy, so this session never owns the resident graph's lines
+                    batch.allocate(model.OrderLine(line.orderid, line.sku, line.qty))
+                    product.version_number += 1
+                    product.events.append(events.Allocated(line.orderid, sku, line.qty, batchref))
+            uow.commit()
+        self.bus.publish(dropped)
+        return rejected
+
+    def _flush_periodically(self):
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("write-behind flush failed, retrying")
+
+    def _claim_lock_file(self):
+        if self._lock_handle is not None:
+            return
+        handle = open(self.lock_file, "a+")  # pylint: disable=consider-using-with
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError as e:
+            handle.close()
+            raise EngineAlreadyRunning(f"another allocation engine holds {self.lock_file}") from e
+        handle.truncate(0)
+        handle.write(str(os.getpid()))
+        handle.flush()
+        self._lock_handle = handle
+
+    def _release_lock_file(self):
+        if self._lock_handle is not None:
+            self._lock_handle.close()
+            self._lock_handle = None
+
+    def _lock_for(self, sku: str) -> threading.RLock:
+        with self._locks_lock:
+            return self._locks[sku]
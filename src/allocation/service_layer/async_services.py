@@ -0,0 +1,94 @@
+"""The services the ASGI entrypoint needs, written against an async unit of work.
+
+The rules stay in the domain model and in services: these functions only
+await the repositories and the commit, and share services' exceptions,
+retry settings and position cache.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, TypeVar
+
+from allocation import config
+from allocation.domain.asset import InvalidSymbol
+from allocation.domain.model import OrderLine, OutOfStock
+from allocation.domain.tracker import Tracker
+from allocation.service_layer import unit_of_work
+from allocation.service_layer.services import InvalidSku, backoff_delay, position_cache
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+async def retry_on_conflict(
+    attempt: Callable[[], Awaitable[T]],
+    attempts: int = config.ALLOCATE_ATTEMPTS,
+    base_delay: float = config.ALLOCATE_RETRY_DELAY,
+    max_delay: float = config.ALLOCATE_MAX_RETRY_DELAY,
+    sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+) -> T:
+    """services.retry_on_conflict, sleeping without blocking the event loop."""
+    for tries in range(1, attempts):
+        try:
+            return await attempt()
+        except unit_of_work.ConcurrencyError:
+            logger.debug("concurrent update, retrying (attempt %d)", tries)
+            await sleep(backoff_delay(tries, base_delay, max_delay))
+    return await attempt()
+
+
+async def allocate(
+    orderid: str,
+    sku: str,
+    qty: int,
+    uow: unit_of_work.AbstractAsyncUnitOfWork,
+) -> str:
+    line = OrderLine(orderid, sku, qty)
+
+    async def attempt():
+        async with uow:
+            product = await uow.products.get(sku=line.sku)
+            if product is None:
+                raise InvalidSku(f"Invalid sku {line.sku}")
+            try:
+                batchref = product.allocate(line)
+            except OutOfStock:
+                # nothing to save, but this publishes the OutOfStock event
+                await uow.commit()
+                raise
+            await uow.commit()
+        return batchref
+
+    return await retry_on_conflict(attempt)
+
+
+async def allocate_tracker(
+    symbol: str, datetime_t: datetime, position: int, uow: unit_of_work.AbstractAsyncUnitOfWork
+) -> tuple:
+    tracker = Tracker(symbol, datetime_t, position)
+    async with uow:
+        asset = await uow.assets.get(tracker.symbol)
+        if asset is None:
+            raise InvalidSymbol(f"Invalid symbol {tracker.symbol}")
+        asset.allocate_tracker(tracker)
+        result_tracker = asset.symbol, tracker.position
+        await uow.commit()
+    position_cache.invalidate(symbol)
+    return result_tracker
+
+
+async def get_position(
+    symbol: str,
+    uow: unit_of_work.AbstractAsyncUnitOfWork,
+):
+    position = position_cache.get(symbol)
+    if position is None:
+        generation = position_cache.generation(symbol)
+        async with uow:
+            result = await uow.trackers.get_latest(symbol)
+            if result is None:
+                raise InvalidSymbol(f"No position for symbol {symbol}")
+            position = result.symbol, result.position, result.datetime_t
+        position_cache.set(symbol, position, generation=generation)
+    return position
@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+Generation = Tuple[int, int]
+
+
+class LRUCache:
+    """A thread-safe, size-bounded LRU cache whose entries expire after `ttl` seconds.
+
+    `maxsize` bounds the number of entries, or their total weight when set()
+    is given one, e.g. a size in bytes. Keeps hit, miss and eviction counters
+    so callers can see how well it works.
+
+    A reader that fills the cache from a slower source takes generation(key)
+    before reading and hands it to set(), which then drops the value if the
+    key was invalidated in between, instead of caching what was just replaced.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+        self._weight = 0
+        # bumped by invalidate() per key, and by clear() for every key
+        self._generations = {}  # type: Dict[Hashable, int]
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value, _ = entry
+                if expires_at is None or expires_at > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._pop(key)
+            self.misses += 1
+            return default
+
+    def generation(self, key: Hashable) -> Generation:
+        with self._lock:
+            return self._epoch, self._generations.get(key, 0)
+
+    def set(
+        self, key: Hashable, value: Any, weight: int = 1, generation: Optional[Generation] = None
+    ) -> bool:
+        """Cache `value`; with a `generation`, only if `key` is still at it."""
+        expires_at = None if self.ttl is None else self._clock() + self.ttl
+        with self._lock:
+            if generation is not None and generation != (
+                self._epoch, self._generations.get(key, 0)
+            ):
+                return False
+            self._pop(key)
+            self._entries[key] = (expires_at, value, weight)
+            self._weight += weight
+            # an entry heavier than maxsize on its own is not kept either
+            while self._weight > self.maxsize:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._weight -= evicted
+                self.evictions += 1
+        return True
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._pop(key)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._weight = 0
+            self._generations.clear()
+            self._epoch += 1
+
+    def _pop(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._weight -= entry[2]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "weight": self._weight,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,20 @@
+"""Side effects of domain events, run by the message bus after a commit.
+
+Handlers run on a worker thread and never in the request that raised the
+event. A failing handler is logged and does not affect the others.
+"""
+import logging
+
+from allocation.domain import events
+
+logger = logging.getLogger(__name__)
+
+
+def notify_out_of_stock(event: events.OutOfStock):
+    logger.warning("out of stock for sku %s", event.sku)
+
+
+def log_tracker_allocated(event: events.TrackerAllocated):
+    logger.debug(
+        "allocated tracker %s %s at %s", event.symbol, event.position, event.datetime_t.isoformat()
+    )
@@ -0,0 +1,65 @@
+"""Dispatch domain events to their handlers on a thread pool.
+
+The unit of work publishes events once its transaction has committed, so a
+request only pays for submitting them. Handlers for one event run in the
+order they are registered, but events are not ordered across threads.
+"""
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Type
+
+from allocation import config
+from allocation.domain import events
+from allocation.service_layer import handlers
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[events.Event], None]
+
+HANDLERS = {
+    events.Allocated: [],
+    events.Deallocated: [],
+    events.OutOfStock: [handlers.notify_out_of_stock],
+    events.TrackerAllocated: [handlers.log_tracker_allocated],
+}  # type: Dict[Type[events.Event], List[Handler]]
+
+
+class MessageBus:
+    """Runs the handlers of each event on `executor`, or inline without one."""
+
+    def __init__(
+        self,
+        handlers: Dict[Type[events.Event], List[Handler]] = HANDLERS,
+        executor: Optional[Executor] = None,
+    ):
+        self.handlers = handlers
+        self.executor = executor
+
+    def publish(self, published: Iterable[events.Event]):
+        for event in published:
+            event_handlers = self.handlers.get(type(event))
+            if not event_handlers:
+                continue
+            if self.executor is None:
+                self._run(event_handlers, event)
+            else:
+                self.executor.submit(self._run, event_handlers, event)
+
+    def shutdown(self, wait: bool = True):
+        """Stop taking events; with `wait`, run the handlers already submitted."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
+
+    @staticmethod
+    def _run(event_handlers: List[Handler], event: events.Event):
+        for handler in event_handlers:
+            try:
+                handler(event)
+            except Exception:
+                logger.exception("handler %s failed for %s", handler.__name__, event)
+
+
+bus = MessageBus(
+    HANDLERS,
+    ThreadPoolExecutor(max_workers=config.EVENT_HANDLER_WORKERS, thread_name_prefix="events"),
+)
@@ -0,0 +1,89 @@
+"""Look up the best AI model for a symbol and keep its artifact in memory.
+
+Prediction workers ask for the same few models over and over. Deserializing
+an artifact costs far more than the indexed lookup of which model is best,
+so only artifacts are cached. They are keyed by filepath and modification
+time: retraining a model in place makes the next load read the new file.
+
+NumPy `.npy` weights are memory-mapped read-only instead of read into the
+heap, so every worker process on a host shares one copy in the page cache.
+Replace such a file by writing a new one and renaming it over the old path;
+truncating a mapped file under a running worker crashes that worker.
+"""
+import os
+import pickle
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, Tuple
+
+import numpy as np
+
+from allocation import config
+from allocation.domain.aimodel import AIModel
+from allocation.service_layer import services, unit_of_work
+from allocation.service_layer.cache import LRUCache
+
+ArtifactLoader = Callable[[str], Any]
+
+
+def load_pickle(filepath: str) -> Any:
+    with open(filepath, "rb") as f:
+        return pickle.load(f)
+
+
+def load_artifact(filepath: str) -> Any:
+    """Map `.npy` files read-only and unpickle everything else."""
+    if filepath.endswith(".npy"):
+        return np.load(filepath, mmap_mode="r")
+    return load_pickle(filepath)
+
+
+class ModelRegistry:
+    """Best models by (symbol, ai_type), with an LRU of deserialized artifacts.
+
+    The cache holds at most `max_bytes` of artifacts, counted by their size
+    on disk, whether they are mapped or loaded.
+    """
+
+    def __init__(
+        self,
+        uow_factory: Callable[[], unit_of_work.AbstractUnitOfWork] = unit_of_work.SqlAlchemyUnitOfWork,
+        loader: ArtifactLoader = load_artifact,
+        max_bytes: int = config.AIMODEL_CACHE_BYTES,
+    ):
+        self.uow_factory = uow_factory
+        self.loader = loader
+        self.artifacts = LRUCache(maxsize=max_bytes)
+        self._mtimes = {}  # type: Dict[str, int]
+        self._locks = defaultdict(threading.Lock)  # type: Dict[str, threading.Lock]
+        self._locks_lock = threading.Lock()
+
+    def best(self, symbol: str, ai_type: str) -> AIModel:
+        return services.get_best_model(symbol, ai_type, self.uow_factory())
+
+    def best_artifact(self, symbol: str, ai_type: str) -> Tuple[AIModel, Any]:
+        aimodel = self.best(symbol, ai_type)
+        return aimodel, self.load(aimodel.get_filepath)
+
+    def load(self, filepath: str) -> Any:
+        """The deserialized artifact at `filepath`, read again only if it changed."""
+        stat = os.stat(filepath)
+        key = filepath, stat.st_mtime_ns
+        # one load per file, however many workers miss at once
+        with self._lock_for(filepath):
+            artifact = self.artifacts.get(key)
+            if artifact is None:
+                artifact = self.loader(filepath)
+                stale = self._mtimes.get(filepath)
+                if stale is not None and stale != stat.st_mtime_ns:
+                    self.artifacts.invalidate((filepath, stale))
+                self._mtimes[filepath] = stat.st_mtime_ns
+                self.artifacts.set(key, artifact, weight=stat.st_size)
+        return artifact
+
+    def stats(self) -> dict:
+        return self.artifacts.stats()
+
+    def _lock_for(self, filepath: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks[filepath]
@@ -1,25 +1,43 @@
 from __future__ import annotations
-from typing import Optional
-from datetime import date
-import json
-from flask import jsonify
+import logging
+import random
+import time
+from collections import defaultdict
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, TypeVar, Union
+from datetime import date, datetime
 
-from allocation.domain.asset import Asset, allocate_tracker
+from allocation.domain.asset import Asset
 
 from allocation.domain.aimodel import AIModel
 from allocation.domain.model import OrderLine
+from allocation import config
 from allocation.service_layer import unit_of_work
+from allocation.service_layer.cache import LRUCache
 from allocation.domain import model
 
-from allocation.adapters.repository import AbstractBaseRepository
-from allocation.domain.tracker import Tracker
+from allocation.domain.tracker import Tracker, TrackerRecord
 from allocation.domain.asset import InvalidSymbol
 
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+position_cache = LRUCache(maxsize=config.POSITION_CACHE_SIZE, ttl=config.POSITION_CACHE_TTL)
+
 
 class InvalidSku(Exception):
     pass
 
 
+class InvalidBatchref(Exception):
+    pass
+
+
+class InvalidModel(Exception):
+    pass
+
+
 def add_batch(
     ref: str,
     sku: str,
@@ -36,6 +54,31 @@ def add_batch(
         uow.commit()
 
 
+def retry_on_conflict(
+    attempt: Callable[[], T],
+    attempts: int = config.ALLOCATE_ATTEMPTS,
+    base_delay: float = config.ALLOCATE_RETRY_DELAY,
+    max_delay: float = config.ALLOCATE_MAX_RETRY_DELAY,
+    sleep: Callable[[float], None] = time.sleep,
+) -> T:
+    """Run `attempt` until it stops raising ConcurrencyError, at most `attempts` times.
+
+    Sleeps a random ("full jitter") exponential backoff between tries, so
+    allocators racing on one hot product spread out instead of colliding again.
+    """
+    for tries in range(1, attempts):
+        try:
+            return attempt()
+        except unit_of_work.ConcurrencyError:
+            logger.debug("concurrent update, retrying (attempt %d)", tries)
+            sleep(backoff_delay(tries, base_delay, max_delay))
+    return attempt()
+
+
+def backoff_delay(tries: int, base_delay: float, max_delay: float) -> float:
+    return random.uniform(0, min(max_delay, base_delay * 2 ** tries))
+
+
 def allocate(
     orderid: str,
     sku: str,
@@ -43,48 +86,326 @@ def allocate(
     uow: unit_of_work.AbstractUnitOfWork,
 ) -> str:
     line = OrderLine(orderid, sku, qty)
+
+    def attempt():
+        with uow:
+            product = uow.products.get(sku=line.sku)
+            if product is None:
+                raise InvalidSku(f"Invalid sku {line.sku}")
+            try:
+                batchref = product.allocate(line)
+            except model.OutOfStock:
+                # nothing to save, but this publishes the OutOfStock event
+                uow.commit()
+                raise
+            uow.commit()
+        return batchref
+
+    return retry_on_conflict(attempt)
+
+
+def allocate_many(
+    lines: Iterable[Tuple[str, str, int]],
+    uow: unit_of_work.AbstractUnitOfWork,
+) -> List[Union[str, Exception]]:
+    """Allocate (orderid, sku, qty) lines in a single transaction.
+
+    Each product is loaded once. Returns, in input order, the batchref each
+    line went to or the InvalidSku/OutOfStock/AlreadyAllocated error it
+    failed with. A line is already allocated if a batch holds it from
+    before, or from earlier in the same call.
+    """
+    order_lines = [OrderLine(orderid, sku, qty) for orderid, sku, qty in lines]
+    return retry_on_conflict(lambda: _allocate_many(order_lines, uow))
+
+
+def _allocate_many(
+    order_lines: List[OrderLine],
+    uow: unit_of_work.AbstractUnitOfWork,
+) -> List[Union[str, Exception]]:
+    positions_by_sku = defaultdict(list)
+    for position, line in enumerate(order_lines):
+        positions_by_sku[line.sku].append(position)
+
+    results = [None] * len(order_lines)  # type: List
     with uow:
-        product = uow.products.get(sku=line.sku)
-        if product is None:
-            raise InvalidSku(f"Invalid sku {line.sku}")
-        batchref = product.allocate(line)
+        # load every product before changing any: a load would otherwise
+        # autoflush the products already changed, outside of commit
+        products = {sku: uow.products.get(sku=sku) for sku in positions_by_sku}
+        for sku, positions in positions_by_sku.items():
+            product = products[sku]
+            for position in positions:
+                line = order_lines[position]
+                try:
+                    if product is None:
+                        raise InvalidSku(f"Invalid sku {sku}")
+                    if product.batch_holding(line) is not None:
+                        raise already_allocated(line)
+                    results[position] = product.allocate(line)
+                except (model.OutOfStock, model.AlreadyAllocated, InvalidSku) as e:
+                    results[position] = e
         uow.commit()
-    return
+    return results
+
+
+def already_allocated(line) -> model.AlreadyAllocated:
+    return model.AlreadyAllocated(
+        f"Order line {line.orderid} is already allocated to sku {line.sku}"
+    )
+
+
+def deallocate(
+    orderid: str,
+    sku: str,
+    qty: int,
+    uow: unit_of_work.AbstractUnitOfWork,
+) -> str:
+    """Take a line off its batch; returns the batchref it was allocated to."""
+    line = OrderLine(orderid, sku, qty)
+
+    def attempt():
+        with uow:
+            product = uow.products.get(sku=line.sku)
+            if product is None:
+                raise InvalidSku(f"Invalid sku {line.sku}")
+            batchref = product.deallocate(line)
+            uow.commit()
+        return batchref
+
+    return retry_on_conflict(attempt)
+
+
+def reallocate_batch(
+    ref: str,
+    uow: unit_of_work.AbstractUnitOfWork,
+    eta: Optional[date] = None,
+    cancel: bool = False,
+) -> List[Tuple[model.LineRecord, Union[str, Exception]]]:
+    """Rebalance the lines of a batch whose ETA slipped or that was cancelled.
+
+    Every line moves off the batch and is allocated again across the
+    product's batches in a single transaction; see Product.reallocate.
+    """
+
+    def attempt():
+        with uow:
+            product = uow.products.get_by_batchref(ref)
+            if product is None:
+                raise InvalidBatchref(f"Invalid batch reference {ref}")
+            results = [
+                # the lines expire on commit, so keep plain copies
+                (model.LineRecord(line.orderid, line.sku, line.qty), result)
+                for line, result in product.reallocate(ref, eta=eta, cancel=cancel)
+            ]
+            uow.commit()
+        return results
+
+    return retry_on_conflict(attempt)
+
+
+def plan_allocations(
+    lines: Iterable[Tuple[str, str, int]],
+    uow: unit_of_work.AbstractUnitOfWork,
+) -> List[Union[str, Exception]]:
+    """Dry run of allocate_many: what each line would get, without saving anything.
+
+    Plans every line in one vectorized pass, see domain.planner.
+    """
+    # numpy is only needed here, so workers that never plan do not import it
+    from allocation.domain import planner
+
+    # only read, so the compact unmapped record is enough
+    order_lines = [model.LineRecord(orderid, sku, qty) for orderid, sku, qty in lines]
+    with uow:
+        products = {sku: uow.products.get(sku=sku) for sku in {line.sku for line in order_lines}}
+        # like allocate_many, only plan each line once, and only if no batch holds it
+        first_positions, held, fresh = {}, set(), []
+        for position, line in enumerate(order_lines):
+            key = line.orderid, line.sku, line.qty
+            if key in first_positions:
+                continue
+            first_positions[key] = position
+            product = products[line.sku]
+            if product is not None and product.batch_holding(OrderLine(*key)) is not None:
+                held.add(position)
+            else:
+                fresh.append(position)
+        plan = planner.plan_allocations(
+            [order_lines[position] for position in fresh],
+            [p for p in products.values() if p is not None],
+        )
+    planned = dict(zip(fresh, plan))
+
+    results = []  # type: List[Union[str, Exception]]
+    for position, line in enumerate(order_lines):
+        first = first_positions[line.orderid, line.sku, line.qty]
+        result = planned.get(first)
+        if first in held or (first != position and isinstance(result, str)):
+            results.append(already_allocated(line))
+        elif result is None:
+            results.append(InvalidSku(f"Invalid sku {line.sku}"))
+        else:
+            results.append(result)
+    return results
+
+
+def get_best_model(symbol: str, ai_type: str, uow: unit_of_work.AbstractUnitOfWork) -> AIModel:
+    """The `ai_type` model for `symbol` with the highest accuracy_score."""
+    with uow:
+        aimodel = uow.aimodels.get_best(symbol, ai_type)
+        if aimodel is None:
+            raise InvalidModel(f"No {ai_type} model for symbol {symbol}")
+        # leaving the uow rolls back and expires it, so hand out a copy
+        return AIModel(
+            aimodel.symbol,
+            aimodel.source,
+            aimodel.feature_counts,
+            aimodel.model_name,
+            aimodel.ai_type,
+            aimodel.hashtag,
+            aimodel.accuracy_score,
+            aimodel.created_at,
+        )
 
 
 def add_asset(
     symbol: str,
     source: str,
-    repo: AbstractBaseRepository,
-    session,
+    uow: unit_of_work.AbstractUnitOfWork,
 ) -> None:
-    repo.add(Asset(symbol, source))
-    session.commit()
-
-
-def is_valid_symbol(symbol, assets):
-    return symbol in {asset.symbol for asset in assets}
+    with uow:
+        uow.assets.add(Asset(symbol, source))
+        uow.commit()
 
 
 def allocate_tracker(
-    symbol: str, datetime_t: str, position: int, repo: AbstractBaseRepository, session
+    symbol: str, datetime_t: datetime, position: int, uow: unit_of_work.AbstractUnitOfWork
 ) -> tuple:
     tracker = Tracker(symbol, datetime_t, position)
-    print(f"tracker created_at : {tracker.created_at}")
-    assets = repo.list()
-    if not is_valid_symbol(tracker.symbol, assets):
-        raise InvalidSymbol(f"Invalid symbol {tracker.symbol}")
-    result_tracker = allocate_tracker(tracker, assets)
-    session.commit()
-    print(f"result print allocatie tracker:L {result_tracker}")
+    with uow:
+        asset = uow.assets.get(tracker.symbol)
+        if asset is None:
+            raise InvalidSymbol(f"Invalid symbol {tracker.symbol}")
+        asset.allocate_tracker(tracker)
+        result_tracker = asset.symbol, tracker.position
+        uow.commit()
+    position_cache.invalidate(symbol)
     return result_tracker
 
 
+def ingest_trackers(
+    records: Iterable[TrackerRecord],
+    uow: unit_of_work.AbstractUnitOfWork,
+    chunk_size: int = 1000,
+) -> Tuple[int, int]:
+    """Bulk-insert tracker records, committing once per chunk.
+
+    Records are consumed lazily, so memory use depends on chunk_size and not
+    on how many records there are. Records for unknown symbols are skipped.
+    A record without created_at is stamped with its datetime_t, so backfilled
+    history never becomes the latest position. Returns (inserted, skipped).
+    """
+    inserted = skipped = 0
+    touched = set()
+    with uow:
+        asset_ids = uow.assets.symbol_ids()
+        for chunk in _chunks(records, chunk_size):
+            rows = []
+            for record in chunk:
+                if record.symbol not in asset_ids:
+                    skipped += 1
+                    continue
+                rows.append(
+                    {
+                        "symbol": record.symbol,
+                        "datetime_t": record.datetime_t,
+                        "position": record.position,
+                        "created_at": record.created_at or record.datetime_t,
+                    }
+                )
+                touched.add(record.symbol)
+            uow.trackers.add_many(rows, asset_ids)
+            uow.commit()
+            inserted += len(rows)
+    for symbol in touched:
+        position_cache.invalidate(symbol)
+    return inserted, skipped
+
+
+def _chunks(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 def get_position(
     symbol: str,
-    repo: AbstractBaseRepository,
-    session,
+    uow: unit_of_work.AbstractUnitOfWork,
 ):
-    result = repo.get(symbol)
-    session.commit()
-    return result.symbol, result.position, result.datetime_t
+    position = position_cache.get(symbol)
+    if position is None:
+        # a tracker allocated while we read must not be hidden by what we read
+        generation = position_cache.generation(symbol)
+        with uow:
+            result = uow.trackers.get_latest(symbol)
+            if result is None:
+                raise InvalidSymbol(f"No position for symbol {symbol}")
+            position = result.symbol, result.position, result.datetime_t
+        position_cache.set(symbol, position, generation=generation)
+    return position
+
+
+def get_positions(
+    symbols: Iterable[str],
+    uow: unit_of_work.AbstractUnitOfWork,
+) -> dict:
+    positions = {}
+    missing = []
+    for symbol in symbols:
+        position = position_cache.get(symbol)
+        if position is None:
+            missing.append(symbol)
+        else:
+            positions[symbol] = position
+    if missing:
+        generations = {symbol: position_cache.generation(symbol) for symbol in missing}
+        with uow:
+            latest = uow.trackers.get_latest_many(missing)
+            for symbol, tracker in latest.items():
+                positions[symbol] = tracker.symbol, tracker.position, tracker.datetime_t
+                position_cache.set(symbol, positions[symbol], generation=generations[symbol])
+    return positions
+
+
+def list_trackers(
+    symbol: str,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    uow: unit_of_work.AbstractUnitOfWork,
+    limit: Optional[int] = None,
+    after: Optional[Tuple[datetime, int]] = None,
+    page_size: int = 1000,
+) -> Iterator[dict]:
+    """Yield a symbol's trackers in [start, end) oldest first, a page at a time.
+
+    `after` is the (datetime_t, id) of the last tracker already seen.
+    """
+    with uow:
+        while limit is None or limit > 0:
+            size = page_size if limit is None else min(page_size, limit)
+            page = uow.trackers.list_range(symbol, start, end, size, after=after)
+            for tracker in page:
+                yield {
+                    "id": tracker.id,
+                    "symbol": tracker.symbol,
+                    "datetime_t": tracker.datetime_t,
+                    "position": tracker.position,
+                }
+            if len(page) < size:
+                return
+            after = page[-1].datetime_t, page[-1].id
+            if limit is not None:
+                limit -= len(page)
@@ -1,25 +1,83 @@
 # pylint: disable=attribute-defined-outside-init
 from __future__ import annotations
 import abc
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from contextlib import contextmanager
+from itertools import chain
+from typing import TYPE_CHECKING, Iterator, Optional
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm.exc import StaleDataError
 from sqlalchemy.orm.session import Session
 
 from allocation import config
-from allocation.adapters import repository
+from allocation.adapters import async_repository, repository
+from allocation.domain import events
+from allocation.adapters.aimodel_repository import AbstractAIModelRepository, AIModelRepository
+from allocation.adapters.asset_repository import AbstractAssetRepository, AssetRepository
+from allocation.adapters.tracker_repository import AbstractTrackerRepository, TrackerRepository
+from allocation.service_layer import messagebus
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+
+# Postgres serialization_failure and deadlock_detected
+RETRYABLE_PGCODES = {"40001", "40P01"}
+
+
+class ConcurrencyError(Exception):
+    """Another transaction changed the data this one read; retrying may succeed."""
+
+
+def is_conflict(error: Optional[BaseException]) -> bool:
+    if isinstance(error, StaleDataError):
+        return True
+    return isinstance(error, DBAPIError) and getattr(error.orig, "pgcode", None) in RETRYABLE_PGCODES
+
+
+@contextmanager
+def conflicts_as_concurrency_errors():
+    try:
+        yield
+    except (StaleDataError, DBAPIError) as e:
+        if is_conflict(e):
+            raise ConcurrencyError(str(e)) from e
+        raise
+
+
+def collect_new_events(uow) -> Iterator[events.Event]:
+    """Take the events recorded by every product and asset the uow has seen."""
+    for aggregate in chain(uow.products.seen, uow.assets.seen):
+        while aggregate.events:
+            yield aggregate.events.pop(0)
+
+
+def discard_new_events(uow):
+    # what was rolled back never happened
+    for aggregate in chain(uow.products.seen, uow.assets.seen):
+        aggregate.events.clear()
 
 
 class AbstractUnitOfWork(abc.ABC):
     products: repository.AbstractRepository
+    assets: AbstractAssetRepository
+    trackers: AbstractTrackerRepository
+    aimodels: AbstractAIModelRepository
+    bus: messagebus.MessageBus = messagebus.bus
 
     def __enter__(self) -> AbstractUnitOfWork:
         return self
 
     def __exit__(self, *args):
         self.rollback()
+        discard_new_events(self)
 
-    @abc.abstractmethod
     def commit(self):
+        """Commit, then publish the events of what was just saved."""
+        self._commit()
+        self.bus.publish(collect_new_events(self))
+
+    @abc.abstractmethod
+    def _commit(self):
         raise NotImplementedError
 
     @abc.abstractmethod
@@ -27,29 +85,90 @@ class AbstractUnitOfWork(abc.ABC):
         raise NotImplementedError
 
 
-DEFAULT_SESSION_FACTORY = sessionmaker(
-    bind=create_engine(
-        config.get_postgres_uri(),
-        isolation_level="REPEATABLE READ",
-    )
-)
-
-
 class SqlAlchemyUnitOfWork(AbstractUnitOfWork):
-    def __init__(self, session_factory=DEFAULT_SESSION_FACTORY):
+    def __init__(self, session_factory=None, loading=None, bus=None):
+        # resolved on first use, so importing this module never connects
         self.session_factory = session_factory
+        self.loading = loading
+        if bus is not None:
+            self.bus = bus
 
     def __enter__(self):
+        if self.session_factory is None:
+            self.session_factory = config.get_session_factory()
         self.session = self.session_factory()  # type: Session
-        self.products = repository.SqlAlchemyRepository(self.session)
+        self.products = repository.SqlAlchemyRepository(self.session, self.loading)
+        self.assets = AssetRepository(self.session)
+        self.trackers = TrackerRepository(self.session)
+        self.aimodels = AIModelRepository(self.session)
         return super().__enter__()
 
-    def __exit__(self, *args):
-        super().__exit__(*args)
+    def __exit__(self, exc_type, exc, traceback):
+        super().__exit__(exc_type, exc, traceback)
         self.session.close()
+        # autoflush can hit a conflict in any query, not only in commit
+        if is_conflict(exc):
+            raise ConcurrencyError(str(exc)) from exc
 
-    def commit(self):
-        self.session.commit()
+    def _commit(self):
+        with conflicts_as_concurrency_errors():
+            self.session.commit()
 
     def rollback(self):
         self.session.rollback()
+
+
+class AbstractAsyncUnitOfWork(abc.ABC):
+    products: async_repository.AsyncSqlAlchemyRepository
+    assets: async_repository.AsyncAssetRepository
+    trackers: async_repository.AsyncTrackerRepository
+    bus: messagebus.MessageBus = messagebus.bus
+
+    async def __aenter__(self) -> AbstractAsyncUnitOfWork:
+        return self
+
+    async def __aexit__(self, *args):
+        await self.rollback()
+        discard_new_events(self)
+
+    async def commit(self):
+        await self._commit()
+        self.bus.publish(collect_new_events(self))
+
+    @abc.abstractmethod
+    async def _commit(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def rollback(self):
+        raise NotImplementedError
+
+
+class AsyncSqlAlchemyUnitOfWork(AbstractAsyncUnitOfWork):
+    def __init__(self, session_factory=None, bus=None):
+        # resolved on first use, so importing this module never needs asyncpg
+        self.session_factory = session_factory
+        if bus is not None:
+            self.bus = bus
+
+    async def __aenter__(self):
+        if self.session_factory is None:
+            self.session_factory = config.get_async_session_factory()
+        self.session = self.session_factory()  # type: AsyncSession
+        self.products = async_repository.AsyncSqlAlchemyRepository(self.session)
+        self.assets = async_repository.AsyncAssetRepository(self.session)
+        self.trackers = async_repository.AsyncTrackerRepository(self.session)
+        return await super().__aenter__()
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await super().__aexit__(exc_type, exc, traceback)
+        await self.session.close()
+        if is_conflict(exc):
+            raise ConcurrencyError(str(exc)) from exc
+
+    async def _commit(self):
+        with conflicts_as_concurrency_errors():
+            await self.session.commit()
+
+    async def rollback(self):
+        await self.session.rollback()
@@ -1,3 +1,3 @@
-from allocation.entrypoints.flask_app import app
+from allocation.entrypoints.flask_app import create_app
 
-app.run()
\ No newline at end of file
+create_app().run()
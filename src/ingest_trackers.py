@@ -0,0 +1,3 @@
+from allocation.entrypoints.ingest_trackers import main
+
+main()
\ No newline at end of file
@@ -7,7 +7,9 @@ import requests
 from requests.exceptions import ConnectionError
 from sqlalchemy.exc import OperationalError
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, clear_mappers
+from sqlalchemy.pool import NullPool
 
 from allocation.adapters.orm import metadata, start_mappers
 from allocation import config
@@ -32,6 +34,31 @@ def session(session_factory):
     return session_factory()
 
 
+@pytest.fixture
+def sqlite_file_session_factory(tmp_path):
+    # unlike :memory:, every connection sees the same database, so
+    # concurrent units of work really are separate transactions
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'allocation.db'}", connect_args={"timeout": 30}
+    )
+    metadata.create_all(engine)
+    start_mappers()
+    yield sessionmaker(bind=engine)
+    clear_mappers()
+    engine.dispose()
+
+
+@pytest.fixture
+def async_session_factory(tmp_path):
+    url = f"sqlite:///{tmp_path / 'allocation.db'}"
+    metadata.create_all(create_engine(url))
+    # no pooling: each test drives its own event loop with asyncio.run
+    engine = create_async_engine(url.replace("sqlite", "sqlite+aiosqlite", 1), poolclass=NullPool)
+    start_mappers()
+    yield sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    clear_mappers()
+
+
 def wait_for_postgres_to_come_up(engine):
     deadline = time.time() + 10
     while time.time() < deadline:
@@ -59,4 +59,26 @@ def test_unhappy_path_returns_400_and_error_message():
     url = config.get_api_url()
     r = requests.post(f"{url}/allocate", json=data)
     assert r.status_code == 400
-    assert r.json()["message"] == f"Invalid sku {unknown_sku}"
\ No newline at end of file
+    assert r.json()["message"] == f"Invalid sku {unknown_sku}"
+
+@pytest.mark.usefixtures("postgres_db")
+@pytest.mark.usefixtures("restart_api")
+def test_allocate_batch_returns_a_result_per_line():
+    sku, unknown_sku = random_sku(), random_sku("unknown")
+    batch = random_batchref()
+    post_to_add_batch(batch, sku, 10, None)
+    data = {
+        "lines": [
+            {"orderid": random_orderid(1), "sku": sku, "qty": 3},
+            {"orderid": random_orderid(2), "sku": unknown_sku, "qty": 3},
+        ]
+    }
+
+    url = config.get_api_url()
+    r = requests.post(f"{url}/allocate_batch", json=data)
+
+    assert r.status_code == 201
+    assert r.json()["results"] == [
+        {"batchref": batch},
+        {"message": f"Invalid sku {unknown_sku}"},
+    ]
@@ -0,0 +1,36 @@
+from allocation.adapters.aimodel_repository import AIModelRepository
+from allocation.domain.aimodel import AIModel
+from allocation.service_layer import services, unit_of_work
+
+
+def add_models(session, *models):
+    for symbol, model_name, ai_type, score in models:
+        session.add(AIModel(symbol, "binance", 12, model_name, ai_type, "btc", score))
+    session.commit()
+
+
+def test_get_best_returns_the_most_accurate_model_of_a_type(session):
+    add_models(
+        session,
+        ("BTCUSDT", "old", "xgboost", 54.3),
+        ("BTCUSDT", "best", "xgboost", 61.0),
+        ("BTCUSDT", "unscored", "xgboost", None),
+        ("BTCUSDT", "other-type", "lstm", 70.2),
+        ("ETHUSDT", "other-symbol", "xgboost", 90.1),
+    )
+
+    best = AIModelRepository(session).get_best("BTCUSDT", "xgboost")
+
+    assert best.model_name == "best"
+    assert AIModelRepository(session).get_best("BTCUSDT", "arima") is None
+
+
+def test_best_model_stays_readable_after_the_uow_closes(session_factory):
+    add_models(session_factory(), ("BTCUSDT", "best", "xgboost", 61.0))
+
+    best = services.get_best_model(
+        "BTCUSDT", "xgboost", unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    )
+
+    assert best.get_filepath.endswith("/btc/best")
+    assert best.accuracy_score == 61.0
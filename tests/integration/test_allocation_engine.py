@@ -0,0 +1,239 @@
+# pylint: disable=protected-access
+import threading
+from functools import partial
+
+import pytest
+from sqlalchemy import text
+
+from allocation.domain import events, model
+from allocation.service_layer import messagebus, services, unit_of_work
+from allocation.service_layer.allocation_engine import AllocationEngine, EngineAlreadyRunning
+
+
+def insert_batch(session, ref, sku, qty, eta=None, product_version=1):
+    if not session.execute(text("SELECT 1 FROM products WHERE sku=:sku"), dict(sku=sku)).first():
+        session.execute(
+            text("INSERT INTO products (sku, version_number) VALUES (:sku, :version)"),
+            dict(sku=sku, version=product_version),
+        )
+    session.execute(
+        text("INSERT INTO batches (reference, sku, _purchased_quantity, eta)"
+        " VALUES (:ref, :sku, :qty, :eta)"),
+        dict(ref=ref, sku=sku, qty=qty, eta=eta),
+    )
+    session.commit()
+
+
+def persisted(session, sku):
+    session.rollback()
+    [[version]] = session.execute(
+        text("SELECT version_number FROM products WHERE sku=:sku"), dict(sku=sku)
+    )
+    rows = session.execute(
+        text(
+            "SELECT b.reference, ol.orderid FROM allocations"
+            " JOIN batches AS b ON batch_id = b.id"
+            " JOIN order_lines AS ol ON orderline_id = ol.id"
+            " WHERE b.sku=:sku"
+        ),
+        dict(sku=sku),
+    )
+    return version, sorted(rows.all())
+
+
+@pytest.fixture
+def engine(sqlite_file_session_factory, tmp_path):
+    # no background flushes, so the tests decide when deltas are written
+    engine = AllocationEngine(
+        partial(unit_of_work.SqlAlchemyUnitOfWork, sqlite_file_session_factory),
+        flush_interval=3600,
+        lock_file=str(tmp_path / "engine.lock"),
+    )
+    yield engine
+    engine.stop()
+
+
+def test_allocations_are_written_behind(sqlite_file_session_factory, engine):
+    session = sqlite_file_session_factory()
+    insert_batch(session, "batch1", "LAMP", 10)
+    engine.start(["LAMP"])
+
+    assert engine.allocate("o1", "LAMP", 3) == "batch1"
+    assert engine.allocate("o2", "LAMP", 3) == "batch1"
+    assert persisted(session, "LAMP") == (1, [])
+
+    assert engine.flush() == 2
+    assert persisted(session, "LAMP") == (3, [("batch1", "o1"), ("batch1", "o2")])
+
+
+def test_allocated_events_are_published_once_flushed(sqlite_file_session_factory):
+    published = []
+    bus = messagebus.MessageBus(
+        {events.Allocated: [published.append], events.OutOfStock: [published.append]}
+    )
+    engine = AllocationEngine(
+        partial(unit_of_work.SqlAlchemyUnitOfWork, sqlite_file_session_factory, bus=bus),
+        flush_interval=3600,
+        bus=bus,
+    )
+    insert_batch(sqlite_file_session_factory(), "batch1", "LAMP", 10)
+
+    engine.allocate("o1", "LAMP", 3)
+    with pytest.raises(model.OutOfStock):
+        engine.allocate("o2", "LAMP", 8)
+    assert published == [events.OutOfStock("LAMP")]
+
+    engine.flush()
+    assert published[1:] == [events.Allocated("o1", "LAMP", 3, "batch1")]
+
+
+def test_resident_products_are_not_reloaded(sqlite_file_session_factory, engine):
+    session = sqlite_file_session_factory()
+    insert_batch(session, "batch1", "LAMP", 10)
+    engine.allocate("o1", "LAMP", 1)
+    loads = []
+    engine.uow_factory = lambda: loads.append(1) or unit_of_work.SqlAlchemyUnitOfWork(
+        sqlite_file_session_factory
+    )
+
+    engine.allocate("o2", "LAMP", 1)
+
+    assert loads == []
+
+
+def test_allocate_errors_like_the_service(sqlite_file_session_factory, engine):
+    session = sqlite_file_session_factory()
+    insert_batch(session, "batch1", "LAMP", 10)
+
+    with pytest.raises(services.InvalidSku, match="Invalid sku NONEXISTENT"):
+        engine.allocate("o1", "NONEXISTENT", 1)
+    with pytest.raises(model.OutOfStock):
+        engine.allocate("o1", "LAMP", 11)
+    assert engine.flush() == 0
+
+
+def test_a_line_is_only_allocated_once(sqlite_file_session_factory, engine):
+    session = sqlite_file_session_factory()
+    insert_batch(session, "early", "LAMP", 5, eta="2023-01-01")
+    insert_batch(session, "late", "LAMP", 5, eta="2023-02-01")
+    engine.allocate("o1", "LAMP", 5)
+
+    with pytest.raises(model.AlreadyAllocated, match="o1"):
+        engine.allocate("o1", "LAMP", 5)
+
+    engine.flush()
+    assert persisted(session, "LAMP")[1] == [("early", "o1")]
+
+
+def test_stop_flushes_pending_allocations(sqlite_file_session_factory, engine):
+    session = sqlite_file_session_factory()
+    insert_batch(session, "batch1", "LAMP", 10)
+    engine.start()
+    engine.allocate("o1", "LAMP", 3)
+
+    engine.stop()
+
+    assert persisted(session, "LAMP") == (2, [("batch1", "o1")])
+
+
+def test_evicted_products_are_reloaded_after_a_flush(sqlite_file_session_factory, engine):
+    session = sqlite_file_session_factory()
+    insert_batch(session, "batch1", "LAMP", 10)
+    engine.allocate("o1", "LAMP", 10)
+    insert_batch(session, "batch2", "LAMP", 10)
+    with pytest.raises(model.OutOfStock):
+        engine.allocate("o2", "LAMP", 10)
+
+    engine.evict("LAMP")
+
+    assert engine.allocate("o2", "LAMP", 10) == "batch2"
+    engine.flush()
+    assert persisted(session, "LAMP") == (3, [("batch1", "o1"), ("batch2", "o2")])
+
+
+def test_concurrent_allocations_never_oversell(sqlite_file_session_factory, engine):
+    session = sqlite_file_session_factory()
+    insert_batch(session, "batch1", "LAMP", 50)
+    engine.start()
+    results = []
+
+    def allocate(orderid):
+        try:
+            results.append(engine.allocate(orderid, "LAMP", 1))
+        except model.OutOfStock as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=allocate, args=(f"o{i}",)) for i in range(80)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.stop()
+
+    assert results.count("batch1") == 50
+    version, rows = persisted(session, "LAMP")
+    assert version == 51
+    assert len(rows) == 50
+
+
+def test_allocations_another_writer_made_impossible_are_dropped(
+    sqlite_file_session_factory, engine
+):
+    session = sqlite_file_session_factory()
+    insert_batch(session, "batch1", "LAMP", 10)
+    engine.allocate("o1", "LAMP", 10)
+    services.allocate("other", "LAMP", 5, unit_of_work.SqlAlchemyUnitOfWork(sqlite_file_session_factory))
+
+    engine.flush()
+
+    assert persisted(session, "LAMP") == (2, [("batch1", "other")])
+    assert engine._products.get("LAMP") is None
+
+
+def test_dropped_allocations_are_published_as_deallocated_and_out_of_stock(
+    sqlite_file_session_factory,
+):
+    published = []
+    bus = messagebus.MessageBus(
+        {
+            events.Allocated: [published.append],
+            events.Deallocated: [published.append],
+            events.OutOfStock: [published.append],
+        }
+    )
+    engine = AllocationEngine(
+        partial(unit_of_work.SqlAlchemyUnitOfWork, sqlite_file_session_factory, bus=bus),
+        flush_interval=3600,
+        bus=bus,
+    )
+    session = sqlite_file_session_factory()
+    insert_batch(session, "batch1", "LAMP", 10)
+    engine.allocate("o1", "LAMP", 4)
+    engine.allocate("o2", "LAMP", 6)
+    services.allocate("other", "LAMP", 5, unit_of_work.SqlAlchemyUnitOfWork(sqlite_file_session_factory))
+    published.clear()
+
+    engine.flush()
+
+    assert published == [
+        events.Allocated("o1", "LAMP", 4, "batch1"),
+        events.Deallocated("o2", "LAMP", 6, "batch1"),
+        events.OutOfStock("LAMP"),
+    ]
+    assert persisted(session, "LAMP") == (3, [("batch1", "o1"), ("batch1", "other")])
+
+
+def test_only_one_engine_can_run_at_a_time(sqlite_file_session_factory, engine):
+    other = AllocationEngine(
+        partial(unit_of_work.SqlAlchemyUnitOfWork, sqlite_file_session_factory),
+        flush_interval=3600,
+        lock_file=engine.lock_file,
+    )
+    engine.start()
+
+    with pytest.raises(EngineAlreadyRunning):
+        other.start()
+
+    engine.stop()
+    other.start()
+    other.stop()
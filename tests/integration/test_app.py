@@ -0,0 +1,90 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from allocation import config
+from allocation.entrypoints import flask_app
+from allocation.service_layer.allocation_engine import EngineAlreadyRunning
+
+
+def test_app_allocates_with_the_given_session_factory(session_factory):
+    client = flask_app.create_app(session_factory).test_client()
+    response = client.post("/add_batch", json={"ref": "b1", "sku": "LAMP", "qty": 10, "eta": None})
+    assert response.status_code == 201
+
+    response = client.post("/allocate", json={"orderid": "o1", "sku": "LAMP", "qty": 2})
+
+    assert response.status_code == 201
+    assert response.json["batchref"] == "b1"
+
+
+def test_apps_can_be_created_more_than_once(session_factory):
+    first = flask_app.create_app(session_factory)
+    second = flask_app.create_app(session_factory)
+
+    assert first is not second
+    assert second.test_client().post("/position", json={"symbol": "NONE"}).status_code == 400
+
+
+def test_importing_the_app_needs_no_database_settings():
+    env = {k: v for k, v in os.environ.items() if not k.startswith(("PSQL_", "API_"))}
+    code = (
+        "import allocation.entrypoints.flask_app, allocation.service_layer.unit_of_work; "
+        "import sys; assert 'numpy' not in sys.modules, 'numpy imported'"
+    )
+
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
+
+
+def test_only_one_app_starts_while_the_allocation_engine_is_on(
+    session_factory, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(config, "ALLOCATION_ENGINE", True)
+    monkeypatch.setattr(config, "ALLOCATION_ENGINE_LOCK_FILE", str(tmp_path / "engine.lock"))
+    writer = flask_app.create_app(session_factory)
+    try:
+        with pytest.raises(EngineAlreadyRunning):
+            flask_app.create_app(session_factory)
+    finally:
+        writer.extensions["allocation_engine"].stop()
+
+
+def test_allocate_batch_reports_repeated_lines_with_the_engine_on(
+    sqlite_file_session_factory, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(config, "ALLOCATION_ENGINE", True)
+    monkeypatch.setattr(config, "ALLOCATION_ENGINE_LOCK_FILE", str(tmp_path / "engine.lock"))
+    app = flask_app.create_app(sqlite_file_session_factory)
+    try:
+        client = app.test_client()
+        for ref, eta in (("early", "2023-01-01"), ("late", "2023-02-01")):
+            client.post("/add_batch", json={"ref": ref, "sku": "DESK", "qty": 5, "eta": eta})
+
+        response = client.post(
+            "/allocate_batch", json={"lines": [{"orderid": "o1", "sku": "DESK", "qty": 5}] * 2}
+        )
+
+        first, second = response.json["results"]
+        assert first == {"batchref": "early"}
+        assert "already allocated" in second["message"]
+    finally:
+        app.extensions["allocation_engine"].stop()
+
+
+@pytest.mark.parametrize(
+    "dry_run, allocated", [("true", False), ("1", False), ("false", True), ("0", True)]
+)
+def test_allocate_batch_only_plans_when_dry_run_is_true(session_factory, dry_run, allocated):
+    client = flask_app.create_app(session_factory).test_client()
+    client.post("/add_batch", json={"ref": "b1", "sku": "RUG", "qty": 5, "eta": None})
+    lines = {"lines": [{"orderid": "o1", "sku": "RUG", "qty": 5}]}
+
+    response = client.post(f"/allocate_batch?dry_run={dry_run}", json=lines)
+
+    assert response.json["results"] == [{"batchref": "b1"}]
+    response = client.post("/allocate", json={"orderid": "o2", "sku": "RUG", "qty": 5})
+    assert (response.status_code == 400) is allocated
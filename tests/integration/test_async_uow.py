@@ -0,0 +1,112 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+
+from allocation.domain import model
+from allocation.domain.asset import InvalidSymbol
+from allocation.service_layer import async_services, services, unit_of_work
+
+
+@pytest.fixture(autouse=True)
+def empty_position_cache():
+    services.position_cache.clear()
+
+
+async def insert_batch(session_factory, ref, sku, qty, product_version=1):
+    async with session_factory() as session:
+        await session.execute(
+            text("INSERT INTO products (sku, version_number) VALUES (:sku, :version)"),
+            dict(sku=sku, version=product_version),
+        )
+        await session.execute(
+            text("INSERT INTO batches (reference, sku, _purchased_quantity, eta)"
+            " VALUES (:ref, :sku, :qty, NULL)"),
+            dict(ref=ref, sku=sku, qty=qty),
+        )
+        await session.commit()
+
+
+async def scalar(session_factory, sql, **params):
+    async with session_factory() as session:
+        return (await session.execute(text(sql), params)).scalar()
+
+
+def test_async_uow_allocates_and_bumps_the_version(async_session_factory):
+    async def scenario():
+        await insert_batch(async_session_factory, "batch1", "ASYNC-LAMP", 100)
+        batchref = await async_services.allocate(
+            "o1", "ASYNC-LAMP", 10, unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory)
+        )
+        version = await scalar(async_session_factory, "SELECT version_number FROM products")
+        allocated = await scalar(async_session_factory, "SELECT count(*) FROM allocations")
+        return batchref, version, allocated
+
+    assert asyncio.run(scenario()) == ("batch1", 2, 1)
+
+
+def test_async_allocate_errors_like_the_sync_service(async_session_factory):
+    async def scenario():
+        await insert_batch(async_session_factory, "batch1", "ASYNC-LAMP", 5)
+        uow = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory)
+        with pytest.raises(services.InvalidSku, match="Invalid sku NONEXISTENT"):
+            await async_services.allocate("o1", "NONEXISTENT", 1, uow)
+        with pytest.raises(model.OutOfStock):
+            await async_services.allocate("o1", "ASYNC-LAMP", 10, uow)
+
+    asyncio.run(scenario())
+
+
+def test_async_uow_rolls_back_uncommitted_work(async_session_factory):
+    async def scenario():
+        await insert_batch(async_session_factory, "batch1", "ASYNC-LAMP", 100)
+        uow = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory)
+        async with uow:
+            product = await uow.products.get(sku="ASYNC-LAMP")
+            product.allocate(model.OrderLine("o1", "ASYNC-LAMP", 10))
+        return await scalar(async_session_factory, "SELECT count(*) FROM allocations")
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_async_stale_product_version_is_a_concurrency_error(async_session_factory):
+    async def scenario():
+        await insert_batch(async_session_factory, "batch1", "ASYNC-LAMP", 100)
+        first = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory)
+        second = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory)
+        async with first, second:
+            (await first.products.get(sku="ASYNC-LAMP")).allocate(
+                model.OrderLine("o1", "ASYNC-LAMP", 10)
+            )
+            (await second.products.get(sku="ASYNC-LAMP")).allocate(
+                model.OrderLine("o2", "ASYNC-LAMP", 10)
+            )
+            await first.commit()
+            with pytest.raises(unit_of_work.ConcurrencyError):
+                await second.commit()
+
+    asyncio.run(scenario())
+
+
+def test_async_allocate_tracker_and_get_position(async_session_factory):
+    async def scenario():
+        async with async_session_factory() as session:
+            await session.execute(
+                text("INSERT INTO assets (symbol, source) VALUES ('BTCUSDT', 'binance')")
+            )
+            await session.commit()
+        uow = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory)
+        with pytest.raises(InvalidSymbol):
+            await async_services.get_position("BTCUSDT", uow)
+        assetref = await async_services.allocate_tracker(
+            "BTCUSDT", datetime(2023, 3, 1, 12), 1, uow
+        )
+        position = await async_services.get_position("BTCUSDT", uow)
+        linked = await scalar(async_session_factory, "SELECT count(*) FROM allocations_tracker")
+        return assetref, position, linked
+
+    assetref, position, linked = asyncio.run(scenario())
+    assert assetref == ("BTCUSDT", 1)
+    assert position == ("BTCUSDT", 1, datetime(2023, 3, 1, 12))
+    assert linked == 1
@@ -0,0 +1,68 @@
+import pstats
+
+from flask import Flask, Response, stream_with_context
+from sqlalchemy import text
+
+from allocation.entrypoints import metrics
+
+
+def make_app(db, **kwargs):
+    app = Flask(__name__)
+    metrics.instrument(app, **kwargs)
+
+    @app.route("/query/<int:times>")
+    def query(times):
+        with db.connect() as connection:
+            for _ in range(times):
+                connection.execute(text("SELECT 1"))
+        return "OK"
+
+    @app.route("/stream")
+    def stream():
+        def rows():
+            with db.connect() as connection:
+                for _ in range(3):
+                    yield str(connection.execute(text("SELECT 1")).scalar())
+
+        return Response(stream_with_context(rows()))
+
+    return app
+
+
+def scrape(client) -> str:
+    response = client.get("/metrics")
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    return response.get_data(as_text=True)
+
+
+def test_counts_statements_and_requests_per_route(in_memory_db):
+    client = make_app(in_memory_db).test_client()
+    client.get("/query/2")
+    client.get("/query/5")
+    client.get("/nowhere")
+
+    scraped = scrape(client)
+
+    route = 'route="/query/<int:times>"'
+    assert f"allocation_request_sql_statements_sum{{{route}}} 7.0" in scraped
+    assert f'allocation_request_sql_statements_bucket{{{route},le="2.0"}} 1' in scraped
+    assert f'allocation_request_sql_statements_bucket{{{route},le="+Inf"}} 2' in scraped
+    assert f"allocation_request_duration_seconds_count{{{route}}} 2" in scraped
+    assert f"allocation_request_db_seconds_count{{{route}}} 2" in scraped
+    assert f'allocation_requests_total{{{route},method="GET",status="200"}} 2' in scraped
+    assert 'allocation_requests_total{route="unmatched",method="GET",status="404"} 1' in scraped
+
+
+def test_streamed_responses_are_measured_until_the_last_chunk(in_memory_db):
+    client = make_app(in_memory_db).test_client()
+    assert client.get("/stream").get_data(as_text=True) == "111"
+
+    assert 'allocation_request_sql_statements_sum{route="/stream"} 3.0' in scrape(client)
+
+
+def test_sampled_requests_dump_a_profile(in_memory_db, tmp_path):
+    client = make_app(in_memory_db, profile_rate=1.0, profile_dir=str(tmp_path)).test_client()
+    client.get("/query/1")
+
+    [dump] = tmp_path.glob("query_int_times-*.prof")
+    assert pstats.Stats(str(dump)).total_calls > 0
@@ -2,7 +2,7 @@ from allocation.domain import model
 from allocation.domain.tracker import Tracker
 from allocation.domain.asset import Asset
 from allocation.domain.aimodel import AIModel
-from datetime import date
+from datetime import date, datetime
 from sqlalchemy import text
 
 
@@ -91,39 +91,75 @@ def test_retrieving_allocations(session):
     batch = session.query(model.Batch).one()
 
     assert batch._allocations == {model.OrderLine("order1", "sku1", 12)}
+    assert batch.allocated_quantity == 12
+
+
+def test_allocated_quantity_survives_reloading_allocations(session):
+    batch = model.Batch("batch1", "sku1", 100, eta=None)
+    batch.allocate(model.OrderLine("order1", "sku1", 10))
+    session.add(batch)
+    session.commit()
+    session.execute(
+        text('INSERT INTO order_lines (orderid, sku, qty) VALUES ("order2", "sku1", 7)')
+    )
+    session.execute(text(
+        "INSERT INTO allocations (orderline_id, batch_id)"
+        ' SELECT id, :bid FROM order_lines WHERE orderid="order2"'),
+        dict(bid=batch.id),
+    )
+    session.expire(batch)
+
+    assert batch.allocated_quantity == 17
+    batch.deallocate(model.OrderLine("order1", "sku1", 10))
+    assert batch.allocated_quantity == sum(l.qty for l in batch._allocations) == 7
     
     
+def test_products_see_stock_added_to_a_batch_by_a_refresh(session):
+    early = model.Batch("early", "sku1", 10, eta=date(2011, 4, 11))
+    late = model.Batch("late", "sku1", 10, eta=date(2011, 4, 12))
+    product = model.Product("sku1", [early, late])
+    product.allocate(model.OrderLine("order1", "sku1", 10))
+    session.add(product)
+    session.flush()
+    session.execute(text(
+        'UPDATE batches SET _purchased_quantity = 20 WHERE reference = "early"'
+    ))
+    session.refresh(early)
+
+    assert product.allocate(model.OrderLine("order2", "sku1", 5)) == "early"
+
+
 def test_saving_trackers(session):
-    tr = Tracker("BTkUSDT", "2023-03-12 16:00:00+00:00", 1)
+    tr = Tracker("BTkUSDT", datetime(2023, 3, 12, 16), 1)
     session.add(tr)
     session.commit()
     rows = session.execute(text(
         'SELECT symbol, datetime_t, position FROM "trackers"'
     ))
-    assert list(rows) == [("BTkUSDT", "2023-03-12 16:00:00+00:00", 1)]
+    assert list(rows) == [("BTkUSDT", "2023-03-12 16:00:00.000000", 1)]
     
     
 def test_tracker_mapper_can_load(session):
     session.execute(text(
         "INSERT INTO trackers (symbol, datetime_t, position) VALUES "
-        '("btcusdt", "RED-CHAIR", 12),'
-        '("zecusd", "RED-TABLE", 13),'
-        '("order2", "BLUE-LIPSTICK", 14)'
+        '("btcusdt", "2023-03-12 16:00:00", 12),'
+        '("zecusd", "2023-03-12 17:00:00", 13),'
+        '("order2", "2023-03-12 18:00:00", 14)'
     ))
     expected = [
-        Tracker("btcusdt", "RED-CHAIR", 12),
-        Tracker("zecusd", "RED-TABLE", 13),
-        Tracker("order2", "BLUE-LIPSTICK", 14),
+        Tracker("btcusdt", datetime(2023, 3, 12, 16), 12),
+        Tracker("zecusd", datetime(2023, 3, 12, 17), 13),
+        Tracker("order2", datetime(2023, 3, 12, 18), 14),
     ]
     assert session.query(Tracker).all() == expected
 
 def test_tracker_mapper_can_save(session):
-    new_line = Tracker("order1", "DECORATIVE-WIDGET", 12)
+    new_line = Tracker("order1", datetime(2023, 3, 12, 16, 30), 12)
     session.add(new_line)
     session.commit()
 
     rows = list(session.execute(text('SELECT symbol, datetime_t, position FROM "trackers"')))
-    assert rows == [("order1", "DECORATIVE-WIDGET", 12)]  
+    assert rows == [("order1", "2023-03-12 16:30:00.000000", 12)]  
     
 def test_retrieving_assets(session):
     session.execute(text(
@@ -154,7 +190,7 @@ def test_saving_assets(session):
     
 def test_saving_allocations_tracker(session):
     batch = Asset("batch1", "sku1")
-    line = Tracker("batch1", "sku222", 10)
+    line = Tracker("batch1", datetime(2023, 3, 12, 16), 10)
     batch.allocate_tracker(line)
     session.add(batch)
     session.commit()
@@ -164,11 +200,11 @@ def test_saving_allocations_tracker(session):
     
 def test_retrieving_allocations_tarcker(session):
     session.execute(
-        text('INSERT INTO trackers (symbol, datetime_t, position) VALUES ("order1", "sku1", 12)')
+        text('INSERT INTO trackers (symbol, datetime_t, position) VALUES ("order1", "2023-03-12 16:00:00.000000", 12)')
     )
     [[olid]] = session.execute(
         text("SELECT id FROM trackers WHERE symbol=:orderid AND datetime_t=:sku"),
-        dict(orderid="order1", sku="sku1"),
+        dict(orderid="order1", sku="2023-03-12 16:00:00.000000"),
     )
     session.execute(text(
         "INSERT INTO assets (symbol, source)"
@@ -185,7 +221,7 @@ def test_retrieving_allocations_tarcker(session):
 
     batch = session.query(Asset).one()
 
-    assert batch._allocations_tracker == {Tracker("order1", "sku1", 12)}
+    assert set(batch._allocations_tracker) == {Tracker("order1", datetime(2023, 3, 12, 16), 12)}
     
     
 def test_aimodel_mapper_can_save(session):
@@ -1,7 +1,8 @@
 # pylint: disable=protected-access
+import pytest
 from allocation.domain import model
 from allocation.adapters import repository
-from sqlalchemy import text
+from sqlalchemy import event, text
 
 
 def test_repository_can_save_a_batch(session):
@@ -67,3 +68,68 @@ def test_repository_can_retrieve_a_batch_with_allocations(session):
         model.OrderLine("order1", "GENERIC-SOFA", 12),
     }
 
+
+
+def insert_product_with_allocated_batches(session, sku, batch_count):
+    session.execute(text("INSERT INTO products (sku) VALUES (:sku)"), dict(sku=sku))
+    for i in range(batch_count):
+        session.execute(text(
+            "INSERT INTO batches (reference, sku, _purchased_quantity, eta)"
+            " VALUES (:ref, :sku, 10, null)"),
+            dict(ref=f"batch{i}", sku=sku),
+        )
+        for orderid in (f"order{i}a", f"order{i}b"):
+            session.execute(text(
+                "INSERT INTO order_lines (orderid, sku, qty) VALUES (:orderid, :sku, 5)"),
+                dict(orderid=orderid, sku=sku),
+            )
+        session.execute(text(
+            "INSERT INTO allocations (orderline_id, batch_id)"
+            " SELECT order_lines.id, batches.id FROM order_lines, batches"
+            " WHERE order_lines.orderid LIKE :prefix AND batches.reference=:ref"),
+            dict(prefix=f"order{i}_", ref=f"batch{i}"),
+        )
+    session.commit()
+
+
+def count_selects_while_allocating(session, engine, strategy):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        repo = repository.SqlAlchemyRepository(session, loading={"get": strategy})
+        product = repo.get("FULL-SHELF")
+        with pytest.raises(model.OutOfStock):
+            product.allocate(model.OrderLine("order-new", "FULL-SHELF", 1))
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    return len(statements)
+
+
+@pytest.mark.parametrize("strategy, expected", [("selectin", 3), ("joined", 1)])
+def test_eager_loading_avoids_n_plus_1_selects(session, in_memory_db, strategy, expected):
+    insert_product_with_allocated_batches(session, "FULL-SHELF", 50)
+
+    assert count_selects_while_allocating(session, in_memory_db, strategy) == expected
+
+
+def test_lazy_loading_selects_once_per_batch(session, in_memory_db):
+    insert_product_with_allocated_batches(session, "FULL-SHELF", 50)
+
+    assert count_selects_while_allocating(session, in_memory_db, "lazy") > 50
+
+
+@pytest.mark.parametrize("strategy", ["selectin", "joined"])
+def test_get_by_batchref_loads_the_whole_product(session, strategy):
+    insert_product_with_allocated_batches(session, "FULL-SHELF", 5)
+    repo = repository.SqlAlchemyRepository(session, loading={"get": strategy})
+
+    product = repo.get_by_batchref("batch3")
+
+    assert product.sku == "FULL-SHELF"
+    assert len(product.batches) == 5
+    assert repo.get_by_batchref("nonexistent") is None
@@ -1,10 +1,15 @@
 from allocation.domain.tracker import Tracker
 from allocation.domain.asset import Asset
 
+from allocation.adapters import migrations
 from allocation.adapters.asset_repository import AssetRepository
 from allocation.adapters.tracker_repository import TrackerRepository
 
-from sqlalchemy import text
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import IntegrityError
 
 
 def test_repository_can_save_a_asset(session):
@@ -23,11 +28,11 @@ def test_repository_can_save_a_asset(session):
 def insert_tracker(session):
     session.execute(text(
         "INSERT INTO trackers (symbol, datetime_t, position)"
-        ' VALUES ("batch1", "GENERIC-SOFA", 12)')
+        ' VALUES ("batch1", "2023-03-12 16:00:00.000000", 12)')
     )
     [[orderline_id]] = session.execute(text(
         "SELECT id FROM trackers WHERE symbol=:orderid AND datetime_t=:sku"),
-        dict(orderid="batch1", sku="GENERIC-SOFA"),
+        dict(orderid="batch1", sku="2023-03-12 16:00:00.000000"),
     )
     return orderline_id
 
@@ -66,6 +71,192 @@ def test_repository_can_retrieve_a_asset_with_allocations(session):
     assert retrieved == expected  # Batch.__eq__ only compares reference
     assert retrieved.symbol == expected.symbol
     assert retrieved.source == expected.source
-    assert retrieved._allocations_tracker == {
-        Tracker("batch1", "GENERIC-SOFA", 12),
-    }
\ No newline at end of file
+    assert set(retrieved._allocations_tracker) == {
+        Tracker("batch1", datetime(2023, 3, 12, 16), 12),
+    }
+
+def test_asset_symbols_are_unique(session):
+    repo = AssetRepository(session)
+    repo.add(Asset("BTCUSDT", "binance"))
+    session.commit()
+
+    repo.add(Asset("BTCUSDT", "coinbase"))
+    with pytest.raises(IntegrityError):
+        session.commit()
+
+
+def test_asset_symbol_is_indexed(in_memory_db):
+    [index] = inspect(in_memory_db).get_indexes("assets")
+    assert index["column_names"] == ["symbol"]
+    assert index["unique"]
+
+
+
+def insert_tracker_at(session, symbol, position, created_at):
+    session.execute(text(
+        "INSERT INTO trackers (symbol, datetime_t, position, created_at)"
+        " VALUES (:symbol, :created_at, :position, :created_at)"),
+        dict(symbol=symbol, position=position, created_at=created_at),
+    )
+
+
+def test_get_latest_returns_the_most_recent_tracker(session):
+    insert_tracker_at(session, "BTCUSDT", 1, "2023-03-12 17:00:00.000000")
+    insert_tracker_at(session, "BTCUSDT", -1, "2023-03-12 18:00:00.000000")
+    insert_tracker_at(session, "BTCUSDT", 0, "2023-03-12 16:00:00.000000")
+    insert_tracker_at(session, "ETHUSDT", 1, "2023-03-12 19:00:00.000000")
+
+    repo = TrackerRepository(session)
+
+    assert repo.get_latest("BTCUSDT").position == -1
+    assert repo.get_latest("XRPUSDT") is None
+
+
+def test_get_latest_many_returns_one_tracker_per_symbol(session):
+    insert_tracker_at(session, "BTCUSDT", 1, "2023-03-12 17:00:00.000000")
+    insert_tracker_at(session, "BTCUSDT", -1, "2023-03-12 18:00:00.000000")
+    insert_tracker_at(session, "ETHUSDT", 1, "2023-03-12 19:00:00.000000")
+    insert_tracker_at(session, "ETHUSDT", 0, "2023-03-12 15:00:00.000000")
+    insert_tracker_at(session, "XRPUSDT", 1, "2023-03-12 15:00:00.000000")
+
+    repo = TrackerRepository(session)
+    latest = repo.get_latest_many(["BTCUSDT", "ETHUSDT", "DOGEUSDT"])
+
+    assert {symbol: t.position for symbol, t in latest.items()} == {"BTCUSDT": -1, "ETHUSDT": 1}
+
+
+
+def test_add_many_inserts_trackers_and_links_them_to_assets(session):
+    btc_id = insert_asset(session, "BTCUSDT")
+    eth_id = insert_asset(session, "ETHUSDT")
+    rows = [
+        dict(symbol=symbol, datetime_t=datetime(2023, 3, 12, 10 + i), position=i, created_at=None)
+        for i, symbol in enumerate(["BTCUSDT", "ETHUSDT", "BTCUSDT"])
+    ]
+
+    TrackerRepository(session).add_many(rows, {"BTCUSDT": btc_id, "ETHUSDT": eth_id})
+    session.commit()
+
+    links = session.execute(text(
+        "SELECT t.symbol, t.position, a.symbol FROM allocations_tracker"
+        " JOIN trackers AS t ON t.id = tracker_id JOIN assets AS a ON a.id = asset_id"
+        " ORDER BY t.position"
+    ))
+    assert list(links) == [
+        ("BTCUSDT", 0, "BTCUSDT"),
+        ("ETHUSDT", 1, "ETHUSDT"),
+        ("BTCUSDT", 2, "BTCUSDT"),
+    ]
+
+
+def test_add_many_links_its_own_rows_when_another_writer_inserts_too(session, in_memory_db):
+    btc_id = insert_asset(session, "BTCUSDT")
+    rows = [
+        dict(symbol="BTCUSDT", datetime_t=datetime(2023, 3, 12, 10 + i), position=i)
+        for i in range(2)
+    ]
+    intruded = []
+
+    def another_writer(conn, cursor, statement, *args):
+        if statement.startswith("INSERT INTO trackers") and not intruded:
+            intruded.append(True)
+            conn.exec_driver_sql(
+                "INSERT INTO trackers (symbol, datetime_t, position)"
+                " VALUES ('ETHUSDT', '2023-03-12 09:00:00', 7)"
+            )
+
+    event.listen(in_memory_db, "after_cursor_execute", another_writer)
+    try:
+        TrackerRepository(session).add_many(rows, {"BTCUSDT": btc_id})
+    finally:
+        event.remove(in_memory_db, "after_cursor_execute", another_writer)
+    session.commit()
+
+    linked = session.execute(text(
+        "SELECT t.symbol, t.position FROM allocations_tracker"
+        " JOIN trackers AS t ON t.id = tracker_id ORDER BY t.position"
+    ))
+    assert list(linked) == [("BTCUSDT", 0), ("BTCUSDT", 1)]
+
+
+def test_allocating_a_tracker_does_not_load_the_history(session, in_memory_db):
+    asset_id = insert_asset(session, "BTCUSDT")
+    for hour in range(10, 15):
+        insert_tracker_at(session, "BTCUSDT", 1, f"2023-03-12 {hour}:00:00.000000")
+        insert_allocation_tracker(session, session.execute(text("SELECT max(id) FROM trackers")).scalar(), asset_id)
+    asset = AssetRepository(session).get("BTCUSDT")
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(in_memory_db, "before_cursor_execute", record)
+
+    asset.allocate_tracker(Tracker("BTCUSDT", datetime(2023, 3, 12, 15), -1))
+    session.commit()
+
+    event.remove(in_memory_db, "before_cursor_execute", record)
+    assert not [s for s in statements if s.lstrip().upper().startswith("SELECT")]
+
+
+def test_pages_through_the_tracker_history(session):
+    asset_id = insert_asset(session, "BTCUSDT")
+    insert_asset(session, "ETHUSDT")
+    for hour in (10, 13, 11, 12):
+        insert_tracker_at(session, "BTCUSDT", hour, f"2023-03-12 {hour}:00:00.000000")
+        insert_allocation_tracker(session, session.execute(text("SELECT max(id) FROM trackers")).scalar(), asset_id)
+    asset = AssetRepository(session).get("BTCUSDT")
+
+    assert [t.position for t in asset.recent_trackers(3)] == [13, 12, 11]
+    assert [t.position for t in asset.trackers_between(
+        datetime(2023, 3, 12, 11), datetime(2023, 3, 12, 13)
+    )] == [11, 12]
+
+    asset.deallocate(Tracker("BTCUSDT", datetime(2023, 3, 12, 13), 13))
+    session.commit()
+    assert [t.position for t in asset.recent_trackers(1)] == [12]
+
+
+
+def test_list_range_pages_with_a_keyset_cursor(session):
+    for minute in (0, 1, 1, 2, 3, 4):
+        insert_tracker_at(session, "BTCUSDT", minute, f"2023-03-12 16:0{minute}:00.000000")
+    insert_tracker_at(session, "ETHUSDT", 9, "2023-03-12 16:02:00.000000")
+    repo = TrackerRepository(session)
+    start, end = datetime(2023, 3, 12, 16, 1), datetime(2023, 3, 12, 16, 4)
+
+    first_page = repo.list_range("BTCUSDT", start, end, 2)
+    last = first_page[-1]
+    second_page = repo.list_range("BTCUSDT", start, end, 2, after=(last.datetime_t, last.id))
+
+    assert [t.position for t in first_page] == [1, 1]
+    assert [t.position for t in second_page] == [2, 3]
+
+
+def test_migrates_string_timestamps(session, in_memory_db):
+    session.execute(text(
+        "INSERT INTO trackers (symbol, datetime_t, position) VALUES "
+        '("BTCUSDT", "2023-03-12 16:00:00+00:00", 1),'
+        '("BTCUSDT", "2023-03-12T19:30:00+03:00", -1),'
+        '("BTCUSDT", NULL, 0)'
+    ))
+    session.commit()
+
+    with in_memory_db.begin() as connection:
+        migrations.migrate_tracker_timestamps(connection, batch_size=2)
+
+    trackers = session.query(Tracker).order_by(Tracker.position).all()
+    assert [t.datetime_t for t in trackers] == [
+        datetime(2023, 3, 12, 16, 30), None, datetime(2023, 3, 12, 16)
+    ]
+
+
+def test_migration_creates_the_tracker_and_asset_indexes(in_memory_db):
+    tables = ("trackers", "allocations_tracker", "assets")
+    expected = {table: inspect(in_memory_db).get_indexes(table) for table in tables}
+    with in_memory_db.begin() as connection:
+        for table in tables:
+            for index in expected[table]:
+                connection.execute(text(f"DROP INDEX {index['name']}"))
+
+        migrations.migrate_tracker_timestamps(connection)
+
+    assert {table: inspect(in_memory_db).get_indexes(table) for table in tables} == expected
+    assert all(expected.values())
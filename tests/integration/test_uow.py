@@ -1,14 +1,17 @@
 # pylint: disable=broad-except
 import threading
+from datetime import datetime
 import time
 import traceback
-from typing import List
+from typing import List, Tuple
 import pytest
-from allocation.domain import model
-from allocation.service_layer import unit_of_work
+from allocation.domain import events, model
+from allocation.domain.asset import Asset
+from allocation.domain.tracker import Tracker
+from allocation.service_layer import messagebus, services, unit_of_work
 #from ..random_refs import random_sku, random_batchref, random_orderid
 import uuid
-from sqlalchemy import text
+from sqlalchemy import event, text
 
 
 def random_suffix():
@@ -68,6 +71,23 @@ def test_uow_can_retrieve_a_batch_and_allocate_to_it(session_factory):
     assert batchref == "batch1"
 
 
+def test_events_of_loaded_aggregates_are_published_after_commit(session_factory):
+    session = session_factory()
+    insert_batch(session, "batch1", "HIPSTER-WORKBENCH", 100, None)
+    session.commit()
+    published = []
+    bus = messagebus.MessageBus({events.Allocated: [published.append]})
+
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory, bus=bus)
+    with uow:
+        product = uow.products.get(sku="HIPSTER-WORKBENCH")
+        product.allocate(model.OrderLine("o1", "HIPSTER-WORKBENCH", 10))
+        assert published == []
+        uow.commit()
+
+    assert published == [events.Allocated("o1", "HIPSTER-WORKBENCH", 10, "batch1")]
+
+
 def test_rolls_back_uncommitted_work_by_default(session_factory):
     uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
     with uow:
@@ -93,6 +113,23 @@ def test_rolls_back_on_error(session_factory):
     assert rows == []
 
 
+def test_repositories_share_one_transaction(session_factory):
+    class MyException(Exception):
+        pass
+
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    with pytest.raises(MyException):
+        with uow:
+            uow.assets.add(Asset("BTCUSDT", "binance"))
+            uow.trackers.add(Tracker("BTCUSDT", datetime(2023, 3, 12, 16), 1))
+            uow.session.flush()
+            raise MyException()
+
+    new_session = session_factory()
+    assert list(new_session.execute(text('SELECT * FROM "assets"'))) == []
+    assert list(new_session.execute(text('SELECT * FROM "trackers"'))) == []
+
+
 def try_to_allocate(orderid, sku, exceptions):
     line = model.OrderLine(orderid, sku, 10)
     try:
@@ -129,7 +166,7 @@ def test_concurrent_updates_to_version_are_not_allowed(postgres_session_factory)
     )
     assert version == 2
     [exception] = exceptions
-    assert "could not serialize access due to concurrent update" in str(exception)
+    assert isinstance(exception, unit_of_work.ConcurrencyError)
 
     orders = session.execute(text(
         "SELECT orderid FROM allocations"
@@ -140,4 +177,141 @@ def test_concurrent_updates_to_version_are_not_allowed(postgres_session_factory)
     )
     assert orders.rowcount == 1
     with unit_of_work.SqlAlchemyUnitOfWork() as uow:
-        uow.session.execute(text("select 1"))
\ No newline at end of file
+        uow.session.execute(text("select 1"))
+
+def test_stale_product_version_is_a_concurrency_error(sqlite_file_session_factory):
+    session = sqlite_file_session_factory()
+    insert_batch(session, "batch1", "TWITCHY-SOFA", 100, None, product_version=1)
+    session.commit()
+
+    first = unit_of_work.SqlAlchemyUnitOfWork(sqlite_file_session_factory)
+    second = unit_of_work.SqlAlchemyUnitOfWork(sqlite_file_session_factory)
+    with first, second:
+        first.products.get(sku="TWITCHY-SOFA").allocate(model.OrderLine("o1", "TWITCHY-SOFA", 10))
+        second.products.get(sku="TWITCHY-SOFA").allocate(model.OrderLine("o2", "TWITCHY-SOFA", 10))
+        first.commit()
+        with pytest.raises(unit_of_work.ConcurrencyError):
+            second.commit()
+
+    [[version]] = session.execute(text("SELECT version_number FROM products"))
+    assert version == 2
+
+
+class InterferingUnitOfWork(unit_of_work.SqlAlchemyUnitOfWork):
+    """On its first use, another writer bumps `sku` just before the second product loads."""
+
+    def __init__(self, session_factory, sku):
+        super().__init__(session_factory)
+        self.sku = sku
+        self.uses = 0
+
+    def __enter__(self):
+        super().__enter__()
+        self.uses += 1
+        if self.uses == 1:
+            get, loads = self.products.get, []
+
+            def get_after_another_writer(sku):
+                loads.append(sku)
+                if len(loads) == 2:
+                    other = self.session_factory()
+                    other.execute(
+                        text("UPDATE products SET version_number = version_number + 1 WHERE sku=:sku"),
+                        dict(sku=self.sku),
+                    )
+                    other.commit()
+                    other.close()
+                return get(sku)
+
+            self.products.get = get_after_another_writer
+        return self
+
+
+def test_allocate_many_retries_a_product_changed_between_loads(sqlite_file_session_factory):
+    session = sqlite_file_session_factory()
+    insert_batch(session, "batch-a", "EAGER-LAMP", 100, None, product_version=1)
+    insert_batch(session, "batch-b", "SHY-TABLE", 100, None, product_version=1)
+    session.commit()
+    uow = InterferingUnitOfWork(sqlite_file_session_factory, sku="EAGER-LAMP")
+
+    results = services.allocate_many([("o1", "EAGER-LAMP", 10), ("o2", "SHY-TABLE", 10)], uow)
+
+    assert results == ["batch-a", "batch-b"]
+    assert uow.uses == 2
+    assert get_allocated_batch_ref(session, "o1", "EAGER-LAMP") == "batch-a"
+    [[version]] = session.execute(
+        text("SELECT version_number FROM products WHERE sku='EAGER-LAMP'")
+    )
+    assert version == 3
+
+
+def allocate_from_many_threads(session_factory, threads=20):
+    sku, batch = random_sku(), random_batchref()
+    session = session_factory()
+    insert_batch(session, batch, sku, 100, eta=None, product_version=1)
+    session.commit()
+
+    allocated, exceptions = [], []  # type: Tuple[List[str], List[Exception]]
+
+    def allocate(orderid):
+        try:
+            uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+            allocated.append(services.allocate(orderid, sku, 1, uow))
+        except Exception as e:
+            exceptions.append(e)
+
+    workers = [
+        threading.Thread(target=allocate, args=(random_orderid(i),)) for i in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    # retries are bounded, so a few threads may still give up, but only
+    # with a ConcurrencyError, and every allocation that succeeded is kept
+    assert allocated
+    assert all(isinstance(e, unit_of_work.ConcurrencyError) for e in exceptions)
+    [[version]] = session.execute(
+        text("SELECT version_number FROM products WHERE sku=:sku"), dict(sku=sku)
+    )
+    assert version == 1 + len(allocated)
+    [[lines]] = session.execute(
+        text(
+            "SELECT count(*) FROM allocations"
+            " JOIN order_lines ON allocations.orderline_id = order_lines.id"
+            " WHERE order_lines.sku=:sku"
+        ),
+        dict(sku=sku),
+    )
+    assert lines == len(allocated)
+
+
+def test_parallel_allocations_are_retried_not_lost(sqlite_file_session_factory):
+    allocate_from_many_threads(sqlite_file_session_factory)
+
+
+def test_parallel_allocations_are_retried_not_lost_on_postgres(postgres_session_factory):
+    allocate_from_many_threads(postgres_session_factory, threads=50)
+
+
+def test_reallocate_batch_moves_every_line_in_one_transaction(session_factory):
+    session = session_factory()
+    insert_batch(session, "cancelled", "BIG-TABLE", 100, None)
+    session.execute(
+        text("INSERT INTO batches (reference, sku, _purchased_quantity, eta)"
+        " VALUES ('spare', 'BIG-TABLE', 100, '2023-06-01')"),
+    )
+    session.commit()
+    for i in range(50):
+        services.allocate(f"o{i}", "BIG-TABLE", 2, unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+    commits = []
+    event.listen(session_factory.kw["bind"], "commit", commits.append)
+
+    results = services.reallocate_batch(
+        "cancelled", unit_of_work.SqlAlchemyUnitOfWork(session_factory), cancel=True
+    )
+
+    assert {result for _, result in results} == {"spare"}
+    assert len(commits) == 1
+    assert {get_allocated_batch_ref(session, f"o{i}", "BIG-TABLE") for i in range(50)} == {"spare"}
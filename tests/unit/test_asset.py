@@ -0,0 +1,55 @@
+from datetime import datetime
+from allocation.domain import events
+from allocation.domain.asset import Asset
+from allocation.domain.tracker import Tracker
+
+
+def test_equal_trackers_hash_equal():
+    assert hash(Tracker("BTCUSDT", datetime(2023, 3, 12, 16), 1)) == hash(
+        Tracker("BTCUSDT", datetime(2023, 3, 12, 16), 1)
+    )
+
+
+def test_trackers_for_one_symbol_spread_across_hash_buckets():
+    trackers = [Tracker("BTCUSDT", datetime(2023, 3, 12, 16, i), i % 3 - 1) for i in range(60)]
+    assert len({hash(t) for t in trackers}) == 60
+
+
+def test_assets_from_different_sources_hash_differently():
+    assert hash(Asset("BTCUSDT", "binance")) != hash(Asset("BTCUSDT", "coinbase"))
+
+
+def test_allocating_and_deallocating_trackers():
+    asset = Asset("BTCUSDT", "binance")
+    first = Tracker("BTCUSDT", datetime(2023, 3, 12, 16), 1)
+    second = Tracker("BTCUSDT", datetime(2023, 3, 12, 17), -1)
+    asset.allocate_tracker(first)
+    asset.allocate_tracker(second)
+    asset.allocate_tracker(Tracker("ETHUSDT", datetime(2023, 3, 12, 17), 1))
+
+    asset.deallocate(Tracker("BTCUSDT", datetime(2023, 3, 12, 16), 1))
+
+    assert set(asset._allocations_tracker) == {second}
+
+
+def test_recent_and_time_range_trackers():
+    asset = Asset("BTCUSDT", "binance")
+    trackers = [
+        Tracker("BTCUSDT", datetime(2023, 3, 12, hour), 1, created_at=datetime(2023, 3, 12, hour))
+        for hour in (14, 17, 15, 16)
+    ]
+    for tracker in trackers:
+        asset.allocate_tracker(tracker)
+
+    assert [t.created_at.hour for t in asset.recent_trackers(2)] == [17, 16]
+    assert [t.created_at.hour for t in asset.trackers_between(
+        datetime(2023, 3, 12, 15), datetime(2023, 3, 12, 17)
+    )] == [15, 16]
+
+
+def test_allocating_a_tracker_records_an_event():
+    asset = Asset("BTCUSDT", "binance")
+    asset.allocate_tracker(Tracker("BTCUSDT", datetime(2023, 3, 12, 16), 1))
+    asset.allocate_tracker(Tracker("ETHUSDT", datetime(2023, 3, 12, 16), 1))
+
+    assert asset.events == [events.TrackerAllocated("BTCUSDT", datetime(2023, 3, 12, 16), 1)]
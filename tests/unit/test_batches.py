@@ -1,3 +1,4 @@
+import random
 from datetime import date
 from allocation.domain.model import Batch, OrderLine
 
@@ -56,4 +57,19 @@ def test_deallocate():
 def test_can_only_deallocate_allocated_lines():
     batch, unallocated_line = make_batch_and_line("DECORATIVE-TRINKET", 20, 2)
     batch.deallocate(unallocated_line)
-    assert batch.available_quantity == 20
\ No newline at end of file
+    assert batch.available_quantity == 20
+
+
+def test_allocated_quantity_matches_a_full_recompute():
+    rng = random.Random(42)
+    for _ in range(50):
+        batch = Batch("batch-001", "WOBBLY-STOOL", 200, eta=None)
+        lines = [OrderLine(f"order-{i}", "WOBBLY-STOOL", rng.randint(1, 30)) for i in range(20)]
+        for _ in range(100):
+            line = rng.choice(lines)
+            if rng.random() < 0.6:
+                batch.allocate(line)
+            else:
+                batch.deallocate(line)
+            assert batch.allocated_quantity == sum(l.qty for l in batch._allocations)
+            assert batch.available_quantity == 200 - batch.allocated_quantity
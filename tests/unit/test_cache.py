@@ -0,0 +1,92 @@
+from allocation.service_layer.cache import LRUCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_returns_cached_values_and_counts_hits_and_misses():
+    cache = LRUCache(maxsize=2)
+    assert cache.get("BTCUSDT") is None
+    cache.set("BTCUSDT", 1)
+
+    assert cache.get("BTCUSDT") == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_evicts_the_least_recently_used_entry():
+    cache = LRUCache(maxsize=2)
+    cache.set("BTCUSDT", 1)
+    cache.set("ETHUSDT", 2)
+    cache.get("BTCUSDT")
+
+    cache.set("XRPUSDT", 3)
+
+    assert cache.get("ETHUSDT") is None
+    assert cache.get("BTCUSDT") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_the_ttl():
+    clock = FakeClock()
+    cache = LRUCache(ttl=30, clock=clock)
+    cache.set("BTCUSDT", 1)
+
+    clock.now = 29
+    assert cache.get("BTCUSDT") == 1
+    clock.now = 30
+    assert cache.get("BTCUSDT") is None
+    assert len(cache) == 0
+
+
+def test_invalidate_drops_one_entry():
+    cache = LRUCache()
+    cache.set("BTCUSDT", 1)
+    cache.set("ETHUSDT", 2)
+
+    cache.invalidate("BTCUSDT")
+
+    assert cache.get("BTCUSDT") is None
+    assert cache.get("ETHUSDT") == 2
+
+
+def test_weighted_entries_are_evicted_by_total_weight():
+    cache = LRUCache(maxsize=100)
+    cache.set("small", "a", weight=30)
+    cache.set("medium", "b", weight=50)
+
+    cache.set("large", "c", weight=60)
+
+    assert cache.get("small") is None
+    assert cache.get("medium") is None
+    assert cache.get("large") == "c"
+    assert cache.stats()["weight"] == 60
+
+    cache.set("huge", "d", weight=101)
+    assert len(cache) == 0
+
+
+def test_values_read_before_an_invalidation_are_not_cached():
+    cache = LRUCache()
+    generation = cache.generation("BTCUSDT")
+    cache.invalidate("BTCUSDT")
+
+    assert cache.set("BTCUSDT", "stale", generation=generation) is False
+    assert cache.get("BTCUSDT") is None
+
+    generation = cache.generation("BTCUSDT")
+    assert cache.set("BTCUSDT", "fresh", generation=generation) is True
+    assert cache.get("BTCUSDT") == "fresh"
+
+
+def test_clear_invalidates_every_generation():
+    cache = LRUCache()
+    generation = cache.generation("BTCUSDT")
+    cache.clear()
+
+    assert cache.set("BTCUSDT", "stale", generation=generation) is False
@@ -0,0 +1,28 @@
+import io
+from datetime import datetime
+
+from allocation.domain.tracker import TrackerRecord
+from allocation.entrypoints.ingest_trackers import read_csv, read_ndjson
+
+
+def test_reads_ndjson_records():
+    stream = io.StringIO(
+        '{"symbol": "BTCUSDT", "datetime_t": "2023-03-12 16:00:00", "position": 1}\n'
+        "\n"
+        '{"symbol": "ETHUSDT", "datetime_t": "2023-03-12T17:00:00+03:00", "position": -1,'
+        ' "created_at": "2023-03-12T17:00:05"}\n'
+    )
+
+    assert list(read_ndjson(stream)) == [
+        TrackerRecord("BTCUSDT", datetime(2023, 3, 12, 16), 1),
+        TrackerRecord("ETHUSDT", datetime(2023, 3, 12, 14), -1, datetime(2023, 3, 12, 17, 0, 5)),
+    ]
+
+
+def test_reads_csv_records():
+    stream = io.StringIO(
+        "symbol,datetime_t,position\n"
+        "BTCUSDT,2023-03-12 16:00:00,1\n"
+    )
+
+    assert list(read_csv(stream)) == [TrackerRecord("BTCUSDT", datetime(2023, 3, 12, 16), 1)]
@@ -0,0 +1,39 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from allocation.domain import events
+from allocation.service_layer.messagebus import MessageBus
+
+
+def test_runs_every_handler_for_the_event_type():
+    seen = []
+    bus = MessageBus({events.OutOfStock: [seen.append, lambda e: seen.append(e.sku)]})
+
+    bus.publish([events.OutOfStock("LAMP"), events.Allocated("o1", "LAMP", 1, "b1")])
+
+    assert seen == [events.OutOfStock("LAMP"), "LAMP"]
+
+
+def test_a_failing_handler_does_not_stop_the_others():
+    seen = []
+
+    def broken(event):
+        raise RuntimeError("mail server down")
+
+    bus = MessageBus({events.OutOfStock: [broken, seen.append]})
+    bus.publish([events.OutOfStock("LAMP")])
+
+    assert seen == [events.OutOfStock("LAMP")]
+
+
+def test_handlers_run_off_the_publishing_thread():
+    threads = []
+    bus = MessageBus(
+        {events.OutOfStock: [lambda e: threads.append(threading.current_thread())]},
+        ThreadPoolExecutor(max_workers=1),
+    )
+
+    bus.publish([events.OutOfStock("LAMP")])
+    bus.shutdown()
+
+    assert threads and threads[0] is not threading.current_thread()
@@ -0,0 +1,77 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from allocation.service_layer.model_registry import ModelRegistry
+
+
+def write_artifact(path, value, mtime):
+    path.write_bytes(pickle.dumps(value))
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def loads():
+    return []
+
+
+@pytest.fixture
+def registry(loads):
+    def counting_loader(filepath):
+        loads.append(filepath)
+        with open(filepath, "rb") as f:
+            return pickle.load(f)
+
+    return ModelRegistry(uow_factory=None, loader=counting_loader, max_bytes=10 ** 6)
+
+
+def test_artifacts_are_deserialized_once(tmp_path, registry, loads):
+    path = tmp_path / "model.pkl"
+    write_artifact(path, {"weights": [1, 2, 3]}, mtime=1000)
+
+    for _ in range(3):
+        assert registry.load(str(path)) == {"weights": [1, 2, 3]}
+
+    assert loads == [str(path)]
+    assert registry.stats()["hits"] == 2
+    assert registry.stats()["misses"] == 1
+
+
+def test_a_rewritten_artifact_is_loaded_again(tmp_path, registry, loads):
+    path = tmp_path / "model.pkl"
+    write_artifact(path, "v1", mtime=1000)
+    registry.load(str(path))
+
+    write_artifact(path, "v2", mtime=2000)
+
+    assert registry.load(str(path)) == "v2"
+    assert len(loads) == 2
+    # the old version does not linger in the cache
+    assert registry.stats()["size"] == 1
+
+
+def test_artifacts_are_evicted_by_size_on_disk(tmp_path, loads):
+    registry = ModelRegistry(uow_factory=None, loader=lambda f: loads.append(f) or f, max_bytes=150)
+    first, second = tmp_path / "first.pkl", tmp_path / "second.pkl"
+    first.write_bytes(b"x" * 100)
+    second.write_bytes(b"x" * 100)
+
+    registry.load(str(first))
+    registry.load(str(second))
+    registry.load(str(first))
+
+    assert loads == [str(first), str(second), str(first)]
+
+
+def test_npy_weights_are_mapped_read_only(tmp_path):
+    path = tmp_path / "weights.npy"
+    np.save(path, np.arange(12, dtype=np.float32).reshape(3, 4))
+
+    weights = ModelRegistry(uow_factory=None).load(str(path))
+
+    assert isinstance(weights, np.memmap)
+    assert weights[2, 3] == 11
+    with pytest.raises(ValueError):
+        weights[0, 0] = 1
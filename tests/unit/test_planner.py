@@ -0,0 +1,165 @@
+import copy
+import random
+from datetime import date, timedelta
+
+from allocation.domain.model import Batch, LineRecord, OrderLine, OutOfStock, Product
+from allocation.domain.planner import plan_allocations
+
+today = date.today()
+
+
+def allocate_one_by_one(lines, products):
+    products = {p.sku: p for p in copy.deepcopy(products)}
+    results = []
+    for line in lines:
+        try:
+            results.append(products[line.sku].allocate(line))
+        except OutOfStock as e:
+            results.append(e)
+        except KeyError:
+            results.append(None)
+    return results
+
+
+def comparable(results):
+    return [str(r) if isinstance(r, OutOfStock) else r for r in results]
+
+
+def test_plans_warehouse_stock_first_then_by_eta():
+    product = Product(
+        "LAMP",
+        [
+            Batch("late", "LAMP", 10, eta=today + timedelta(days=5)),
+            Batch("warehouse", "LAMP", 10, eta=None),
+            Batch("soon", "LAMP", 10, eta=today),
+        ],
+    )
+    lines = [OrderLine(f"o{i}", "LAMP", 6) for i in range(4)]
+
+    plan = plan_allocations(lines, [product])
+
+    assert plan[:3] == ["warehouse", "soon", "late"]
+    assert isinstance(plan[3], OutOfStock)
+
+
+def test_leaves_the_products_untouched():
+    batch = Batch("batch1", "LAMP", 10, eta=None)
+    product = Product("LAMP", [batch])
+
+    plan_allocations([OrderLine("o1", "LAMP", 4)], [product])
+
+    assert batch.available_quantity == 10
+    assert product.version_number == 0
+
+
+def test_lines_for_unknown_skus_are_not_planned():
+    product = Product("LAMP", [Batch("batch1", "LAMP", 10, eta=None)])
+
+    plan = plan_allocations([OrderLine("o1", "SOFA", 1), OrderLine("o2", "LAMP", 1)], [product])
+
+    assert plan == [None, "batch1"]
+
+
+def test_repeated_lines_use_stock_like_product_allocate():
+    existing = OrderLine("o1", "LAMP", 4)
+    first = Batch("first", "LAMP", 8, eta=None)
+    first.allocate(existing)
+    product = Product("LAMP", [first, Batch("second", "LAMP", 8, eta=today)])
+    lines = [existing, existing, OrderLine("o2", "LAMP", 4), existing, OrderLine("o3", "LAMP", 4)]
+
+    assert plan_allocations(lines, [product]) == allocate_one_by_one(lines, [product])
+
+
+def test_matches_allocating_one_line_at_a_time():
+    rng = random.Random(17)
+    products = []
+    for s in range(30):
+        sku = f"SKU-{s}"
+        batches = [
+            Batch(
+                f"{sku}-batch-{b}",
+                sku,
+                rng.randint(0, 60),
+                eta=rng.choice([None, today + timedelta(days=rng.randint(0, 5))]),
+            )
+            for b in range(rng.randint(0, 12))
+        ]
+        products.append(Product(sku, batches))
+    lines = [
+        OrderLine(f"order-{rng.randint(0, 400)}", f"SKU-{rng.randint(0, 32)}", rng.randint(1, 9))
+        for _ in range(3000)
+    ]
+    # some lines are already allocated before planning
+    for line in rng.sample(lines, 100):
+        for product in products:
+            if product.sku == line.sku and product.batches:
+                rng.choice(product.batches).allocate(line)
+
+    expected = allocate_one_by_one(lines, products)
+    plan = plan_allocations(lines, products)
+
+    assert comparable(plan) == comparable(expected)
+
+
+def test_plans_compact_line_records_like_order_lines():
+    existing = OrderLine("o1", "LAMP", 4)
+    batch = Batch("batch1", "LAMP", 8, eta=None)
+    batch.allocate(existing)
+    product = Product("LAMP", [batch])
+    lines = [("o1", "LAMP", 4), ("o2", "LAMP", 4), ("o3", "LAMP", 4)]
+
+    records = plan_allocations([LineRecord(*line) for line in lines], [product])
+
+    assert not hasattr(LineRecord("o1", "LAMP", 4), "__dict__")
+    assert comparable(records) == comparable(
+        plan_allocations([OrderLine(*line) for line in lines], [product])
+    )
+
+
+
+def random_products(rng, skus, batches_per_sku):
+    return [
+        Product(
+            f"SKU-{s}",
+            [
+                Batch(
+                    f"SKU-{s}-batch-{b}", f"SKU-{s}", rng.randint(0, 60),
+                    eta=today + timedelta(days=b),
+                )
+                for b in range(batches_per_sku(s))
+            ],
+        )
+        for s in range(skus)
+    ]
+
+
+def test_matches_allocating_one_line_at_a_time_with_one_hot_sku():
+    rng = random.Random(3)
+    products = random_products(rng, 12, lambda s: 4)
+    lines = [
+        OrderLine(
+            f"order-{rng.randint(0, 50)}",
+            "SKU-0" if rng.random() < 0.8 else f"SKU-{rng.randint(1, 11)}",
+            rng.randint(1, 9),
+        )
+        for _ in range(2000)
+    ]
+
+    expected = allocate_one_by_one(lines, products)
+    plan = plan_allocations(lines, products)
+
+    assert comparable(plan) == comparable(expected)
+
+
+def test_matches_allocating_one_line_at_a_time_with_one_wide_sku():
+    rng = random.Random(5)
+    products = random_products(rng, 10, lambda s: 300 if s == 0 else 3)
+    lines = [
+        OrderLine(f"order-{rng.randint(0, 50)}", f"SKU-{rng.randint(0, 9)}", rng.randint(1, 40))
+        for _ in range(2000)
+    ]
+
+    expected = allocate_one_by_one(lines, products)
+    plan = plan_allocations(lines, products)
+
+    assert comparable(plan) == comparable(expected)
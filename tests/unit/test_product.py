@@ -1,6 +1,7 @@
 from datetime import date, timedelta
 import pytest
-from allocation.domain.model import Product, OrderLine, Batch, OutOfStock
+from allocation.domain import events
+from allocation.domain.model import Product, OrderLine, Batch, OutOfStock, NotAllocated
 
 today = date.today()
 tomorrow = today + timedelta(days=1)
@@ -58,4 +59,175 @@ def test_increments_version_number():
     )
     product.version_number = 7
     product.allocate(line)
-    assert product.version_number == 8
\ No newline at end of file
+    assert product.version_number == 8
+
+def test_skips_batches_without_enough_stock():
+    nearly_empty = Batch("nearly-empty", "TALL-LAMP", 5, eta=None)
+    earliest = Batch("earliest", "TALL-LAMP", 100, eta=today)
+    latest = Batch("latest", "TALL-LAMP", 100, eta=later)
+    product = Product(sku="TALL-LAMP", batches=[latest, earliest, nearly_empty])
+
+    assert product.allocate(OrderLine("o1", "TALL-LAMP", 10)) == "earliest"
+    assert product.allocate(OrderLine("o2", "TALL-LAMP", 5)) == "nearly-empty"
+    assert product.allocate(OrderLine("o3", "TALL-LAMP", 95)) == "latest"
+
+
+def test_picks_up_batches_appended_after_allocating():
+    product = Product(sku="SHINY-KETTLE", batches=[Batch("b1", "SHINY-KETTLE", 10, eta=later)])
+    product.allocate(OrderLine("o1", "SHINY-KETTLE", 5))
+
+    product.batches.append(Batch("b2", "SHINY-KETTLE", 10, eta=None))
+
+    assert product.allocate(OrderLine("o2", "SHINY-KETTLE", 5)) == "b2"
+
+
+def test_sees_lines_allocated_straight_to_a_batch():
+    early = Batch("early", "FLUFFY-RUG", 10, eta=today)
+    late = Batch("late", "FLUFFY-RUG", 10, eta=tomorrow)
+    product = Product(sku="FLUFFY-RUG", batches=[early, late])
+    product.allocate(OrderLine("o1", "FLUFFY-RUG", 1))
+
+    early.allocate(OrderLine("o2", "FLUFFY-RUG", 9))
+
+    assert product.allocate(OrderLine("o3", "FLUFFY-RUG", 1)) == "late"
+
+
+def test_sees_lines_deallocated_straight_from_a_batch():
+    early = Batch("early", "DUSTY-LAMP", 10, eta=today)
+    late = Batch("late", "DUSTY-LAMP", 10, eta=tomorrow)
+    product = Product(sku="DUSTY-LAMP", batches=[early, late])
+    line = OrderLine("o1", "DUSTY-LAMP", 10)
+    product.allocate(line)
+
+    early.deallocate(line)
+
+    assert product.allocate(OrderLine("o2", "DUSTY-LAMP", 5)) == "early"
+
+
+def test_sees_stock_added_to_a_batch_outside_allocation():
+    early = Batch("early", "TALL-SHELF", 10, eta=today)
+    late = Batch("late", "TALL-SHELF", 10, eta=tomorrow)
+    product = Product(sku="TALL-SHELF", batches=[early, late])
+    product.allocate(OrderLine("o1", "TALL-SHELF", 10))
+
+    early.change_purchased_quantity(20)
+
+    assert product.allocate(OrderLine("o2", "TALL-SHELF", 5)) == "early"
+
+
+def test_allocates_in_the_same_order_as_sorting_the_batches():
+    batches = [
+        Batch(f"b{i}", "RANDOM-VASE", qty, eta)
+        for i, (qty, eta) in enumerate(
+            [(3, later), (5, None), (2, today), (7, tomorrow), (4, None), (1, today)]
+        )
+    ]
+    product = Product(sku="RANDOM-VASE", batches=batches)
+    for i, qty in enumerate([2, 3, 1, 4, 2, 5, 1, 1]):
+        line = OrderLine(f"o{i}", "RANDOM-VASE", qty)
+        expected = next((b for b in sorted(batches) if b.can_allocate(line)), None)
+        if expected is None:
+            with pytest.raises(OutOfStock):
+                product.allocate(line)
+        else:
+            assert product.allocate(line) == expected.reference
+
+
+def test_deallocate_frees_the_stock_for_the_next_line():
+    batch = Batch("b1", "DUSTY-CHAIR", 10, eta=None)
+    product = Product(sku="DUSTY-CHAIR", batches=[batch])
+    line = OrderLine("o1", "DUSTY-CHAIR", 10)
+    product.allocate(line)
+
+    assert product.deallocate(line) == "b1"
+
+    assert batch.available_quantity == 10
+    assert product.version_number == 2
+    assert product.allocate(OrderLine("o2", "DUSTY-CHAIR", 10)) == "b1"
+
+
+def test_cannot_deallocate_a_line_that_is_not_allocated():
+    product = Product(sku="DUSTY-CHAIR", batches=[Batch("b1", "DUSTY-CHAIR", 10, eta=None)])
+
+    with pytest.raises(NotAllocated, match="o1"):
+        product.deallocate(OrderLine("o1", "DUSTY-CHAIR", 1))
+
+
+def test_reallocate_moves_lines_off_a_slipped_batch():
+    slipped = Batch("slipped", "SLOW-BOAT", 10, eta=today)
+    other = Batch("other", "SLOW-BOAT", 10, eta=tomorrow)
+    product = Product(sku="SLOW-BOAT", batches=[slipped, other])
+    for orderid, qty in (("o1", 4), ("o2", 4)):
+        product.allocate(OrderLine(orderid, "SLOW-BOAT", qty))
+    version = product.version_number
+
+    results = product.reallocate("slipped", eta=later)
+
+    assert results == [
+        (OrderLine("o1", "SLOW-BOAT", 4), "other"),
+        (OrderLine("o2", "SLOW-BOAT", 4), "other"),
+    ]
+    assert slipped.available_quantity == 10
+    assert other.available_quantity == 2
+    assert product.version_number == version + 1
+    assert product.allocate(OrderLine("o3", "SLOW-BOAT", 3)) == "slipped"
+
+
+def test_reallocate_keeps_lines_on_a_changed_batch_that_is_still_the_best_fit():
+    changed = Batch("changed", "SLOW-BOAT", 10, eta=today)
+    product = Product(sku="SLOW-BOAT", batches=[changed, Batch("full", "SLOW-BOAT", 0, eta=None)])
+    product.allocate(OrderLine("o1", "SLOW-BOAT", 4))
+
+    assert product.reallocate("changed", eta=later) == [(OrderLine("o1", "SLOW-BOAT", 4), "changed")]
+    assert changed.eta == later
+
+
+def test_reallocating_a_cancelled_batch_leaves_lines_that_fit_nowhere():
+    cancelled = Batch("cancelled", "SLOW-BOAT", 10, eta=None)
+    other = Batch("other", "SLOW-BOAT", 5, eta=later)
+    product = Product(sku="SLOW-BOAT", batches=[cancelled, other])
+    big, small = OrderLine("o1", "SLOW-BOAT", 6), OrderLine("o2", "SLOW-BOAT", 4)
+    product.allocate(big)
+    product.allocate(small)
+
+    [(_, big_result), (_, small_result)] = product.reallocate("cancelled", cancel=True)
+
+    assert isinstance(big_result, OutOfStock)
+    assert small_result == "other"
+    assert cancelled.available_quantity == 0
+    assert other.available_quantity == 1
+
+
+
+def test_records_an_allocated_event():
+    product = Product(sku="RETRO-CLOCK", batches=[Batch("b1", "RETRO-CLOCK", 100, eta=None)])
+    product.allocate(OrderLine("o1", "RETRO-CLOCK", 10))
+    assert product.events == [events.Allocated("o1", "RETRO-CLOCK", 10, "b1")]
+
+
+def test_records_out_of_stock_event_and_still_raises():
+    product = Product(sku="SMALL-FORK", batches=[Batch("b1", "SMALL-FORK", 10, eta=None)])
+    product.allocate(OrderLine("o1", "SMALL-FORK", 10))
+
+    with pytest.raises(OutOfStock):
+        product.allocate(OrderLine("o2", "SMALL-FORK", 1))
+
+    assert product.events[-1] == events.OutOfStock("SMALL-FORK")
+
+
+def test_reallocate_records_where_every_line_went():
+    cancelled = Batch("cancelled", "SLOW-BOAT", 10, eta=None)
+    other = Batch("other", "SLOW-BOAT", 5, eta=later)
+    product = Product(sku="SLOW-BOAT", batches=[cancelled, other])
+    product.allocate(OrderLine("o1", "SLOW-BOAT", 6))
+    product.allocate(OrderLine("o2", "SLOW-BOAT", 4))
+    product.events.clear()
+
+    product.reallocate("cancelled", cancel=True)
+
+    assert product.events == [
+        events.Deallocated("o1", "SLOW-BOAT", 6, "cancelled"),
+        events.Deallocated("o2", "SLOW-BOAT", 4, "cancelled"),
+        events.OutOfStock("SLOW-BOAT"),
+        events.Allocated("o2", "SLOW-BOAT", 4, "other"),
+    ]
@@ -1,31 +1,135 @@
+from datetime import date, datetime
 import pytest
 from allocation.adapters import repository
-from allocation.service_layer import services, unit_of_work
+from allocation.adapters.aimodel_repository import AbstractAIModelRepository
+from allocation.adapters.asset_repository import AbstractAssetRepository
+from allocation.adapters.tracker_repository import AbstractTrackerRepository
+from allocation.domain import model
+from allocation.domain.aimodel import AIModel
+from allocation.domain.tracker import Tracker, TrackerRecord
+from allocation.domain import events
+from allocation.service_layer import messagebus, services, unit_of_work
 
 
 class FakeRepository(repository.AbstractRepository):
     def __init__(self, products):
+        super().__init__()
         self._products = set(products)
 
-    def add(self, product):
+    def _add(self, product):
         self._products.add(product)
 
-    def get(self, sku):
+    def _get(self, sku):
         return next((p for p in self._products if p.sku == sku), None)
 
+    def _get_by_batchref(self, batchref):
+        return next(
+            (p for p in self._products for b in p.batches if b.reference == batchref), None
+        )
+
+
+class FakeAssetRepository(AbstractAssetRepository):
+    def __init__(self, assets):
+        super().__init__()
+        self._assets = set(assets)
+
+    def _add(self, asset):
+        self._assets.add(asset)
+
+    def _get(self, symbol):
+        return next((a for a in self._assets if a.symbol == symbol), None)
+
+    def symbol_ids(self):
+        return {asset.symbol: i for i, asset in enumerate(self._assets)}
+
+    def list(self):
+        return list(self._assets)
+
+
+class FakeTrackerRepository(AbstractTrackerRepository):
+    def __init__(self, trackers):
+        self._trackers = list(trackers)
+
+    def add(self, tracker):
+        self._trackers.append(tracker)
+
+    def get(self, symbol):
+        return next((t for t in self._trackers if t.symbol == symbol), None)
+
+    def add_many(self, rows, asset_ids):
+        self._trackers.extend(
+            Tracker(row["symbol"], row["datetime_t"], row["position"], row["created_at"])
+            for row in rows
+        )
+
+    def list_range(self, symbol, start, end, limit, after=None):
+        matching = sorted(
+            (t for t in self._trackers if t.symbol == symbol and start <= t.datetime_t < end),
+            key=lambda t: (t.datetime_t, t.id),
+        )
+        return [t for t in matching if after is None or (t.datetime_t, t.id) > after][:limit]
+
+    def get_latest(self, symbol):
+        return self.get_latest_many([symbol]).get(symbol)
+
+    def get_latest_many(self, symbols):
+        latest = {}
+        for tracker in sorted(self._trackers, key=lambda t: t.created_at):
+            if tracker.symbol in symbols:
+                latest[tracker.symbol] = tracker
+        return latest
+
+
+class FakeAIModelRepository(AbstractAIModelRepository):
+    def __init__(self, aimodels):
+        self._aimodels = list(aimodels)
+
+    def add(self, aimodel):
+        self._aimodels.append(aimodel)
+
+    def get(self, symbol):
+        return next((m for m in self._aimodels if m.symbol == symbol), None)
+
+    def get_best(self, symbol, ai_type):
+        candidates = [
+            m for m in self._aimodels
+            if (m.symbol, m.ai_type) == (symbol, ai_type) and m.accuracy_score is not None
+        ]
+        return max(candidates, key=lambda m: m.accuracy_score, default=None)
+
+
+class FakeBus(messagebus.MessageBus):
+    def __init__(self):
+        super().__init__(handlers={})
+        self.published = []
+
+    def publish(self, published):
+        self.published.extend(published)
+
 
 class FakeUnitOfWork(unit_of_work.AbstractUnitOfWork):
     def __init__(self):
         self.products = FakeRepository([])
+        self.assets = FakeAssetRepository([])
+        self.trackers = FakeTrackerRepository([])
+        self.aimodels = FakeAIModelRepository([])
         self.committed = False
+        self.commits = 0
+        self.bus = FakeBus()
 
-    def commit(self):
+    def _commit(self):
         self.committed = True
+        self.commits += 1
 
     def rollback(self):
         pass
 
 
+@pytest.fixture(autouse=True)
+def empty_position_cache():
+    services.position_cache.clear()
+
+
 def test_add_batch_for_new_product():
     uow = FakeUnitOfWork()
     services.add_batch("b1", "CRUNCHY-ARMCHAIR", 100, None, uow)
@@ -41,13 +145,11 @@ def test_add_batch_for_existing_product():
 
 
 
-"""
 def test_allocate_returns_allocation():
     uow = FakeUnitOfWork()
     services.add_batch("batch1", "COMPLICATED-LAMP", 100, None, uow)
     result = services.allocate("o1", "COMPLICATED-LAMP", 10, uow)
     assert result == "batch1"
-"""
 
 
 
@@ -63,4 +165,346 @@ def test_allocate_commits():
     uow = FakeUnitOfWork()
     services.add_batch("b1", "OMINOUS-MIRROR", 100, None, uow)
     services.allocate("o1", "OMINOUS-MIRROR", 10, uow)
-    assert uow.committed
\ No newline at end of file
+    assert uow.committed
+
+
+def test_allocate_publishes_allocated_after_commit():
+    uow = FakeUnitOfWork()
+    services.add_batch("b1", "OMINOUS-MIRROR", 100, None, uow)
+    services.allocate("o1", "OMINOUS-MIRROR", 10, uow)
+
+    assert uow.bus.published == [events.Allocated("o1", "OMINOUS-MIRROR", 10, "b1")]
+
+
+def test_out_of_stock_is_published_and_raised():
+    uow = FakeUnitOfWork()
+    services.add_batch("b1", "SMALL-FORK", 10, None, uow)
+
+    with pytest.raises(model.OutOfStock):
+        services.allocate("o1", "SMALL-FORK", 11, uow)
+
+    assert uow.bus.published == [events.OutOfStock("SMALL-FORK")]
+
+
+def test_events_are_not_published_when_the_commit_fails():
+    uow = ConflictingUnitOfWork(conflicts=0)
+    services.add_batch("b1", "BUSY-BENCH", 100, None, uow)
+    uow.conflicts = 1
+
+    services.allocate("o1", "BUSY-BENCH", 10, uow)
+
+    # the failed attempt's product was discarded with its events
+    assert uow.bus.published == [events.Allocated("o1", "BUSY-BENCH", 10, "b1")]
+
+
+def test_deallocate_returns_the_batch_and_commits():
+    uow = FakeUnitOfWork()
+    services.add_batch("b1", "OMINOUS-MIRROR", 100, None, uow)
+    services.allocate("o1", "OMINOUS-MIRROR", 10, uow)
+    uow.committed = False
+
+    assert services.deallocate("o1", "OMINOUS-MIRROR", 10, uow) == "b1"
+    assert uow.committed
+    assert uow.products.get("OMINOUS-MIRROR").batches[0].available_quantity == 100
+
+
+def test_deallocate_errors_for_lines_that_are_not_allocated():
+    uow = FakeUnitOfWork()
+    services.add_batch("b1", "OMINOUS-MIRROR", 100, None, uow)
+
+    with pytest.raises(services.InvalidSku):
+        services.deallocate("o1", "NONEXISTENT", 10, uow)
+    with pytest.raises(model.NotAllocated):
+        services.deallocate("o1", "OMINOUS-MIRROR", 10, uow)
+
+
+def test_reallocate_batch_rebalances_every_line_in_one_commit():
+    uow = FakeUnitOfWork()
+    services.add_batch("cancelled", "BRASS-LAMP", 20, None, uow)
+    services.add_batch("other", "BRASS-LAMP", 10, date(2023, 6, 1), uow)
+    for i in range(3):
+        services.allocate(f"o{i}", "BRASS-LAMP", 5, uow)
+    uow.commits = 0
+
+    results = services.reallocate_batch("cancelled", uow, cancel=True)
+
+    assert [(line.orderid, str(result)) for line, result in results] == [
+        ("o0", "other"),
+        ("o1", "other"),
+        ("o2", "Out of stock for sku BRASS-LAMP"),
+    ]
+    assert uow.commits == 1
+
+
+def test_reallocate_batch_errors_for_unknown_batches():
+    with pytest.raises(services.InvalidBatchref, match="nonexistent"):
+        services.reallocate_batch("nonexistent", FakeUnitOfWork())
+
+
+def test_allocate_many_returns_a_result_per_line_in_order():
+    uow = FakeUnitOfWork()
+    services.add_batch("lamp-batch", "BRASS-LAMP", 10, None, uow)
+    services.add_batch("rug-batch", "WOOL-RUG", 100, None, uow)
+
+    results = services.allocate_many(
+        [
+            ("o1", "BRASS-LAMP", 6),
+            ("o2", "WOOL-RUG", 50),
+            ("o3", "BRASS-LAMP", 6),
+            ("o4", "NONEXISTENTSKU", 1),
+            ("o5", "BRASS-LAMP", 4),
+        ],
+        uow,
+    )
+
+    assert results[0] == "lamp-batch"
+    assert results[1] == "rug-batch"
+    assert isinstance(results[2], model.OutOfStock)
+    assert isinstance(results[3], services.InvalidSku)
+    assert results[4] == "lamp-batch"
+    assert uow.committed
+
+
+def test_allocate_many_reports_lines_that_are_already_allocated():
+    uow = FakeUnitOfWork()
+    services.add_batch("b1", "BRASS-LAMP", 10, None, uow)
+    services.allocate("o1", "BRASS-LAMP", 2, uow)
+
+    results = services.allocate_many(
+        [("o1", "BRASS-LAMP", 2), ("o2", "BRASS-LAMP", 3), ("o2", "BRASS-LAMP", 3)], uow
+    )
+
+    assert isinstance(results[0], model.AlreadyAllocated)
+    assert results[1] == "b1"
+    assert isinstance(results[2], model.AlreadyAllocated)
+    assert uow.products.get("BRASS-LAMP").batches[0].available_quantity == 5
+
+
+def test_allocate_many_loads_each_product_once():
+    uow = FakeUnitOfWork()
+    services.add_batch("b1", "SQUEAKY-CHAIR", 100, None, uow)
+    loaded = []
+    get = uow.products.get
+    uow.products.get = lambda sku: loaded.append(sku) or get(sku)
+
+    services.allocate_many([(f"o{i}", "SQUEAKY-CHAIR", 1) for i in range(10)], uow)
+
+    assert loaded == ["SQUEAKY-CHAIR"]
+
+
+
+def test_plan_allocations_is_a_dry_run_of_allocate_many():
+    uow = FakeUnitOfWork()
+    services.add_batch("b1", "LAMP", 10, None, uow)
+    uow.committed = False
+    lines = [("o1", "LAMP", 6), ("o2", "SOFA", 1), ("o3", "LAMP", 6)]
+
+    results = services.plan_allocations(lines, uow)
+
+    assert results[0] == "b1"
+    assert isinstance(results[1], services.InvalidSku)
+    assert isinstance(results[2], model.OutOfStock)
+    assert uow.products.get("LAMP").batches[0].available_quantity == 10
+    assert uow.committed is False
+
+
+def test_plan_allocations_reports_lines_that_are_already_allocated_like_allocate_many():
+    lines = [
+        ("o1", "LAMP", 2), ("o2", "LAMP", 3), ("o2", "LAMP", 3), ("o3", "LAMP", 9),
+        ("o3", "LAMP", 9), ("o4", "SOFA", 1), ("o5", "LAMP", 4),
+    ]
+    uows = []
+    for _ in range(2):
+        uow = FakeUnitOfWork()
+        services.add_batch("b1", "LAMP", 10, None, uow)
+        services.allocate("o1", "LAMP", 2, uow)
+        uows.append(uow)
+
+    planned = services.plan_allocations(lines, uows[0])
+    allocated = services.allocate_many(lines, uows[1])
+
+    assert [str(r) if isinstance(r, Exception) else r for r in planned] == [
+        str(r) if isinstance(r, Exception) else r for r in allocated
+    ]
+    assert [type(r) for r in planned] == [type(r) for r in allocated]
+    assert isinstance(planned[2], model.AlreadyAllocated)
+
+
+def test_add_asset():
+    uow = FakeUnitOfWork()
+    services.add_asset("BTCUSDT", "binance", uow)
+    assert uow.assets.get("BTCUSDT") is not None
+    assert uow.committed
+
+
+def test_allocate_tracker_returns_symbol_and_position():
+    uow = FakeUnitOfWork()
+    services.add_asset("BTCUSDT", "binance", uow)
+    result = services.allocate_tracker("BTCUSDT", datetime(2023, 3, 12, 16), 1, uow)
+    assert result == ("BTCUSDT", 1)
+    assert uow.committed
+    assert uow.bus.published == [events.TrackerAllocated("BTCUSDT", datetime(2023, 3, 12, 16), 1)]
+
+
+def test_allocate_tracker_errors_for_invalid_symbol():
+    uow = FakeUnitOfWork()
+    services.add_asset("BTCUSDT", "binance", uow)
+
+    with pytest.raises(services.InvalidSymbol, match="Invalid symbol NONEXISTENT"):
+        services.allocate_tracker("NONEXISTENT", datetime(2023, 3, 12, 16), 1, uow)
+
+
+
+def test_allocate_tracker_only_loads_the_matching_asset():
+    uow = FakeUnitOfWork()
+    services.add_asset("BTCUSDT", "binance", uow)
+    uow.assets.list = lambda: pytest.fail("allocate_tracker should not list every asset")
+
+    assert services.allocate_tracker("BTCUSDT", datetime(2023, 3, 12, 16), -1, uow) == ("BTCUSDT", -1)
+
+
+
+def test_get_position_returns_the_latest_tracker():
+    uow = FakeUnitOfWork()
+    uow.trackers.add(Tracker("BTCUSDT", datetime(2023, 3, 12, 16), 1, created_at=datetime(2023, 3, 12, 16)))
+    uow.trackers.add(Tracker("BTCUSDT", datetime(2023, 3, 12, 17), -1, created_at=datetime(2023, 3, 12, 17)))
+
+    assert services.get_position("BTCUSDT", uow) == ("BTCUSDT", -1, datetime(2023, 3, 12, 17))
+
+
+def test_get_position_errors_for_symbol_without_trackers():
+    uow = FakeUnitOfWork()
+
+    with pytest.raises(services.InvalidSymbol, match="No position for symbol NONEXISTENT"):
+        services.get_position("NONEXISTENT", uow)
+
+
+
+def test_get_position_is_served_from_cache_until_a_tracker_is_allocated():
+    uow = FakeUnitOfWork()
+    services.add_asset("BTCUSDT", "binance", uow)
+    uow.trackers.add(Tracker("BTCUSDT", datetime(2023, 3, 12, 16), 1, created_at=datetime(2023, 3, 12, 16)))
+    services.get_position("BTCUSDT", uow)
+
+    uow.trackers.add(Tracker("BTCUSDT", datetime(2023, 3, 12, 17), -1, created_at=datetime(2023, 3, 12, 17)))
+    assert services.get_position("BTCUSDT", uow) == ("BTCUSDT", 1, datetime(2023, 3, 12, 16))
+
+    services.allocate_tracker("BTCUSDT", datetime(2023, 3, 12, 18), 0, uow)
+    uow.trackers.add(Tracker("BTCUSDT", datetime(2023, 3, 12, 18), 0))
+    assert services.get_position("BTCUSDT", uow) == ("BTCUSDT", 0, datetime(2023, 3, 12, 18))
+
+
+
+def test_a_position_read_while_a_tracker_is_allocated_is_not_cached():
+    uow = FakeUnitOfWork()
+    services.add_asset("BTCUSDT", "binance", uow)
+    uow.trackers.add(Tracker("BTCUSDT", datetime(2023, 3, 12, 16), 1, created_at=datetime(2023, 3, 12, 16)))
+    get_latest = uow.trackers.get_latest
+
+    def read_then_another_request_allocates(symbol):
+        read = get_latest(symbol)
+        # what allocate_tracker does once it has committed
+        uow.trackers.add(Tracker("BTCUSDT", datetime(2023, 3, 12, 17), -1, created_at=datetime(2023, 3, 12, 17)))
+        services.position_cache.invalidate(symbol)
+        return read
+
+    uow.trackers.get_latest = read_then_another_request_allocates
+    assert services.get_position("BTCUSDT", uow)[1] == 1
+
+    uow.trackers.get_latest = get_latest
+    assert services.get_position("BTCUSDT", uow)[1] == -1
+
+
+def test_ingest_trackers_commits_once_per_chunk_and_skips_unknown_symbols():
+    uow = FakeUnitOfWork()
+    services.add_asset("BTCUSDT", "binance", uow)
+    uow.commits = 0
+    records = (
+        TrackerRecord("BTCUSDT" if i % 5 else "NONEXISTENT", datetime(2023, 3, 12, 16, i), 1)
+        for i in range(25)
+    )
+
+    inserted, skipped = services.ingest_trackers(records, uow, chunk_size=10)
+
+    assert (inserted, skipped) == (20, 5)
+    assert uow.commits == 3
+    assert len(uow.trackers.get_latest_many(["BTCUSDT", "NONEXISTENT"])) == 1
+
+
+
+def test_ingesting_history_leaves_the_latest_position_alone():
+    uow = FakeUnitOfWork()
+    services.add_asset("BTCUSDT", "binance", uow)
+    now = datetime.now()
+    uow.trackers.add(Tracker("BTCUSDT", now, 1, created_at=now))
+    backfill = [
+        TrackerRecord("BTCUSDT", datetime(2025, 1, 1), -1),
+        TrackerRecord("BTCUSDT", datetime(2025, 1, 2), 0),
+    ]
+
+    services.ingest_trackers(backfill, uow)
+
+    assert services.get_position("BTCUSDT", uow) == ("BTCUSDT", 1, now)
+
+
+def test_list_trackers_pages_through_a_time_range():
+    uow = FakeUnitOfWork()
+    for minute in range(10):
+        tracker = Tracker("BTCUSDT", datetime(2023, 3, 12, 16, minute), minute)
+        tracker.id = minute
+        uow.trackers.add(tracker)
+
+    trackers = services.list_trackers(
+        "BTCUSDT", datetime(2023, 3, 12, 16, 2), datetime(2023, 3, 12, 16, 9), uow,
+        limit=5, page_size=2,
+    )
+
+    assert [t["position"] for t in trackers] == [2, 3, 4, 5, 6]
+
+
+class ConflictingUnitOfWork(FakeUnitOfWork):
+    def __init__(self, conflicts):
+        super().__init__()
+        self.conflicts = conflicts
+
+    def _commit(self):
+        if self.conflicts:
+            self.conflicts -= 1
+            raise unit_of_work.ConcurrencyError("version_number changed")
+        super()._commit()
+
+
+def test_allocate_retries_concurrent_updates():
+    uow = ConflictingUnitOfWork(conflicts=0)
+    services.add_batch("b1", "BUSY-BENCH", 100, None, uow)
+    uow.conflicts = 2
+
+    assert services.allocate("o1", "BUSY-BENCH", 10, uow) == "b1"
+    assert uow.committed
+
+
+def test_retry_on_conflict_gives_up_after_the_last_attempt():
+    calls, delays = [], []
+
+    def always_conflicts():
+        calls.append(1)
+        raise unit_of_work.ConcurrencyError()
+
+    with pytest.raises(unit_of_work.ConcurrencyError):
+        services.retry_on_conflict(
+            always_conflicts, attempts=4, base_delay=0.1, max_delay=0.3, sleep=delays.append
+        )
+
+    assert len(calls) == 4
+    assert len(delays) == 3
+    assert all(0 <= delay <= 0.3 for delay in delays)
+
+
+def test_get_best_model_picks_the_most_accurate_of_its_type():
+    uow = FakeUnitOfWork()
+    for name, ai_type, score in [("a", "xgboost", 54.3), ("b", "xgboost", 61.0), ("c", "lstm", 70.2)]:
+        uow.aimodels.add(AIModel("BTCUSDT", "binance", 12, name, ai_type, "btc", score))
+
+    assert services.get_best_model("BTCUSDT", "xgboost", uow).model_name == "b"
+    with pytest.raises(services.InvalidModel, match="No xgboost model for symbol ETHUSDT"):
+        services.get_best_model("ETHUSDT", "xgboost", uow)